@@ -0,0 +1,103 @@
+"""
+Domain blocklist benchmark.
+Measures per-message cost of extracting links and matching them against blocklists of growing size,
+and cost of extracting links from adversarial messages, that could make link pattern backtrack.
+
+Run from repository root:
+ python -m benchmarks.blocklist_scan --sizes 1000 10000 100000
+"""
+
+
+import os
+import time
+import random
+import string
+import timeit
+import argparse
+import tempfile
+import discord
+from types import SimpleNamespace
+from modules.SpamATon.blocklist import BlocklistFile, extract_domains
+
+
+TLDS: list[str] = [".com", ".net", ".ru", ".xyz", ".gift", ".co.uk"]
+
+
+def make_domain(rng: random.Random) -> str:
+    """
+    Makes random domain
+    """
+
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 14))) + rng.choice(TLDS)
+
+
+def make_message(rng: random.Random, blocked: str | None) -> SimpleNamespace:
+    """
+    Makes discord message stand-in with a few links in content and an embed
+    :param rng: random generator
+    :param blocked: blocked domain to put into the message
+    :return: message
+    """
+
+    embed = discord.Embed(
+        title="Free nitro",
+        description=f"Claim at https://{make_domain(rng)}/gift",
+        url=f"https://{make_domain(rng)}")
+    content = f"hey check https://www.{make_domain(rng)}/a?b=c and {make_domain(rng)} lol"
+    if blocked is not None:
+        content += f" https://cdn.{blocked}/claim"
+    return SimpleNamespace(content=content, embeds=[embed])
+
+
+# messages, that look almost like links; 4000 characters is the longest message
+ADVERSARIAL: dict[str, str] = {
+    "no user info": "a!" * 2000,
+    "no scheme": "a+" * 2000,
+    "no user info, dots": "a.!" * 1333,
+    "no host": "https://user@" * 300,
+    "long user info": "x" * 3900 + "@scam.com"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Domain blocklist benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="blocklist sizes")
+    parser.add_argument("--messages", type=int, default=1000, help="messages per measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'domains':>8} {'load, ms':>9} {'extract, us':>12} {'match, us':>10} {'blocked':>8}")
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        domains = [make_domain(rng) for _ in range(size)]
+
+        # blocklist file
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as file:
+            file.write("# benchmark blocklist\n" + "\n".join(domains))
+        blocklist = BlocklistFile(file.name)
+        start = time.perf_counter()
+        blocklist.reload()
+        load = time.perf_counter() - start
+        os.remove(file.name)
+
+        # every 10th message has a blocked link
+        messages = [make_message(rng, rng.choice(domains) if i % 10 == 0 else None) for i in range(args.messages)]
+        extracted = [extract_domains(x) for x in messages]
+
+        extract = min(timeit.repeat(lambda: [extract_domains(x) for x in messages], number=1, repeat=5))
+        match = min(timeit.repeat(lambda: [blocklist.match(x) for x in extracted], number=1, repeat=5))
+        blocked = sum(blocklist.match(x) is not None for x in extracted)
+
+        print(
+            f"{size:>8} {load * 1000:>9.1f} {extract * 1e6 / len(messages):>12.2f} "
+            f"{match * 1e6 / len(messages):>10.2f} {blocked:>8}")
+
+    print()
+    print(f"{'adversarial message':<20} {'extract, us':>12}")
+    for name, content in ADVERSARIAL.items():
+        message = SimpleNamespace(content=content, embeds=[])
+        extract = min(timeit.repeat(lambda: extract_domains(message), number=10, repeat=5)) / 10
+        print(f"{name:<20} {extract * 1e6:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
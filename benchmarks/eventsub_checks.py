@@ -0,0 +1,158 @@
+"""
+EventSub webhook checks.
+Sends signed, unsigned, tampered, replayed and stale requests to TwitchNotifs EventSub server,
+and checks responses and dispatched events. Exits with status 1 if any check fails.
+
+Run from repository root:
+ python -m benchmarks.eventsub_checks
+"""
+
+
+import sys
+import hmac
+import json
+import uuid
+import asyncio
+import hashlib
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from datetime import datetime, timezone, timedelta
+from modules.TwitchNotifs.eventsub import EventSubServer
+
+
+SECRET: str = "benchmark-secret"
+
+
+def make_headers(
+        body: bytes,
+        message_type: str,
+        message_id: str | None = None,
+        timestamp: datetime | None = None,
+        secret: str | None = SECRET) -> dict[str, str]:
+    """
+    Makes EventSub request headers, the way twitch does
+    :param body: request body
+    :param message_type: 'notification', 'webhook_callback_verification' or 'revocation'
+    :param message_id: message id; random if not given
+    :param timestamp: message timestamp; current time if not given
+    :param secret: secret to sign with; None to leave the request unsigned
+    :return: headers
+    """
+
+    message_id = message_id if message_id is not None else str(uuid.uuid4())
+    timestamp = timestamp if timestamp is not None else datetime.now(timezone.utc)
+
+    # twitch sends nanoseconds
+    headers = {
+        EventSubServer.MESSAGE_ID: message_id,
+        EventSubServer.MESSAGE_TIMESTAMP: timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f000Z"),
+        EventSubServer.MESSAGE_TYPE: message_type}
+    if secret is not None:
+        message = headers[EventSubServer.MESSAGE_ID].encode("utf-8")
+        message += headers[EventSubServer.MESSAGE_TIMESTAMP].encode("utf-8") + body
+        headers[EventSubServer.MESSAGE_SIGNATURE] = (
+                "sha256=" + hmac.new(secret.encode("utf-8"), message, hashlib.sha256).hexdigest())
+    return headers
+
+
+def make_body(subscription_type: str, **fields) -> bytes:
+    """
+    Makes EventSub request body
+    :param subscription_type: subscription type (ex. 'stream.online')
+    :param fields: additional top level fields (ex. 'event', 'challenge')
+    :return: encoded body
+    """
+
+    subscription = {"id": str(uuid.uuid4()), "type": subscription_type, "version": "1", "status": "enabled"}
+    return json.dumps({"subscription": subscription} | fields).encode("utf-8")
+
+
+async def run_checks() -> list[tuple[str, bool, str]]:
+    """
+    Runs all checks against EventSub server
+    :return: list of (check name, passed, details)
+    """
+
+    events = []
+
+    async def callback(subscription_type: str, event: dict) -> None:
+        events.append((subscription_type, event))
+
+    server = EventSubServer(SECRET, callback, "127.0.0.1", 0)
+    app = web.Application()
+    app.router.add_post(server.path, server.handle)
+
+    results = []
+    async with TestClient(TestServer(app)) as client:
+        async def send(body: bytes, headers: dict[str, str]) -> tuple[int, str]:
+            async with client.post(server.path, data=body, headers=headers) as resp:
+                text = await resp.text()
+            await asyncio.sleep(0)  # let dispatched callbacks run
+            return resp.status, text
+
+        def check(name: str, passed: bool, details: str) -> None:
+            results.append((name, passed, details))
+
+        # subscription creation challenge is echoed back
+        body = make_body("stream.online", challenge="pogchamp-kappa-360noscope")
+        status, text = await send(body, make_headers(body, "webhook_callback_verification"))
+        check("challenge", status == 200 and text == "pogchamp-kappa-360noscope", f"status {status}, body '{text}'")
+
+        # signed notification is dispatched
+        event = {"broadcaster_user_id": "1337", "broadcaster_user_login": "cool_user", "type": "live"}
+        body = make_body("stream.online", event=event)
+        headers = make_headers(body, "notification")
+        status, _ = await send(body, headers)
+        check("signed notification", status == 204 and events == [("stream.online", event)],
+              f"status {status}, {len(events)} events")
+
+        # resent notification is accepted, but not dispatched again
+        status, _ = await send(body, headers)
+        check("replayed message id", status == 204 and len(events) == 1, f"status {status}, {len(events)} events")
+
+        # unsigned notification is rejected
+        body = make_body("stream.online", event=event)
+        status, _ = await send(body, make_headers(body, "notification", secret=None))
+        check("unsigned notification", status == 403 and len(events) == 1, f"status {status}, {len(events)} events")
+
+        # notification signed with other secret is rejected
+        status, _ = await send(body, make_headers(body, "notification", secret="other-secret"))
+        check("wrong secret", status == 403 and len(events) == 1, f"status {status}, {len(events)} events")
+
+        # body changed after signing is rejected
+        headers = make_headers(body, "notification")
+        tampered = body.replace(b"1337", b"1338")
+        status, _ = await send(tampered, headers)
+        check("tampered body", status == 403 and len(events) == 1, f"status {status}, {len(events)} events")
+
+        # properly signed, but old message is rejected
+        stale = datetime.now(timezone.utc) - EventSubServer.MESSAGE_MAX_AGE - timedelta(minutes=1)
+        status, _ = await send(body, make_headers(body, "notification", timestamp=stale))
+        check("stale timestamp", status == 403 and len(events) == 1, f"status {status}, {len(events)} events")
+
+        # stale challenge is rejected as well
+        body = make_body("stream.online", challenge="old-challenge")
+        status, _ = await send(body, make_headers(body, "webhook_callback_verification", timestamp=stale))
+        check("stale challenge", status == 403, f"status {status}")
+
+        # revocation is acknowledged, and not dispatched
+        body = make_body("stream.offline")
+        status, _ = await send(body, make_headers(body, "revocation"))
+        check("revocation", status == 204 and len(events) == 1, f"status {status}, {len(events)} events")
+
+    return results
+
+
+def main():
+    results = asyncio.run(run_checks())
+
+    print(f"{'check':<24} {'result':<6} details")
+    for name, passed, details in results:
+        print(f"{name:<24} {'ok' if passed else 'FAIL':<6} {details}")
+
+    if not all(passed for _, passed, _ in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
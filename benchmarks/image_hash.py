@@ -0,0 +1,168 @@
+"""
+Image hashing benchmark.
+Measures throughput of SpamATon perceptual hashing on synthetic images, per thread count,
+hamming distance between hashes of original and edited images,
+and checks that images downloaded from local server in chunks hash the same as in-memory ones.
+
+Run from repository root:
+ python -m benchmarks.image_hash --threads 1 2 4
+"""
+
+
+import io
+import os
+import time
+import random
+import asyncio
+import argparse
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from types import SimpleNamespace
+from PIL import Image, ImageDraw
+from concurrent.futures import ThreadPoolExecutor
+from modules.SpamATon.images import dhash, ImageHasher
+from modules.SpamATon.fingerprints import hamming_distance
+
+
+def make_image(size: tuple[int, int], seed: int) -> Image.Image:
+    """
+    Makes synthetic image, that looks somewhat like a scam banner
+    :param size: image width and height
+    :param seed: random seed
+    :return: image
+    """
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(20):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        w, h = rng.randrange(size[0] // 2), rng.randrange(size[1] // 2)
+        draw.rectangle((x, y, x + w, y + h), fill=tuple(rng.randrange(256) for _ in range(3)))
+    draw.text((size[0] // 10, size[1] // 2), "FREE NITRO", fill=(255, 255, 255))
+    return image
+
+
+def rng_bytes(seed: int, amount: int) -> bytes:
+    """
+    :return: random bytes; used to make images, that don't compress
+    """
+
+    return random.Random(seed).randbytes(amount)
+
+
+def encode(image: Image.Image, image_format: str, **kwargs) -> bytes:
+    """
+    Encodes image
+    :param image: image
+    :param image_format: format name (ex. 'JPEG')
+    :return: encoded image
+    """
+
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **kwargs)
+    return buffer.getvalue()
+
+
+def throughput(images: list[bytes], threads: int) -> float:
+    """
+    Hashes images in thread pool
+    :return: images per second
+    """
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        start = time.perf_counter()
+        list(executor.map(dhash, images))
+        return len(images) / (time.perf_counter() - start)
+
+
+async def download(images: dict[str, bytes], max_size: int) -> dict[str, tuple[int | None, float]]:
+    """
+    Serves images from local server with chunked transfer encoding, and hashes them through 'ImageHasher'
+    :param images: "name": encoded image
+    :param max_size: largest downloaded image
+    :return: "name": (hash, seconds)
+    """
+
+    async def handler(request: web.Request) -> web.StreamResponse:
+        data = images[request.match_info["name"]]
+        resp = web.StreamResponse(headers={"Content-Type": "image/png"})
+        resp.enable_chunked_encoding()
+        await resp.prepare(request)
+        for i in range(0, len(data), 16384):
+            await resp.write(data[i:i + 16384])
+        await resp.write_eof()
+        return resp
+
+    app = web.Application()
+    app.router.add_get("/{name}", handler)
+
+    results = {}
+    hasher = ImageHasher(max_size=max_size)
+    async with TestServer(app) as server:
+        for name, data in images.items():
+            attachment = SimpleNamespace(url=str(server.make_url(f"/{name}")), size=len(data), content_type="image/png")
+            start = time.perf_counter()
+            value = await hasher.hash_attachment(attachment)
+            results[name] = value, time.perf_counter() - start
+    await hasher.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image hashing benchmark")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4], help="thread counts")
+    parser.add_argument("--images", type=int, default=200, help="images per measurement")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[512, 1920], help="image widths")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"CPU cores: {os.cpu_count()}")
+    print(f"{'format':<6} {'width':>6} {'KiB':>6} {'threads':>8} {'images/s':>10} {'per thread':>11}")
+    for width in args.sizes:
+        size = (width, width * 9 // 16)
+        for image_format in ("JPEG", "PNG"):
+            images = [encode(make_image(size, args.seed + i), image_format) for i in range(8)]
+            images = (images * (args.images // len(images) + 1))[:args.images]
+            kib = sum(len(x) for x in images) / len(images) / 1024
+
+            for threads in args.threads:
+                rate = throughput(images, threads)
+                print(f"{image_format:<6} {width:>6} {kib:>6.0f} {threads:>8} {rate:>10.0f} {rate / threads:>11.0f}")
+
+    # hashes should survive edits, that spam bots make to avoid exact matching
+    original = make_image((1280, 720), args.seed)
+    base = dhash(encode(original, "PNG"))
+    edits = {
+        "JPEG, quality 40": encode(original, "JPEG", quality=40),
+        "resized to 50%": encode(original.resize((640, 360)), "PNG"),
+        "cropped 2%": encode(original.crop((12, 7, 1267, 712)), "PNG"),
+        "brightness +10": encode(original.point(lambda x: min(x + 10, 255)), "PNG"),
+        "different image": encode(make_image((1280, 720), args.seed + 1), "PNG")}
+
+    print()
+    print(f"{'edit':<20} {'distance':>8}")
+    for name, data in edits.items():
+        print(f"{name:<20} {hamming_distance(base, dhash(data)):>8}")
+
+    # noisy PNG doesn't compress, and is downloaded in many chunks
+    noise = Image.frombytes("RGB", original.size, rng_bytes(args.seed, original.width * original.height * 3))
+    images = {
+        "small": encode(original, "PNG"),
+        "large": encode(Image.blend(original, noise, 0.3), "PNG")}
+    results = asyncio.run(download(images, max_size=max(len(x) for x in images.values())))
+
+    print()
+    print(f"{'download':<10} {'KiB':>6} {'ms':>8} {'matches':>8}")
+    failed = False
+    for name, data in images.items():
+        value, seconds = results[name]
+        matches = value is not None and value == dhash(data)
+        failed |= not matches
+        print(f"{name:<10} {len(data) / 1024:>6.0f} {seconds * 1000:>8.1f} {str(matches):>8}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,419 @@
+"""
+Local stand-in for YouTube Data API, YouTube RSS feeds, Twitch Helix and Twitch OAuth.
+Used by benchmarks, so notification modules can be measured without API keys and network.
+
+Base urls (for fetchers):
+ - YouTube API - '{base}/youtube/v3'
+ - YouTube feeds - '{base}/feeds/videos.xml'
+ - Twitch Helix - '{base}/helix'
+ - Twitch OAuth - '{base}/oauth2'
+
+Control endpoints:
+ - POST '/_control/setup' - {"youtube_channels": int, "twitch_users": int, "error_rate": float,
+                              "quota_error_rate": float, "latency": float, "seed": int}
+ - POST '/_control/advance' - {"upload_rate": float, "live_rate": float}; publishes new videos and changes streams
+ - GET '/_control/stats' - request counters
+"""
+
+
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from aiohttp import web
+from datetime import datetime, timezone
+from email.utils import formatdate
+
+
+class MockAPI:
+    """
+    Mock API state and request handlers
+    """
+
+    # twitch rate limit bucket
+    RATELIMIT_LIMIT: int = 800
+    RATELIMIT_PERIOD: float = 60
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Resets all state
+        """
+
+        self.rng: random.Random = random.Random(0)
+
+        # injected failures and delays
+        self.error_rate: float = 0
+        self.quota_error_rate: float = 0
+        self.latency: float = 0
+
+        # "channel_id": ["video_id", ...] (newest first)
+        self.channels: dict[str, list[str]] = dict()
+
+        # "video_id": {"channel_id": ..., "published": ..., "is_stream": ..., "duration": ...}
+        self.videos: dict[str, dict] = dict()
+
+        # "user_id": "login"
+        self.users: dict[str, str] = dict()
+
+        # "user_id": "stream_id"
+        self.streams: dict[str, str] = dict()
+
+        # twitch rate limit bucket
+        self.ratelimit_tokens: float = self.RATELIMIT_LIMIT
+        self.ratelimit_updated_at: float = time.monotonic()
+
+        # metrics
+        # "endpoint": count
+        self.requests: dict[str, int] = dict()
+        # "status": count
+        self.statuses: dict[str, int] = dict()
+
+        self._counter: int = 0
+
+    def make_app(self) -> web.Application:
+        """
+        Creates web application
+        """
+
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_post("/_control/setup", self.handle_setup)
+        app.router.add_post("/_control/advance", self.handle_advance)
+        app.router.add_get("/_control/stats", self.handle_stats)
+        app.router.add_get("/youtube/v3/channels", self.handle_channels)
+        app.router.add_get("/youtube/v3/playlistItems", self.handle_playlist_items)
+        app.router.add_get("/youtube/v3/videos", self.handle_videos)
+        app.router.add_get("/feeds/videos.xml", self.handle_feed)
+        app.router.add_post("/oauth2/token", self.handle_token)
+        app.router.add_get("/helix/streams", self.handle_streams)
+        app.router.add_get("/helix/users", self.handle_users)
+        app.router.add_get("/helix/games", self.handle_games)
+        return app
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        """
+        Counts requests, and injects delays and errors
+        """
+
+        if request.path.startswith("/_control"):
+            return await handler(request)
+
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        if self.rng.random() < self.error_rate:
+            response = web.json_response({"error": {"code": 500, "message": "Injected error"}}, status=500)
+        elif request.path.startswith("/youtube") and self.rng.random() < self.quota_error_rate:
+            response = web.json_response(
+                {"error": {"code": 403, "errors": [{"reason": "quotaExceeded"}]}}, status=403)
+        else:
+            response = await handler(request)
+
+        self.requests[request.path] = self.requests.get(request.path, 0) + 1
+        self.statuses[str(response.status)] = self.statuses.get(str(response.status), 0) + 1
+        return response
+
+    # ---- helpers ----
+
+    def next_id(self, prefix: str) -> str:
+        """
+        Returns unique id
+        """
+
+        self._counter += 1
+        return f"{prefix}{self._counter:09d}"
+
+    def add_video(self, channel_id: str) -> None:
+        """
+        Publishes new video on a channel
+        """
+
+        video_id = self.next_id("v")
+        is_stream = self.rng.random() < 0.1
+        self.videos[video_id] = {
+            "channel_id": channel_id,
+            "published": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "is_stream": is_stream,
+            "duration": "P0D" if is_stream else f"PT{self.rng.randint(0, 20)}M{self.rng.randint(0, 59)}S"}
+        self.channels[channel_id].insert(0, video_id)
+        del self.channels[channel_id][15:]
+
+    @staticmethod
+    def conditional_response(request: web.Request, body: str, content_type: str) -> web.Response:
+        """
+        Makes response with ETag, or 304 if client already has it
+        """
+
+        etag = f'"{hashlib.md5(body.encode("utf-8")).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=body, content_type=content_type, headers={"ETag": etag})
+
+    def youtube_response(self, request: web.Request, body: dict) -> web.Response:
+        """
+        Makes YouTube API response. ETag is part of the body, like in real API
+        """
+
+        etag = hashlib.md5(json.dumps(body).encode("utf-8")).hexdigest()
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+
+        body["etag"] = etag
+        return web.json_response(body, headers={"ETag": etag})
+
+    @staticmethod
+    def thumbnails(video_id: str) -> dict:
+        return {
+            "default": {"url": f"https://i.ytimg.com/vi/{video_id}/default.jpg", "width": 120, "height": 90},
+            "medium": {"url": f"https://i.ytimg.com/vi/{video_id}/mqdefault.jpg", "width": 320, "height": 180},
+            "high": {"url": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg", "width": 480, "height": 360}}
+
+    def take_ratelimit_token(self) -> dict[str, str] | None:
+        """
+        Takes a point from twitch rate limit bucket
+        :return: rate limit headers, or None if bucket is empty
+        """
+
+        now = time.monotonic()
+        self.ratelimit_tokens = min(
+            self.RATELIMIT_LIMIT,
+            self.ratelimit_tokens + (now - self.ratelimit_updated_at) * self.RATELIMIT_LIMIT / self.RATELIMIT_PERIOD)
+        self.ratelimit_updated_at = now
+
+        if self.ratelimit_tokens < 1:
+            return None
+        self.ratelimit_tokens -= 1
+
+        return {
+            "Ratelimit-Limit": str(self.RATELIMIT_LIMIT),
+            "Ratelimit-Remaining": str(int(self.ratelimit_tokens)),
+            "Ratelimit-Reset": str(int(time.time() + self.RATELIMIT_PERIOD))}
+
+    def helix_response(self, data: list[dict], pagination: dict | None = None) -> web.Response:
+        """
+        Makes rate limited helix response
+        """
+
+        headers = self.take_ratelimit_token()
+        if headers is None:
+            return web.json_response({"error": "Too Many Requests", "status": 429}, status=429, headers={
+                "Ratelimit-Limit": str(self.RATELIMIT_LIMIT),
+                "Ratelimit-Remaining": "0",
+                "Ratelimit-Reset": str(int(time.time()) + 1)})
+
+        body = {"data": data}
+        if pagination is not None:
+            body["pagination"] = pagination
+        return web.json_response(body, headers=headers)
+
+    # ---- control ----
+
+    async def handle_setup(self, request: web.Request) -> web.Response:
+        config = await request.json()
+
+        self.reset()
+        self.rng.seed(config.get("seed", 0))
+        self.error_rate = config.get("error_rate", 0)
+        self.quota_error_rate = config.get("quota_error_rate", 0)
+        self.latency = config.get("latency", 0)
+
+        for i in range(config.get("youtube_channels", 0)):
+            channel_id = f"UC{i:022d}"
+            self.channels[channel_id] = []
+            for _ in range(5):
+                self.add_video(channel_id)
+
+        for i in range(config.get("twitch_users", 0)):
+            self.users[str(100000 + i)] = f"bench_user_{i}"
+
+        return web.json_response({
+            "youtube_channels": list(self.channels.keys()),
+            "twitch_users": list(self.users.values())})
+
+    async def handle_advance(self, request: web.Request) -> web.Response:
+        config = await request.json()
+
+        uploads = 0
+        for channel_id in self.channels:
+            if self.rng.random() < config.get("upload_rate", 0):
+                self.add_video(channel_id)
+                uploads += 1
+
+        changes = 0
+        for user_id in self.users:
+            if self.rng.random() < config.get("live_rate", 0):
+                if user_id in self.streams:
+                    del self.streams[user_id]
+                else:
+                    self.streams[user_id] = self.next_id("s")
+                changes += 1
+
+        return web.json_response({"uploads": uploads, "stream_changes": changes})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "requests": sum(self.requests.values()),
+            "endpoints": self.requests,
+            "statuses": self.statuses})
+
+    # ---- youtube ----
+
+    async def handle_channels(self, request: web.Request) -> web.Response:
+        items = []
+        for channel_id in request.query.get("id", "").split(","):
+            if channel_id not in self.channels:
+                continue
+            items.append({
+                "kind": "youtube#channel",
+                "id": channel_id,
+                "snippet": {
+                    "title": f"Channel {channel_id[-6:]}",
+                    "description": "Benchmark channel",
+                    "customUrl": f"@bench{channel_id[-6:]}",
+                    "publishedAt": "2017-05-06T16:08:53Z",
+                    "thumbnails": self.thumbnails(channel_id),
+                    "country": "US"},
+                "contentDetails": {"relatedPlaylists": {"likes": "", "uploads": f"UU{channel_id[2:]}"}}})
+        return self.youtube_response(request, {"kind": "youtube#channelListResponse", "items": items})
+
+    async def handle_playlist_items(self, request: web.Request) -> web.Response:
+        channel_id = f"UC{request.query.get('playlistId', '')[2:]}"
+        if channel_id not in self.channels:
+            return web.json_response({"error": {"code": 404, "message": "Playlist not found"}}, status=404)
+
+        amount = int(request.query.get("maxResults", 5))
+        items = []
+        for position, video_id in enumerate(self.channels[channel_id][:amount]):
+            video = self.videos[video_id]
+            items.append({
+                "kind": "youtube#playlistItem",
+                "snippet": {
+                    "publishedAt": video["published"],
+                    "channelId": channel_id,
+                    "title": f"Video {video_id}",
+                    "description": "Benchmark video",
+                    "thumbnails": self.thumbnails(video_id),
+                    "position": position,
+                    "resourceId": {"kind": "youtube#video", "videoId": video_id}},
+                "contentDetails": {"videoId": video_id, "videoPublishedAt": video["published"]}})
+        return self.youtube_response(request, {"kind": "youtube#playlistItemListResponse", "items": items})
+
+    async def handle_videos(self, request: web.Request) -> web.Response:
+        items = []
+        for video_id in request.query.get("id", "").split(","):
+            if video_id not in self.videos:
+                continue
+            video = self.videos[video_id]
+            item = {
+                "kind": "youtube#video",
+                "id": video_id,
+                "snippet": {"liveBroadcastContent": "live" if video["is_stream"] else "none"},
+                "contentDetails": {"duration": video["duration"]}}
+            if video["is_stream"]:
+                item["liveStreamingDetails"] = {"actualStartTime": video["published"]}
+            items.append(item)
+        return self.youtube_response(request, {"kind": "youtube#videoListResponse", "items": items})
+
+    async def handle_feed(self, request: web.Request) -> web.Response:
+        channel_id = request.query.get("channel_id", "")
+        if channel_id not in self.channels:
+            return web.Response(status=404)
+
+        entries = []
+        for video_id in self.channels[channel_id]:
+            video = self.videos[video_id]
+            entries.append(
+                f"<entry>"
+                f"<yt:videoId>{video_id}</yt:videoId>"
+                f"<yt:channelId>{channel_id}</yt:channelId>"
+                f"<title>Video {video_id}</title>"
+                f"<published>{video['published']}</published>"
+                f"<media:group><media:description>Benchmark video</media:description></media:group>"
+                f"</entry>")
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" '
+            'xmlns:media="http://search.yahoo.com/mrss/" xmlns="http://www.w3.org/2005/Atom">'
+            f"<title>Channel {channel_id[-6:]}</title>" + "".join(entries) + "</feed>")
+
+        response = self.conditional_response(request, body, "application/atom+xml")
+        response.headers["Last-Modified"] = formatdate(usegmt=True)
+        return response
+
+    # ---- twitch ----
+
+    async def handle_token(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "access_token": self.next_id("token"),
+            "expires_in": 5000000,
+            "token_type": "bearer"})
+
+    def make_stream(self, user_id: str) -> dict:
+        login = self.users[user_id]
+        return {
+            "id": self.streams[user_id],
+            "user_id": user_id,
+            "user_login": login,
+            "user_name": login,
+            "game_id": str(int(user_id) % 20),
+            "game_name": f"Game {int(user_id) % 20}",
+            "type": "live",
+            "title": f"Stream {self.streams[user_id]}",
+            "viewer_count": 100,
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "language": "en",
+            "thumbnail_url": f"https://static-cdn.jtvnw.net/previews-ttv/live_user_{login}-{{width}}x{{height}}.jpg",
+            "tags": [],
+            "is_mature": False}
+
+    async def handle_streams(self, request: web.Request) -> web.Response:
+        logins = {login: user_id for user_id, login in self.users.items()}
+        user_ids = request.query.getall("user_id", []) + [
+            logins[x] for x in request.query.getall("user_login", []) if x in logins]
+
+        live = [x for x in user_ids if x in self.streams]
+        first = int(request.query.get("first", 20))
+        offset = int(request.query.get("after", 0))
+
+        page = live[offset:offset + first]
+        pagination = {"cursor": str(offset + first)} if offset + first < len(live) else {}
+        return self.helix_response([self.make_stream(x) for x in page], pagination)
+
+    async def handle_users(self, request: web.Request) -> web.Response:
+        logins = set(request.query.getall("login", []))
+        return self.helix_response([
+            {"id": user_id, "login": login, "display_name": login}
+            for user_id, login in self.users.items() if login in logins])
+
+    async def handle_games(self, request: web.Request) -> web.Response:
+        return self.helix_response([
+            {"id": x, "name": f"Game {x}", "box_art_url": f"https://static-cdn.jtvnw.net/ttv-boxart/{x}-{{width}}x{{height}}.jpg"}
+            for x in request.query.getall("id", [])])
+
+
+def run(host: str = "127.0.0.1", port: int = 8089) -> None:
+    """
+    Runs mock API server
+    :param host: host to listen on
+    :param port: port to listen on
+    """
+
+    web.run_app(MockAPI().make_app(), host=host, port=port, print=None, access_log=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock YouTube and Twitch API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+
+    run(args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
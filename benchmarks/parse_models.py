@@ -0,0 +1,113 @@
+"""
+Response parsing micro-benchmark.
+Measures per-item cost of decoding recorded API payloads and building fetcher models.
+
+Run from repository root:
+ python -m benchmarks.parse_models
+"""
+
+
+import json
+import asyncio
+import timeit
+import argparse
+import tracemalloc
+from source.utils import json_loads
+from modules.YouTubeNotifs.fetcher import Fetcher, Channel, Media
+from modules.TwitchNotifs.fetcher import Stream
+
+
+PAYLOADS_DIRECTORY = "benchmarks/payloads"
+
+
+def load_payload(name: str) -> bytes:
+    """
+    Loads recorded payload
+    :param name: payload name
+    :return: raw payload
+    """
+
+    with open(f"{PAYLOADS_DIRECTORY}/{name}.json", "rb") as file:
+        return file.read()
+
+
+def report(name: str, function, items: int, repeat: int) -> None:
+    """
+    Times function, and prints per-item cost
+    :param name: name of the measurement
+    :param function: function to time
+    :param items: amount of items processed by one call
+    :param repeat: amount of calls
+    """
+
+    best = min(timeit.repeat(function, number=repeat, repeat=5)) / repeat
+    print(f"{name:<40} {best * 1e6 / items:>10.2f} us/item")
+
+
+def report_memory(name: str, function, items: int) -> None:
+    """
+    Measures memory held by function result, and prints per-item size
+    :param name: name of the measurement
+    :param function: function, that makes objects
+    :param items: amount of items made by one call
+    """
+
+    tracemalloc.start()
+    result = function()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    print(f"{name:<40} {size / items:>10.0f} bytes/item")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response parsing micro-benchmark")
+    parser.add_argument("--repeat", type=int, default=200, help="calls per measurement")
+    args = parser.parse_args()
+
+    print(f"JSON decoder: {json_loads.__module__}")
+
+    # youtube
+    playlist_raw = load_payload("youtube_playlist_items")
+    channels_raw = load_payload("youtube_channels")
+    playlist = json_loads(playlist_raw)
+    items = [x["snippet"] for x in playlist["items"]]
+
+    # channel info is cached, so it's not requested
+    channel_response = json_loads(channels_raw)["items"][0]
+    Fetcher.channels[channel_response["id"]] = asyncio.run(Channel.from_response(channel_response))
+
+    loop = asyncio.new_event_loop()
+
+    async def _build_media():
+        return [await Media.from_response(x) for x in items]
+
+    def build_media():
+        return loop.run_until_complete(_build_media())
+
+    def build_media_thumbnails():
+        return [video.thumbnails.high.url for video in build_media()]
+
+    report("youtube playlistItems decode (json)", lambda: json.loads(playlist_raw), len(items), args.repeat)
+    report("youtube playlistItems decode", lambda: json_loads(playlist_raw), len(items), args.repeat)
+    report("youtube Media build", build_media, len(items), args.repeat)
+    report("youtube Media build + high thumbnail", build_media_thumbnails, len(items), args.repeat)
+    report_memory("youtube Media", build_media, len(items))
+
+    loop.close()
+
+    # twitch
+    streams_raw = load_payload("twitch_streams")
+    streams = json_loads(streams_raw)["data"]
+
+    def build_streams():
+        return [Stream.from_response(x) for x in streams]
+
+    report("twitch streams decode (json)", lambda: json.loads(streams_raw), len(streams), args.repeat)
+    report("twitch streams decode", lambda: json_loads(streams_raw), len(streams), args.repeat)
+    report("twitch Stream build", build_streams, len(streams), args.repeat)
+    report_memory("twitch Stream", build_streams, len(streams))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+"""
+Poll cycle benchmark for YouTube and Twitch notification modules.
+Drives 'YouTubeNotifsModule.check' and 'TwitchNotifsModule.check_routine' against local mock API,
+and reports requests, wall time and CPU time per cycle.
+
+Run from repository root:
+ python -m benchmarks.poll_cycle --feeds 10 100 1000
+"""
+
+
+import os
+import time
+import asyncio
+import aiohttp
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from unittest import mock
+from discord.ext import tasks
+from source.utils import DotDict
+from source.keychain import KeyChain
+from source.configs import GuildConfig
+from benchmarks import mock_api
+
+
+# announcement format, same shape as in guild configs
+FORMAT: dict = {
+    "text": "{role_mention}",
+    "embed": {
+        "body": {"title": "{channel_name}", "description": None, "url": None, "color": "#ffffff"},
+        "thumbnail": None,
+        "author": {"name": "{channel_name}", "url": None, "icon_url": None},
+        "fields": []}}
+
+
+class FakeChannel:
+    """
+    Discord channel stand-in, that counts sent messages
+    """
+
+    def __init__(self):
+        self.sent: int = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+
+    @staticmethod
+    def is_news() -> bool:
+        return False
+
+
+class FakeClient:
+    """
+    Discord client stand-in
+    """
+
+    def __init__(self):
+        self.channel: FakeChannel = FakeChannel()
+
+    def get_channel(self, channel_id: int) -> FakeChannel:
+        return self.channel
+
+
+def make_guild_config(data: dict) -> GuildConfig:
+    """
+    Makes guild config without reading it from disk
+    :param data: raw config
+    :return: guild config
+    """
+
+    config = GuildConfig.__new__(GuildConfig)
+    config.config_path = None
+    config._config = DotDict(data)
+    return config
+
+
+async def control(session: aiohttp.ClientSession, base_url: str, action: str, data: dict | None = None) -> dict:
+    """
+    Calls mock API control endpoint
+    """
+
+    if data is None:
+        async with session.get(f"{base_url}/_control/{action}") as resp:
+            return await resp.json()
+    async with session.post(f"{base_url}/_control/{action}", json=data) as resp:
+        return await resp.json()
+
+
+async def make_youtube_module(client: FakeClient, base_url: str, channel_ids: list[str], backend: str):
+    """
+    Creates YouTube module, pointed at mock API
+    """
+
+    from modules.YouTubeNotifs.fetcher import Fetcher, KeyPool, QuotaExceeded
+    from modules.YouTubeNotifs.main import YouTubeNotifsModule
+    from source.breakers import BreakerRegistry
+
+    # reset fetcher state
+    Fetcher.API_URL = f"{base_url}/youtube/v3"
+    Fetcher.FEED_URL = f"{base_url}/feeds/videos.xml"
+    Fetcher.key_pool = KeyPool(["benchmark-key"], daily_quota=10**9)
+    Fetcher.endpoint_breakers = BreakerRegistry(client_errors=False)
+    Fetcher.feed_breakers = BreakerRegistry(ignored=(QuotaExceeded,))
+    Fetcher.cached.clear()
+    Fetcher.channels.clear()
+    Fetcher.channels_playlists.clear()
+
+    module = YouTubeNotifsModule(client)
+    module.module_config._config["backend"] = backend
+    module.db_handle.database_path = ":memory:"
+    with mock.patch.object(tasks.Loop, "start"):
+        await module.on_ready()
+
+    guild_config = make_guild_config({
+        "notifications_channel_id": 0,
+        "video_role_id": 0,
+        "stream_role_id": 0,
+        "channels": channel_ids,
+        "format": FORMAT})
+    module.subscriptions = {channel_id: [guild_config] for channel_id in channel_ids}
+    return module
+
+
+async def make_twitch_module(client: FakeClient, base_url: str, logins: list[str], token_path: str):
+    """
+    Creates Twitch module, pointed at mock API
+    """
+
+    from modules.TwitchNotifs.fetcher import Fetcher, TokenManager, RateLimiter
+    from modules.TwitchNotifs.main import TwitchNotifsModule
+    from source.breakers import BreakerRegistry
+
+    # credentials are not checked by mock API
+    for key in ("TWITCH_API_ID", "TWITCH_API_KEY"):
+        if not hasattr(KeyChain, key):
+            setattr(KeyChain, key, "benchmark")
+
+    # reset fetcher state
+    Fetcher.API_URL = f"{base_url}/helix"
+    Fetcher.AUTH_URL = f"{base_url}/oauth2"
+    Fetcher.token_manager = TokenManager(token_path)
+    Fetcher.rate_limiter = RateLimiter()
+    Fetcher.endpoint_breakers = BreakerRegistry(client_errors=False)
+
+    module = TwitchNotifsModule(client)
+    module.module_config._config["eventsub"]["enabled"] = False
+    module.db_handle.database_path = ":memory:"
+    with mock.patch.object(tasks.Loop, "start"):
+        await module.on_ready()
+
+    guild_config = make_guild_config({
+        "notifications_channel_id": 0,
+        "role_id": 0,
+        "channels": logins,
+        "format": FORMAT})
+    module.subscriptions = {login: [guild_config] for login in logins}
+    return module
+
+
+async def measure(session: aiohttp.ClientSession, base_url: str, cycle) -> dict:
+    """
+    Runs one poll cycle
+    :return: cycle metrics
+    """
+
+    requests_before = (await control(session, base_url, "stats"))["requests"]
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    await cycle()
+
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    requests = (await control(session, base_url, "stats"))["requests"] - requests_before
+
+    return {"requests": requests, "wall": wall, "cpu": cpu}
+
+
+async def bench(args: argparse.Namespace) -> None:
+    """
+    Runs the benchmark
+    """
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    token_path = os.path.join(tempfile.mkdtemp(), "token.json")
+
+    print(f"{'module':<10} {'feeds':>6} {'cycle':>6} {'requests':>9} {'wall, ms':>10} {'cpu, ms':>10} {'sent':>6}")
+    async with aiohttp.ClientSession() as session:
+        for feeds in args.feeds:
+            for name in args.modules:
+                setup = await control(session, base_url, "setup", {
+                    "youtube_channels": feeds,
+                    "twitch_users": feeds,
+                    "error_rate": args.error_rate,
+                    "quota_error_rate": args.quota_error_rate,
+                    "latency": args.latency,
+                    "seed": args.seed})
+
+                client = FakeClient()
+                if name == "youtube":
+                    module = await make_youtube_module(client, base_url, setup["youtube_channels"], args.backend)
+                    cycle = module.check
+                else:
+                    module = await make_twitch_module(client, base_url, setup["twitch_users"], token_path)
+                    cycle = module.check_routine
+
+                # first cycle fetches everything, and only remembers what it has seen
+                for i in range(args.cycles + 1):
+                    if i > 0:
+                        await control(session, base_url, "advance", {
+                            "upload_rate": args.upload_rate,
+                            "live_rate": args.live_rate})
+
+                    sent_before = client.channel.sent
+                    result = await measure(session, base_url, cycle)
+                    print(
+                        f"{name:<10} {feeds:>6} {'cold' if i == 0 else i:>6} {result['requests']:>9} "
+                        f"{result['wall'] * 1000:>10.1f} {result['cpu'] * 1000:>10.1f} "
+                        f"{client.channel.sent - sent_before:>6}")
+
+                await module.db_handle.close()
+
+
+async def wait_for_server(base_url: str, timeout: float = 10) -> None:
+    """
+    Waits until mock API starts accepting requests
+    """
+
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                await control(session, base_url, "stats")
+                return
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll cycle benchmark for notification modules")
+    parser.add_argument("--feeds", type=int, nargs="+", default=[10, 100, 1000],
+                        help="amounts of feeds to benchmark with")
+    parser.add_argument("--modules", nargs="+", default=["youtube", "twitch"], choices=["youtube", "twitch"])
+    parser.add_argument("--cycles", type=int, default=3, help="warm cycles after the cold one")
+    parser.add_argument("--backend", default="api", choices=["api", "rss"], help="YouTube fetching backend")
+    parser.add_argument("--upload-rate", type=float, default=0.1, help="chance of a channel uploading per cycle")
+    parser.add_argument("--live-rate", type=float, default=0.1, help="chance of a streamer going live/offline")
+    parser.add_argument("--error-rate", type=float, default=0, help="chance of a request failing with 500")
+    parser.add_argument("--quota-error-rate", type=float, default=0, help="chance of YouTube quota error")
+    parser.add_argument("--latency", type=float, default=0, help="added delay per request in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    # mock API runs in its own process, so it doesn't affect measured CPU time
+    server = multiprocessing.get_context("spawn").Process(
+        target=mock_api.run, kwargs={"port": args.port}, daemon=True)
+    server.start()
+    try:
+        asyncio.run(wait_for_server(f"http://127.0.0.1:{args.port}"))
+        asyncio.run(bench(args))
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
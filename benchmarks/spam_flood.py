@@ -0,0 +1,211 @@
+"""
+SpamATon flood benchmark.
+Replays a message flood through 'SpamATonModule.process_message', and reports per-message cost.
+Then reports, how often edited spam texts are still counted as the same message
+with configured 'similarity_distance', and how often unrelated texts are.
+
+Run from repository root:
+ python -m benchmarks.spam_flood --messages 1000 10000
+"""
+
+
+import time
+import random
+import string
+import asyncio
+import argparse
+import statistics
+from typing import Callable
+from types import SimpleNamespace
+from datetime import datetime, timezone, timedelta
+from source.configs import ModuleConfig
+from modules.SpamATon.main import SpamATonModule
+from modules.SpamATon.fingerprints import fingerprint, minhash_distance
+
+
+# words spam texts are made of
+SPAM_WORDS: list[str] = (
+    "free nitro discord gift claim now steam airdrop crypto giveaway click here link limited offer join server "
+    "winner prize bonus code get your account verify login official event drop exclusive reward today only").split()
+
+# look-alike characters, that are not folded by normalization
+HOMOGLYPHS: dict[str, str] = {
+    "a": "ɑ", "c": "ᴄ", "g": "ɡ", "i": "ı", "l": "ӏ", "n": "ո", "o": "օ", "u": "ս", "y": "ʏ"}
+
+
+def change_case(text: str, rng: random.Random) -> str:
+    return "".join(x.upper() if rng.random() < 0.2 else x for x in text)
+
+
+def insert_invisible(text: str, rng: random.Random) -> str:
+    position = rng.randrange(len(text))
+    return text[:position] + rng.choice(["\u200b", "\u2060", " "]) + text[position:]
+
+
+def substitute(text: str, rng: random.Random) -> str:
+    positions = [i for i, x in enumerate(text) if x.isalpha()]
+    if not positions:
+        return text
+    position = rng.choice(positions)
+    letter = rng.choice(string.ascii_lowercase.replace(text[position].lower(), ""))
+    return text[:position] + letter + text[position + 1:]
+
+
+def replace_homoglyph(text: str, rng: random.Random) -> str:
+    positions = [i for i, x in enumerate(text) if x.lower() in HOMOGLYPHS]
+    if not positions:
+        return text
+    position = rng.choice(positions)
+    return text[:position] + HOMOGLYPHS[text[position].lower()] + text[position + 1:]
+
+
+def obfuscate(text: str, rng: random.Random) -> str:
+    """
+    Makes variation of the text, like spam bots do to avoid exact matching:
+    changes case, inserts invisible character, substitutes one letter and replaces one with a homoglyph
+    :param text: text
+    :param rng: random generator
+    :return: varied text
+    """
+
+    for edit in (change_case, insert_invisible, substitute, replace_homoglyph):
+        text = edit(text, rng)
+    return text
+
+
+# edit name: edit
+EDITS: dict[str, Callable[[str, random.Random], str]] = {
+    "case": change_case,
+    "invisible": insert_invisible,
+    "substitution": substitute,
+    "homoglyph": replace_homoglyph,
+    "all (obfuscate)": obfuscate}
+
+
+def make_spam_text(rng: random.Random) -> str:
+    """
+    Makes spam text of 40 to 120 characters, with a link
+    """
+
+    text = ""
+    length = rng.randint(40, 100)
+    while len(text) < length:
+        text += rng.choice(SPAM_WORDS) + " "
+    return text + f"https://{''.join(rng.choices(string.ascii_lowercase, k=8))}.com/{rng.randrange(10**6)}"
+
+
+def make_flood(
+        amount: int, users: int, channels: int, contents: int, interval: float, seed: int, variants: bool) -> list:
+    """
+    Makes discord message stand-ins
+    :param amount: amount of messages
+    :param users: amount of users sending them
+    :param channels: amount of channels they are sent in
+    :param contents: amount of different message contents
+    :param interval: seconds between messages
+    :param seed: random seed
+    :param variants: whether every message is a slightly changed variant of its content
+    :return: list of messages
+    """
+
+    rng = random.Random(seed)
+    start = datetime.now(timezone.utc) - timedelta(seconds=amount * interval)
+    guild = SimpleNamespace(id=1)
+
+    messages = []
+    for i in range(amount):
+        content = f"Free nitro at https://example.com/{rng.randrange(contents)}"
+        if variants:
+            content = obfuscate(content, rng)
+        messages.append(SimpleNamespace(
+            id=10**17 + i,
+            content=content,
+            attachments=[],
+            stickers=[],
+            embeds=[],
+            mentions=[],
+            role_mentions=[],
+            mention_everyone=False,
+            author=SimpleNamespace(id=rng.randrange(users), bot=False),
+            channel=SimpleNamespace(id=rng.randrange(channels)),
+            guild=guild,
+            created_at=start + timedelta(seconds=i * interval)))
+    return messages
+
+
+def detection_rates(samples: int, max_distance: int, seed: int) -> None:
+    """
+    Prints share of edited spam texts, whose fingerprints are within 'max_distance' of the original,
+    and share of unrelated spam texts, that are
+    :param samples: amount of texts
+    :param max_distance: maximum fingerprint distance of the same message
+    :param seed: random seed
+    """
+
+    rng = random.Random(seed)
+    texts = [make_spam_text(rng) for _ in range(samples)]
+
+    print(f"{'edit':<16} {'median distance':>16} {f'detected (<= {max_distance})':>18}")
+    for name, edit in EDITS.items():
+        distances = [minhash_distance(fingerprint(x), fingerprint(edit(x, rng))) for x in texts]
+        detected = sum(x <= max_distance for x in distances) / samples
+        print(f"{name:<16} {statistics.median(distances):>16.1f} {detected:>18.1%}")
+
+    distances = [minhash_distance(fingerprint(a), fingerprint(b)) for a, b in zip(texts, texts[1:])]
+    matched = sum(x <= max_distance for x in distances) / len(distances)
+    print(f"{'unrelated':<16} {statistics.median(distances):>16.1f} {matched:>18.1%}")
+
+
+async def replay(messages: list) -> tuple[float, int, int]:
+    """
+    Replays messages through new module instance
+    :return: wall time, amount of spam detections and amount of raid detections
+    """
+
+    module = SpamATonModule(SimpleNamespace())
+
+    # only count detections
+    detections = 0
+    raids = 0
+
+    async def timeout_member(member, repeated_message, reason="possible spam", flag=True):
+        nonlocal detections
+        detections += 1
+
+    async def timeout_raid(repeated_message, authors, fingerprint):
+        nonlocal raids
+        raids += 1
+
+    module.timeout_member = timeout_member
+    module.timeout_raid = timeout_raid
+
+    start = time.perf_counter()
+    for message in messages:
+        await module.process_message(message)
+    return time.perf_counter() - start, detections, raids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SpamATon flood benchmark")
+    parser.add_argument("--messages", type=int, nargs="+", default=[1000, 10000], help="flood sizes")
+    parser.add_argument("--users", type=int, default=1, help="amount of users flooding")
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--contents", type=int, default=50, help="amount of different message contents")
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds between messages")
+    parser.add_argument("--variants", action="store_true", help="send slightly changed variants of contents")
+    parser.add_argument("--samples", type=int, default=2000, help="amount of texts to measure detection rates on")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'messages':>9} {'total, ms':>10} {'per message, us':>16} {'detections':>11} {'raids':>6}")
+    for amount in args.messages:
+        messages = make_flood(amount, args.users, args.channels, args.contents, args.interval, args.seed, args.variants)
+        wall, detections, raids = asyncio.run(replay(messages))
+        print(f"{amount:>9} {wall * 1000:>10.1f} {wall * 1e6 / amount:>16.2f} {detections:>11} {raids:>6}")
+
+    print()
+    detection_rates(args.samples, ModuleConfig("SpamATon").similarity_distance, args.seed)
+
+
+if __name__ == '__main__':
+    main()
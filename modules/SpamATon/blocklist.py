@@ -0,0 +1,140 @@
+"""
+Domain blocklists, used to act on known scam links
+"""
+
+
+import os
+import re
+import discord
+
+
+# domain-like tokens, with or without scheme and user info (ex. 'https://user@scam.example.com/path', 'scam.com').
+# Scheme and user info are bounded, so text without them (ex. 'a!a!a!...') isn't rescanned from every position
+DOMAIN: re.Pattern = re.compile(
+    r"(?<![\w.@-])(?:[a-z][a-z0-9+.-]{0,31}://)?(?:[^\s/@<>]{1,64}@)?((?:[\w-]+\.)+[\w-]{2,})", re.I)
+
+
+def extract_domains(message: discord.Message) -> set[str]:
+    """
+    Extracts domains of links in message content and embeds
+    :param message: user message
+    :return: set of lowercase domains
+    """
+
+    # all texts, that can hold links
+    texts = [message.content]
+    for embed in message.embeds:
+        texts += [embed.url, embed.title, embed.description, embed.author.url, embed.footer.text]
+        texts += [f"{field.name}\n{field.value}" for field in embed.fields]
+
+    # scan in one pass; there are no domains without dots
+    text = "\n".join(x for x in texts if x)
+    if "." not in text:
+        return set()
+    return {x.lower() for x in DOMAIN.findall(text)}
+
+
+class DomainTrie:
+    """
+    Trie over reversed domain labels (ex. 'scam.example.com' -> 'com', 'example', 'scam').
+    Blocked domain matches itself and all of its subdomains.
+    Lookup cost depends only on amount of labels in the domain, not on amount of blocked domains
+    """
+
+    # marks node of blocked domain
+    END: str = ""
+
+    def __init__(self):
+        self.root: dict[str, dict] = dict()
+        self.size: int = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, domain: str) -> None:
+        """
+        Adds domain to the trie
+        :param domain: domain (ex. 'example.com')
+        """
+
+        node = self.root
+        for label in reversed(domain.lower().strip(".").split(".")):
+            node = node.setdefault(label, dict())
+        if self.END not in node:
+            node[self.END] = domain
+            self.size += 1
+
+    def match(self, domain: str) -> str | None:
+        """
+        Finds blocked domain, that matches given one
+        :param domain: lowercase domain (ex. 'scam.example.com')
+        :return: blocked domain (ex. 'example.com'), or None if domain is not blocked
+        """
+
+        node = self.root
+        for label in reversed(domain.rstrip(".").split(".")):
+            node = node.get(label)
+            if node is None:
+                return None
+            if self.END in node:
+                return node[self.END]
+        return None
+
+
+class BlocklistFile:
+    """
+    Blocklist, loaded from text file with one domain per line ('#' starts a comment).
+    The file is reloaded, when its modification time changes
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: path to blocklist file; missing file is treated as an empty list
+        """
+
+        self.path: str = path
+        self.mtime: float | None = None
+        self.trie: DomainTrie = DomainTrie()
+
+    def __len__(self) -> int:
+        return len(self.trie)
+
+    def reload(self) -> bool:
+        """
+        Reloads the file, if it was changed. Large lists take a while to load, so it's better called in a thread
+        :return: True if blocklist was reloaded
+        """
+
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:  # file was removed, or never existed
+            mtime = None
+
+        if mtime == self.mtime:
+            return False
+
+        # build new trie, and swap it in
+        trie = DomainTrie()
+        if mtime is not None:
+            with open(self.path, "r", encoding="utf-8") as file:
+                for line in file:
+                    domain = line.split("#", 1)[0].strip()
+                    if domain:
+                        trie.add(domain)
+
+        self.trie = trie
+        self.mtime = mtime
+        return True
+
+    def match(self, domains: set[str]) -> str | None:
+        """
+        Finds first blocked domain
+        :param domains: lowercase domains
+        :return: blocked domain, or None if none of domains are blocked
+        """
+
+        for domain in domains:
+            blocked = self.trie.match(domain)
+            if blocked is not None:
+                return blocked
+        return None
@@ -0,0 +1,234 @@
+"""
+Message content fingerprints, used to find near-duplicate messages
+"""
+
+
+import re
+import hashlib
+import functools
+import unicodedata
+from typing import Callable
+
+
+# characters, that look like latin letters
+CONFUSABLES: dict[int, str] = str.maketrans({
+    # cyrillic
+    "а": "a", "в": "b", "с": "c", "ԁ": "d", "е": "e", "һ": "h", "і": "i", "ј": "j", "к": "k", "м": "m",
+    "н": "h", "о": "o", "р": "p", "ԛ": "q", "ѕ": "s", "т": "t", "у": "y", "х": "x", "ԝ": "w",
+    # greek
+    "α": "a", "β": "b", "ε": "e", "η": "n", "ι": "i", "κ": "k", "ν": "v", "ο": "o", "ρ": "p", "τ": "t",
+    "υ": "u", "χ": "x",
+    # symbols
+    "@": "a", "$": "s"})
+
+# fillers, that render as whitespace or nothing
+FILLERS: re.Pattern = re.compile("[ᅟᅠㅤﾠ]")
+
+# discord custom emoji (ex. '<:name:123>')
+CUSTOM_EMOJI: re.Pattern = re.compile(r"<a?:\w+:\d+>")
+
+# length of character shingles
+SHINGLE_SIZE: int = 3
+
+# amount of one byte MinHash values in a fingerprint
+MINHASH_SIZE: int = 8
+
+# lowest bit of every byte
+BYTE_LOW_BITS: int = 0x0101010101010101
+
+
+def normalize(text: str) -> str:
+    """
+    Normalizes text, so small changes don't affect its fingerprint.
+    Folds case and look-alike characters, removes invisible characters, emoji, marks and extra whitespace
+    :param text: text
+    :return: normalized text
+    """
+
+    text = CUSTOM_EMOJI.sub("", text)
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = FILLERS.sub("", text).translate(CONFUSABLES)
+
+    # drop marks (M), symbols and emoji (S), control and format characters (C)
+    text = "".join(x for x in unicodedata.normalize("NFD", text) if unicodedata.category(x)[0] not in "MSC")
+    return " ".join(text.split())
+
+
+def minhash(text: str) -> int:
+    """
+    Computes MinHash signature of text character shingles, made of 8 one byte values.
+    Every value is the lowest byte of the minimum of one shingle hash function, so it's equal in
+    2 texts with probability close to share of shingles they have in common.
+    Changing a character only changes a few shingles, so most values stay the same
+    :param text: normalized text
+    :return: fingerprint
+    """
+
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(max(len(text) - SHINGLE_SIZE + 1, 1))}
+
+    # one digest holds 8 hashes of the shingle
+    digests = [hashlib.blake2b(x.encode("utf-8"), digest_size=8 * MINHASH_SIZE).digest() for x in shingles]
+
+    value = 0
+    for i in range(0, 8 * MINHASH_SIZE, 8):
+        value = value << 8 | min(x[i:i + 8] for x in digests)[7]
+    return value
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(text: str) -> int:
+    """
+    Computes fingerprint of raw text. Results are cached, as spam floods repeat the same texts.
+    Texts, that are too short after normalization (ex. only emoji), are hashed exactly,
+    as otherwise all of them would get the same fingerprint
+    :param text: raw text
+    :return: fingerprint
+    """
+
+    normalized = normalize(text)
+    if len(normalized) < SHINGLE_SIZE:
+        return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest())
+    return minhash(normalized)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """
+    :return: amount of different bits in 2 fingerprints
+    """
+
+    return (a ^ b).bit_count()
+
+
+def minhash_distance(a: int, b: int) -> int:
+    """
+    :return: amount of different bytes (MinHash values) in 2 fingerprints
+    """
+
+    # fold every byte into its lowest bit
+    x = a ^ b
+    x |= x >> 4
+    x |= x >> 2
+    x |= x >> 1
+    return (x & BYTE_LOW_BITS).bit_count()
+
+
+class LSHIndex:
+    """
+    Clusters of similar 64 bit fingerprints, found with banded locality sensitive hashing.
+    Fingerprint is split into 8 bands of 8 bits; fingerprints within distance of 7 (either in bits or in bytes)
+    share at least one band, so only cluster representatives in the same band buckets are compared.
+    Every fingerprint belongs to the cluster of the first similar representative, or starts its own
+    """
+
+    BANDS: int = 8
+    BAND_BITS: int = 8
+
+    def __init__(self, max_distance: int, distance: Callable[[int, int], int] = hamming_distance):
+        """
+        :param max_distance: maximum distance of similar fingerprints (up to 7)
+        :param distance: distance function; 'hamming_distance' or 'minhash_distance'
+        """
+
+        self.max_distance: int = min(max_distance, self.BANDS - 1)
+        self.distance: Callable[[int, int], int] = distance
+
+        # (band, band_value): {representative, ...}
+        self.buckets: dict[tuple[int, int], set[int]] = dict()
+
+        # "fingerprint": representative
+        self.representatives: dict[int, int] = dict()
+
+        # "fingerprint": count; how many times fingerprint was added
+        self.references: dict[int, int] = dict()
+
+        # "representative": count; how many fingerprints were added to the cluster
+        self.sizes: dict[int, int] = dict()
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def bands(self, fingerprint: int) -> list[tuple[int, int]]:
+        """
+        :return: band buckets of the fingerprint
+        """
+
+        mask = (1 << self.BAND_BITS) - 1
+        return [(band, (fingerprint >> (band * self.BAND_BITS)) & mask) for band in range(self.BANDS)]
+
+    def find(self, fingerprint: int) -> int | None:
+        """
+        Finds representative of a cluster, that fingerprint is similar to
+        :param fingerprint: fingerprint
+        :return: representative, or None if there are no similar clusters
+        """
+
+        # exact matches only
+        if self.max_distance == 0:
+            return fingerprint if fingerprint in self.sizes else None
+
+        for bucket in self.bands(fingerprint):
+            for representative in self.buckets.get(bucket, ()):
+                if self.distance(fingerprint, representative) <= self.max_distance:
+                    return representative
+        return None
+
+    def add(self, fingerprint: int) -> int:
+        """
+        Adds fingerprint to the index
+        :param fingerprint: fingerprint
+        :return: representative of fingerprint's cluster
+        """
+
+        representative = self.representatives.get(fingerprint)
+        if representative is None:
+            representative = self.find(fingerprint)
+
+            # start new cluster
+            if representative is None:
+                representative = fingerprint
+                self.sizes[representative] = 0
+                if self.max_distance > 0:
+                    for bucket in self.bands(representative):
+                        self.buckets.setdefault(bucket, set()).add(representative)
+
+            self.representatives[fingerprint] = representative
+            self.references[fingerprint] = 0
+
+        self.references[fingerprint] += 1
+        self.sizes[representative] += 1
+        return representative
+
+    def remove(self, fingerprint: int) -> int:
+        """
+        Removes one reference of fingerprint from the index. Empty clusters are removed
+        :param fingerprint: fingerprint
+        :return: representative of fingerprint's cluster
+        """
+
+        representative = self.representatives[fingerprint]
+
+        self.references[fingerprint] -= 1
+        if self.references[fingerprint] == 0:
+            del self.references[fingerprint]
+            del self.representatives[fingerprint]
+
+        self.sizes[representative] -= 1
+        if self.sizes[representative] == 0:
+            del self.sizes[representative]
+            if self.max_distance > 0:
+                for bucket in self.bands(representative):
+                    representatives = self.buckets[bucket]
+                    representatives.discard(representative)
+                    if len(representatives) == 0:
+                        del self.buckets[bucket]
+        return representative
+
+    def clear(self) -> None:
+        """
+        Removes all fingerprints
+        """
+
+        self.buckets.clear()
+        self.representatives.clear()
+        self.references.clear()
+        self.sizes.clear()
@@ -0,0 +1,175 @@
+"""
+Perceptual hashes of image attachments, used to find re-uploaded images
+"""
+
+
+import io
+import asyncio
+import aiohttp
+import discord
+import logging
+from PIL import Image
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+# dHash is made from (HASH_SIZE + 1) x HASH_SIZE grayscale image; 64 bits for size of 8
+HASH_SIZE: int = 8
+
+
+def dhash(data: bytes) -> int:
+    """
+    Computes difference hash of the image.
+    Every bit tells whether pixel is brighter than its right neighbour on downscaled image,
+    so hash survives re-encoding, resizing and small edits
+    :param data: encoded image (first frame is used for animations)
+    :return: 64 bit hash
+    """
+
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEG images are decoded at reduced scale
+        image.draft("L", ((HASH_SIZE + 1) * 4, HASH_SIZE * 4))
+        pixels = image.convert("L").resize(
+            (HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BILINEAR, reducing_gap=2.0).tobytes()
+
+    value = 0
+    for row in range(0, len(pixels), HASH_SIZE + 1):
+        for i in range(row, row + HASH_SIZE):
+            value = value << 1 | (pixels[i] > pixels[i + 1])
+    return value
+
+
+class ImageHasher:
+    """
+    Downloads image attachments through pooled HTTP session, and hashes them in thread pool.
+    Hashes are cached by attachment URL and size
+    """
+
+    def __init__(
+            self,
+            max_size: int,
+            threads: int = 2,
+            cache_size: int = 4096,
+            logger: logging.Logger | None = None):
+        """
+        :param max_size: larger attachments (in bytes) are not downloaded
+        :param threads: amount of hashing threads and concurrent downloads
+        :param cache_size: maximum amount of cached hashes
+        :param logger: logger
+        """
+
+        self.max_size: int = max_size
+        self.threads: int = threads
+        self.cache_size: int = cache_size
+        self.logger: logging.Logger | None = logger
+
+        # Pillow releases GIL while decoding and resizing, so threads are enough
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="dhash")
+        self.session: aiohttp.ClientSession | None = None
+
+        # (url, size): hash; None for attachments, that couldn't be hashed
+        self.cache: OrderedDict[tuple[str, int], int | None] = OrderedDict()
+
+        # metrics
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """
+        Returns pooled session; it's created on first use, as it requires running event loop
+        """
+
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.threads),
+                timeout=aiohttp.ClientTimeout(total=10))
+        return self.session
+
+    async def close(self) -> None:
+        """
+        Closes the session and stops hashing threads
+        """
+
+        if self.session is not None:
+            await self.session.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def download(self, url: str) -> bytes | None:
+        """
+        Downloads attachment, unless it's larger than 'max_size'
+        :param url: attachment url
+        :return: attachment data, or None if it's too large
+        """
+
+        async with self.get_session().get(url) as resp:
+            resp.raise_for_status()
+            if resp.content_length is not None and resp.content_length > self.max_size:
+                return None
+
+            # body arrives in chunks; 'read(n)' would only return the first one
+            data = bytearray()
+            async for chunk in resp.content.iter_chunked(65536):
+                data += chunk
+                if len(data) > self.max_size:
+                    return None
+        return bytes(data)
+
+    async def hash_attachment(self, attachment: discord.Attachment) -> int | None:
+        """
+        Computes perceptual hash of image attachment
+        :param attachment: message attachment
+        :return: 64 bit hash, or None if attachment is not an image, is too large, or failed to download
+        """
+
+        if not (attachment.content_type or "").startswith("image/") or attachment.size > self.max_size:
+            return None
+
+        # signed query parameters change over time, while the path stays the same
+        key = (attachment.url.split("?")[0], attachment.size)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return self.cache[key]
+        self.misses += 1
+
+        try:
+            data = await self.download(attachment.url)
+            value = None
+            if data is not None:
+                value = await asyncio.get_running_loop().run_in_executor(self.executor, dhash, data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:  # not cached, can be retried later
+            if self.logger:
+                self.logger.warning(f"Failed to download attachment '{attachment.url}'", exc_info=e)
+            return None
+        except (OSError, ValueError, Image.DecompressionBombError):  # not a valid image
+            value = None
+
+        # cache the hash
+        self.cache[key] = value
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return value
+
+    async def hash_message(self, message: discord.Message) -> int | None:
+        """
+        Computes perceptual hash of the first image attachment of the message
+        :param message: user message
+        :return: 64 bit hash, or None if message has no images, that can be hashed
+        """
+
+        for attachment in message.attachments:
+            value = await self.hash_attachment(attachment)
+            if value is not None:
+                return value
+        return None
+
+    def state(self) -> dict[str, int]:
+        """
+        Returns gauges and metrics
+        :return: dictionary with state
+        """
+
+        return {
+            "cached": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses}
@@ -3,70 +3,92 @@ Module for preventing spam bots
 """
 
 
+import re
+import time
 import asyncio
+import aiosqlite
 import discord
-import hashlib
 import logging
 import discord.ui
-from datetime import datetime, timezone
+from discord import app_commands
+from discord.ext import tasks
 from source.configs import *
 from source.databases import *
 from source.notifications import *
-from source.utils import has_privilege
+from source.utils import has_privilege, check_bot_ownership
+from source.settings import CONFIGS_GUILDS_DIRECTORY
+from modules.SpamATon.images import ImageHasher
+from modules.SpamATon.blocklist import BlocklistFile, extract_domains
+from modules.SpamATon.rates import RateLimiter, compute_message_costs
+from modules.SpamATon.offenders import OffenderStore
+from modules.SpamATon.window import UserStatistics, RaidIndex, MessageRecord, compute_message_fingerprint
 
 
-class TimeoutUserAction(discord.ui.View):
-    def __init__(
-            self,
-            timeout_member: discord.Member,
-            self_user: discord.Member,
-            logger: logging.Logger | None = None):
-        super().__init__(timeout=None)
-
-        self.logger = logger
-        self.self_user = self_user
-        self.timeout_member = timeout_member
-
-    @discord.ui.button(label="Ban", style=discord.ButtonStyle.red)
-    async def ban_button(self, interaction: discord.Interaction, button: discord.Button):
-        # check permission
-        if not has_privilege(interaction.user, self.timeout_member):
-            raise commands.MissingPermissions(
-                ["ban_members"],
-                f"User {self.timeout_member.mention} has higher or equal privilege")
-
-        # ban user
-        await member_ban(
-            member=self.timeout_member,
-            delete_within_days=2,
-            reason="Spam",
-            author=interaction.user,
-            logger=self.logger)
+# messages older than that (in seconds) can't be bulk deleted
+BULK_DELETE_MAX_AGE: int = 14 * 24 * 60 * 60
 
-        # disable buttons
-        for child in self.children:
-            child.disabled = True
+# maximum amount of messages in one bulk deletion
+BULK_DELETE_LIMIT: int = 100
 
-        # update interaction
-        await interaction.response.edit_message(view=self)
 
-    @discord.ui.button(label="Remove timeout", style=discord.ButtonStyle.green)
-    async def remove_timeout_button(self, interaction: discord.Interaction, button: discord.Button):
-        # check permission
-        if not has_privilege(interaction.user, self.timeout_member):
-            raise commands.MissingPermissions(
-                ["moderate_members"],
-                f"User {self.timeout_member.mention} has higher or equal privilege")
+# alert button actions; "action": (label, style)
+ALERT_ACTIONS: dict[str, tuple[str, discord.ButtonStyle]] = {
+    "ban": ("Ban", discord.ButtonStyle.red),
+    "untimeout": ("Remove timeout", discord.ButtonStyle.green)}
 
-        # remove timeout
-        await self.timeout_member.edit(timed_out_until=None)
 
-        # disable buttons
-        for child in self.children:
-            child.disabled = True
+class AlertActionButton(
+        discord.ui.DynamicItem[discord.ui.Button],
+        template=r"spamaton:(?P<action>ban|untimeout):(?P<guild_id>[0-9]+):(?P<user_id>[0-9]+)"):
+    """
+    Spam alert button. Custom id holds the action, guild id and user id, so buttons keep working
+    after restarts, without keeping views in memory
+    """
 
-        # update interaction
-        await interaction.response.edit_message(view=self)
+    def __init__(self, action: str, guild_id: int, user_id: int, disabled: bool = False):
+        label, style = ALERT_ACTIONS[action]
+        super().__init__(discord.ui.Button(
+            label=label,
+            style=style,
+            disabled=disabled,
+            custom_id=f"spamaton:{action}:{guild_id}:{user_id}"))
+
+        self.action: str = action
+        self.guild_id: int = guild_id
+        self.user_id: int = user_id
+
+    @classmethod
+    async def from_custom_id(
+            cls,
+            interaction: discord.Interaction,
+            item: discord.ui.Button,
+            match: re.Match[str]
+    ):
+        return cls(match["action"], int(match["guild_id"]), int(match["user_id"]))
+
+    async def callback(self, interaction: discord.Interaction) -> None:
+        module = interaction.client.get_cog(SpamATonModule.__name__)
+        if module is None:
+            raise commands.CommandError("Module 'SpamATon' is not loaded")
+
+        await module.handle_alert_action(interaction, self.action, self.guild_id, self.user_id)
+
+
+def make_alert_view(guild_id: int, user_id: int, disabled: bool = False) -> discord.ui.View:
+    """
+    Makes view with alert buttons.
+    View is stopped right away, so it's not stored; button presses are handled by registered 'AlertActionButton'
+    :param guild_id: guild id
+    :param user_id: id of flagged user
+    :param disabled: whether buttons are disabled
+    :return: view
+    """
+
+    view = discord.ui.View(timeout=None)
+    for action in ALERT_ACTIONS:
+        view.add_item(AlertActionButton(action, guild_id, user_id, disabled))
+    view.stop()
+    return view
 
 
 class SpamATonModule(commands.Cog):
@@ -86,53 +108,193 @@ class SpamATonModule(commands.Cog):
         self.module_config: ModuleConfig = ModuleConfig(self.module_name)
         self.guild_config: GuildConfigCollection = GuildConfigCollection(self.module_name)
 
-        # processing queue
-        self.user_statistics: dict[int, list[discord.Message]] = {}
+        # databases
+        self.db_handle: DatabaseHandle = DatabaseHandle(self.module_name)
+        self.db: aiosqlite.Connection | None = None
+
+        # offenders flagged in any guild; loaded when database is connected
+        self.offenders: OffenderStore | None = None
+
+        # recent messages of every user
+        self.user_statistics: UserStatistics = UserStatistics(
+            window=self.module_config.message_window,
+            max_records=self.module_config.max_tracked_messages,
+            tick=self.module_config.sweep_interval,
+            max_distance=self.module_config.similarity_distance,
+            image_distance=self.module_config.image_distance)
+
+        # perceptual hashes of image attachments
+        self.image_hasher: ImageHasher | None = None
+        if self.module_config.hash_images:
+            self.image_hasher = ImageHasher(
+                max_size=self.module_config.image_max_size,
+                threads=self.module_config.image_hash_threads,
+                cache_size=self.module_config.image_cache_size,
+                logger=self.logger)
+
+        # message, mention and attachment rates of every user in every guild
+        self.rate_limiter: RateLimiter = RateLimiter(self.module_config.rate_limits)
+
+        # recent messages in every guild, indexed by content
+        self.raid_indexes: dict[int, RaidIndex] = {}
+
+        # message deletions, running in background
+        self._deletion_tasks: set[asyncio.Task] = set()
+
+        # blocked domains; global, and "guild_id": blocklist
+        self.blocklist: BlocklistFile = BlocklistFile(self.module_config.blocklist_path)
+        self.guild_blocklists: dict[int, BlocklistFile] = {}
+
+        self.sweep_user_statistics.change_interval(seconds=self.module_config.sweep_interval)
+        self.reload_blocklists.change_interval(seconds=self.module_config.blocklist_reload_interval)
 
     async def on_cleanup(self):
         """
         Gets called when the bot is exiting
         """
 
+        # let started deletions finish
+        await asyncio.gather(*self._deletion_tasks, return_exceptions=True)
+
+        if self.image_hasher is not None:
+            await self.image_hasher.close()
+
+        self.client.remove_dynamic_items(AlertActionButton)
+
+        await self.db_handle.close()
+        self.logger.info("Database closed")
+
     async def on_ready(self):
         """
         When the module is loaded
         """
 
-    @staticmethod
-    def compute_message_content_hash(message: discord.Message) -> bytes:
+        # connect to database
+        self.db = await self.db_handle.connect()
+        self.logger.info("Database connected")
+
+        # check the table is present
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS Alerts (
+                    GuildId INTEGER,
+                    UserId INTEGER,
+                    State TEXT DEFAULT 'open',
+                    CreatedAt INTEGER,
+                    HandledBy INTEGER,
+                    PRIMARY KEY (GuildId, UserId)
+                );""")
+
+        # commit database changes
+        await self.db.commit()
+
+        # alert buttons are handled by custom id, and are registered once
+        self.client.add_dynamic_items(AlertActionButton)
+
+        # load offenders
+        offenders = OffenderStore(
+            self.db, capacity=self.module_config.offender_capacity, ttl=self.module_config.offender_ttl)
+        await offenders.load()
+        self.offenders = offenders
+        self.logger.info(f"Loaded {len(offenders.filter)} offender entries")
+
+        self.sweep_user_statistics.start()
+        self.reload_blocklists.start()
+        self.prune_alerts.start()
+        self.prune_offenders.start()
+
+    @tasks.loop(seconds=10)
+    async def sweep_user_statistics(self) -> None:
         """
-        Computes repeated_message content hash
-        :param repeated_message: user repeated_message
-        :return: md5 bytes hash
+        Stops tracking users, that didn't send messages within the window
         """
 
-        content = message.content + "".join(f"{x.size}{x.filename}" for x in message.attachments)
-        return hashlib.md5(content.encode("utf-8")).digest()
+        self.user_statistics.sweep(time.time())
+        self.rate_limiter.sweep(time.time())
 
-    async def timeout_member(self, member: discord.Member, repeated_message: discord.Message):
+    @tasks.loop(hours=6)
+    async def prune_alerts(self) -> None:
+        """
+        Removes alerts older than 'alert_retention' seconds; their buttons stop working
+        """
+
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.execute(
+                "DELETE FROM Alerts WHERE ? - CreatedAt >= ?",
+                (int(time.time()), self.module_config.alert_retention))
+        await self.db.commit()
+
+    @tasks.loop(hours=6)
+    async def prune_offenders(self) -> None:
+        """
+        Removes offender flags older than 'offender_ttl' seconds
+        """
+
+        await self.offenders.prune()
+
+    @tasks.loop(seconds=30)
+    async def reload_blocklists(self) -> None:
+        """
+        Loads blocklists of configured guilds, and reloads changed blocklist files
+        """
+
+        # guild blocklists are stored next to guild configs
+        for guild in self.client.guilds:
+            if guild.id in self.guild_config and guild.id not in self.guild_blocklists:
+                self.guild_blocklists[guild.id] = BlocklistFile(
+                    f"{CONFIGS_GUILDS_DIRECTORY}/{guild.id}/{self.module_name.lower()}_blocklist.txt")
+
+        for blocklist in [self.blocklist, *self.guild_blocklists.values()]:
+            try:
+                if await asyncio.to_thread(blocklist.reload):
+                    self.logger.info(f"Loaded {len(blocklist)} blocked domains from '{blocklist.path}'")
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Failed to load blocklist '{blocklist.path}'", exc_info=e)
+
+    async def timeout_member(
+            self,
+            member: discord.Member,
+            repeated_message: discord.Message,
+            reason: str = "possible spam",
+            flag: bool = True):
         """
         Timeout the member
+        :param member: member to timeout
+        :param repeated_message: message, that triggered the timeout
+        :param reason: reason
+        :param flag: whether the member is shared with other guilds as an offender
         """
 
         # get self member
         self_member = self.client.get_guild(repeated_message.guild.id).get_member(self.client.user.id)
 
+        # recent messages of the member
+        user_window = self.user_statistics.get(member.id)
+        records = list(user_window.records) if user_window is not None else []
+
         # timeout user and delete past messages
         if has_privilege(self_member, member):
             await member_timeout(
                 member=member,
                 duration=timedelta(minutes=self.module_config.timeout_duration),
-                reason="possible spam",
+                reason=reason,
                 author=self_member,
                 logger=self.logger)
 
             # delete spam messages
-            for message in self.user_statistics[member.id]:
-                await message.delete()
+            self.schedule_deletion(records)
+
+            # share with other guilds; members, that bot can't act on, are left to moderators
+            if flag:
+                await self.flag_offender(
+                    member.id, repeated_message.guild.id, reason,
+                    self.offender_fingerprints(repeated_message, records))
 
-        # clear messages
-        self.user_statistics[member.id].clear()
+        # clear messages and rates
+        self.user_statistics.clear(member.id)
+        self.rate_limiter.remove(repeated_message.guild.id, member.id)
 
         # create notification
         # fetch channel id
@@ -147,14 +309,13 @@ class SpamATonModule(commands.Cog):
             title="Spam bot detected",
             description=f"Possible spam account {member.mention}",
             color=discord.Color.orange())
+        embed.add_field(name="Reason", value=reason, inline=False)
         embed.add_field(name="Message content", value=message_content, inline=False)
 
         # create 2 buttons action
         if has_privilege(self_member, member):
-            action = TimeoutUserAction(
-                timeout_member=member,
-                self_user=self_member,
-                logger=self.logger)
+            action = make_alert_view(repeated_message.guild.id, member.id)
+            await self.store_alert(repeated_message.guild.id, member.id)
         else:
             action = None
             embed.description += "; Manual action required, bot lacks permissions"
@@ -162,41 +323,479 @@ class SpamATonModule(commands.Cog):
         # send message
         await channel.send(embed=embed, view=action)
 
+    async def store_alert(self, guild_id: int, user_id: int) -> None:
+        """
+        Stores alert, so its buttons can be handled later
+        :param guild_id: guild id
+        :param user_id: id of flagged user
+        """
+
+        if self.db is None:
+            return
+
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.execute("""
+                INSERT INTO Alerts (GuildId, UserId, State, CreatedAt) VALUES (?, ?, 'open', ?)
+                ON CONFLICT (GuildId, UserId) DO UPDATE SET
+                    State = excluded.State,
+                    CreatedAt = excluded.CreatedAt,
+                    HandledBy = NULL""", (guild_id, user_id, int(time.time())))
+        await self.db.commit()
+
+    async def handle_alert_action(
+            self,
+            interaction: discord.Interaction,
+            action: str,
+            guild_id: int,
+            user_id: int
+    ) -> None:
+        """
+        Handles alert button press
+        :param interaction: button interaction
+        :param action: 'ban' or 'untimeout'
+        :param guild_id: guild id
+        :param user_id: id of flagged user
+        """
+
+        # check the alert is still open
+        state = None
+        if interaction.guild is not None and interaction.guild.id == guild_id:
+            async with self.db.execute(
+                    "SELECT State FROM Alerts WHERE GuildId = ? AND UserId = ?", (guild_id, user_id)) as cur:
+                row = await cur.fetchone()
+            state = row[0] if row is not None else None
+        if state != "open":
+            await interaction.response.send_message(
+                "This alert was already handled, or has expired", ephemeral=True)
+            return
+
+        # check permission; also when member has left, as removing the timeout clears the flag for all guilds
+        permission = "ban_members" if action == "ban" else "moderate_members"
+        if not getattr(interaction.user.guild_permissions, permission):
+            await interaction.response.send_message(
+                f"You need '{permission}' permission to do that", ephemeral=True)
+            return
+
+        # member may have left the guild already
+        member = interaction.guild.get_member(user_id)
+        if member is None:
+            try:
+                member = await interaction.guild.fetch_member(user_id)
+            except discord.NotFound:
+                pass
+
+        # check privilege
+        if member is not None and not has_privilege(interaction.user, member):
+            raise commands.MissingPermissions([permission], f"User {member.mention} has higher or equal privilege")
+
+        if action == "ban":
+            if member is not None:
+                await member_ban(
+                    member=member,
+                    delete_within_days=2,
+                    reason="Spam",
+                    author=interaction.user,
+                    logger=self.logger)
+            else:
+                await interaction.guild.ban(discord.Object(user_id), delete_message_days=2, reason="Spam")
+            state = "banned"
+        else:
+            if member is not None:
+                await member.edit(timed_out_until=None)
+            state = "untimed"
+
+            # moderator decided it wasn't spam; stop other guilds from acting on it
+            if self.offenders is not None:
+                await self.offenders.clear(user_id)
+
+        # mark as handled
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.execute(
+                "UPDATE Alerts SET State = ?, HandledBy = ? WHERE GuildId = ? AND UserId = ?",
+                (state, interaction.user.id, guild_id, user_id))
+        await self.db.commit()
+
+        # disable buttons
+        await interaction.response.edit_message(view=make_alert_view(guild_id, user_id, disabled=True))
+
+    async def timeout_raid(self, repeated_message: discord.Message, authors: list[int], fingerprint: int):
+        """
+        Timeout all members, that posted the same or similar content
+        """
+
+        guild = repeated_message.guild
+
+        # get self member
+        self_member = guild.get_member(self.client.user.id)
+
+        # split members, by whether bot can timeout them
+        members = [member for member in (guild.get_member(x) for x in authors) if member is not None]
+        punished = [member for member in members if has_privilege(self_member, member)]
+        unpunished = [member for member in members if not has_privilege(self_member, member)]
+
+        # timeout users at once
+        results = await asyncio.gather(*[
+            member_timeout(
+                member=member,
+                duration=timedelta(minutes=self.module_config.timeout_duration),
+                reason="possible raid",
+                author=self_member,
+                logger=self.logger)
+            for member in punished], return_exceptions=True)
+        for member, result in zip(punished, results):
+            if isinstance(result, Exception):
+                self.logger.warning(f"Failed to timeout raid member {member.id}", exc_info=result)
+
+        # delete raid messages
+        self.schedule_deletion(
+            self.raid_indexes[guild.id].get_records(fingerprint, [member.id for member in punished]))
+        for member in punished:
+            self.user_statistics.clear(member.id)
+            self.rate_limiter.remove(guild.id, member.id)
+
+        # share with other guilds
+        for member in punished:
+            await self.flag_offender(
+                member.id, guild.id, "possible raid", self.offender_fingerprints(repeated_message, []))
+
+        # create notification
+        # fetch channel id
+        channel = self.client.get_channel(self.guild_config[guild.id].notification_channel_id)
+
+        # get questionable content
+        message_content = repeated_message.content + "\n" + "\n".join(x.url for x in repeated_message.attachments)
+        message_content = message_content[:1000]
+
+        # create embed
+        embed = discord.Embed(
+            title="Raid detected",
+            description=f"Accounts, that posted the same message: {len(members)}",
+            color=discord.Color.red())
+        embed.add_field(name="Message content", value=message_content, inline=False)
+        if len(punished) > 0:
+            embed.add_field(
+                name="Timed out",
+                value=" ".join(member.mention for member in punished)[:1000],
+                inline=False)
+        if len(unpunished) > 0:
+            embed.add_field(
+                name="Manual action required, bot lacks permissions",
+                value=" ".join(member.mention for member in unpunished)[:1000],
+                inline=False)
+
+        # send message
+        await channel.send(embed=embed)
+
+    def schedule_deletion(self, records: list[MessageRecord]) -> None:
+        """
+        Deletes recorded messages in background, so alerts are not delayed by deletions
+        :param records: message records
+        """
+
+        task = asyncio.create_task(self.delete_records(records))
+        self._deletion_tasks.add(task)
+        task.add_done_callback(self._deletion_tasks.discard)
+
+    async def delete_records(self, records: list[MessageRecord]) -> None:
+        """
+        Deletes recorded messages. Messages are grouped by channel, and channels are processed concurrently
+        :param records: message records
+        """
+
+        # group by channel
+        channels = dict()
+        for record in records:
+            channels.setdefault(record.channel_id, []).append(record)
+
+        # define semaphore
+        sem = asyncio.Semaphore(self.module_config.delete_concurrency)
+
+        async def coro(_channel_id, _records):
+            async with sem:
+                await self.delete_channel_records(_channel_id, _records)
+
+        results = await asyncio.gather(*[coro(*x) for x in channels.items()], return_exceptions=True)
+        for channel_id, result in zip(channels, results):
+            if isinstance(result, Exception):
+                self.logger.warning(f"Failed to delete messages in channel {channel_id}", exc_info=result)
+
+    async def delete_channel_records(self, channel_id: int, records: list[MessageRecord]) -> None:
+        """
+        Deletes recorded messages in one channel.
+        Messages younger than 14 days are deleted in bulk, others - one by one
+        :param channel_id: channel id
+        :param records: message records from that channel
+        """
+
+        channel = self.client.get_channel(channel_id)
+        if channel is None:
+            return
+
+        # split messages by whether they can be bulk deleted; leave a minute of margin
+        single = records
+        if hasattr(channel, "delete_messages"):
+            bulk_after = time.time() - BULK_DELETE_MAX_AGE + 60
+            bulk = [discord.Object(x.message_id) for x in records if x.timestamp > bulk_after]
+            single = [x for x in records if x.timestamp <= bulk_after]
+
+            for i in range(0, len(bulk), BULK_DELETE_LIMIT):
+                try:
+                    await channel.delete_messages(bulk[i:i + BULK_DELETE_LIMIT], reason="Spam")
+                except discord.NotFound:  # single message was already deleted
+                    pass
+
+        for record in single:
+            try:
+                await channel.get_partial_message(record.message_id).delete()
+            except discord.NotFound:  # already deleted
+                pass
+
+    def offender_fingerprints(
+            self,
+            message: discord.Message,
+            records: list[MessageRecord]
+    ) -> list[tuple[str, int]]:
+        """
+        Picks fingerprints to be shared with other guilds.
+        Text is only shared, if it's long enough to not be a common phrase (same rule as for raids)
+        :param message: message, that got the user flagged
+        :param records: user's recent messages
+        :return: list of (kind, fingerprint)
+        """
+
+        fingerprints = {("image", x.image_hash) for x in records if x.image_hash is not None}
+        if self.is_raid_candidate(message):
+            fingerprints.add(("text", compute_message_fingerprint(message)))
+        return list(fingerprints)
+
+    async def flag_offender(
+            self,
+            user_id: int,
+            guild_id: int,
+            reason: str,
+            fingerprints: list[tuple[str, int]]
+    ) -> None:
+        """
+        Stores offender in shared store
+        :param user_id: user id
+        :param guild_id: guild, where user was flagged
+        :param reason: reason
+        :param fingerprints: list of (kind, fingerprint)
+        """
+
+        if self.offenders is None:
+            return
+
+        try:
+            await self.offenders.flag(user_id, guild_id, reason, int(time.time()), fingerprints)
+        except aiosqlite.Error as e:
+            self.logger.warning(f"Failed to store offender {user_id}", exc_info=e)
+
+    async def check_offender(self, message: discord.Message, record: MessageRecord) -> bool:
+        """
+        Checks whether author or content of the message were flagged before, in this or any other guild.
+        Acts according to guild's 'offender_action'
+        :param message: user message
+        :param record: message record
+        :return: True if author was timed out
+        """
+
+        if self.offenders is None:
+            return False
+
+        # auto-actions are opt-in
+        action = self.guild_config[message.guild.id].get("offender_action", "none")
+        if action == "none":
+            return False
+
+        # flags from this guild were acted on, when the user was flagged; flags from other guilds are acted on once
+        offender = await self.offenders.get_offender(message.author.id)
+        if offender is not None and offender[0] == message.guild.id:
+            offender = None
+        elif offender is not None:
+            acted = await self.offenders.get_action(message.guild.id, message.author.id)
+            if acted is not None and acted[0] == offender[2]:
+                offender = None
+
+        # check the author, then the content
+        reason = None
+        flagged_at = None
+        if offender is not None:
+            reason = f"known offender, flagged for {offender[1]}"
+            flagged_at = offender[2]
+        elif record.image_hash is not None and await self.offenders.get_fingerprint("image", record.image_hash) is not None:
+            reason = "known spam image"
+        elif (self.is_raid_candidate(message)
+              and await self.offenders.get_fingerprint("text", record.fingerprint) is not None):
+            reason = "known spam message"
+        if reason is None:
+            return False
+
+        # remember the flag, so user isn't acted on again after timeout ends or bot restarts
+        try:
+            if flagged_at is not None:
+                await self.offenders.set_action(message.guild.id, message.author.id, flagged_at, int(time.time()))
+            elif action == "alert":  # alert about flagged content of every user once
+                if await self.offenders.get_action(message.guild.id, message.author.id) is not None:
+                    return False
+                await self.offenders.set_action(message.guild.id, message.author.id, None, int(time.time()))
+        except aiosqlite.Error as e:
+            self.logger.warning(f"Failed to store action on offender {message.author.id}", exc_info=e)
+
+        if action == "timeout":
+            # message is added to the window, so it's deleted with the rest;
+            # user is not flagged again, as that would only repeat the existing flag
+            self.user_statistics.add(message.author.id, record)
+            await self.timeout_member(message.author, message, reason, flag=False)
+            return True
+
+        # create notification
+        # fetch channel id
+        channel = self.client.get_channel(self.guild_config[message.guild.id].notification_channel_id)
+
+        # get questionable content
+        message_content = message.content + "\n" + "\n".join(x.url for x in message.attachments)
+        message_content = message_content[:1000]
+
+        # create embed
+        embed = discord.Embed(
+            title="Known offender",
+            description=f"{message.author.mention} was flagged before",
+            color=discord.Color.yellow())
+        embed.add_field(name="Reason", value=reason, inline=False)
+        embed.add_field(name="Message content", value=message_content, inline=False)
+
+        # send message
+        await channel.send(embed=embed)
+        return False
+
+    def find_blocked_domain(self, message: discord.Message) -> str | None:
+        """
+        Checks message links against guild's and global blocklists
+        :param message: user message
+        :return: blocked domain, or None if message has no blocked links
+        """
+
+        domains = extract_domains(message)
+        if len(domains) == 0:
+            return None
+
+        guild_blocklist = self.guild_blocklists.get(message.guild.id)
+        if guild_blocklist is not None and (domain := guild_blocklist.match(domains)) is not None:
+            return domain
+        return self.blocklist.match(domains)
+
+    def is_raid_candidate(self, message: discord.Message) -> bool:
+        """
+        Checks if message is long enough to be checked for raids.
+        Short messages (ex. 'hi', 'lol') are often posted by many users at once
+        :param message: user message
+        :return: True if message should be checked
+        """
+
+        return len(message.content.strip()) >= self.module_config.raid_min_length or len(message.attachments) > 0
+
     async def process_message(self, repeated_message: discord.Message):
         """
         Processes the users message
         """
 
-        # if the user wasn't in statistics
-        if repeated_message.author.id not in self.user_statistics:
-            self.user_statistics[repeated_message.author.id] = []
+        # check links against blocklists
+        blocked_domain = self.find_blocked_domain(repeated_message)
 
-        # get user stat list
-        user_statistic = self.user_statistics[repeated_message.author.id]
+        # hash images, so re-uploaded and renamed images are counted as repeats
+        image_hash = None
+        if blocked_domain is None and self.image_hasher is not None and len(repeated_message.attachments) > 0:
+            image_hash = await self.image_hasher.hash_message(repeated_message)
 
-        # delete outdated messages
-        for message in user_statistic[::]:
-            if (datetime.now(timezone.utc) - message.created_at).seconds > self.module_config.message_window:
-                user_statistic.remove(message)
+        record = MessageRecord.from_message(repeated_message, image_hash)
+
+        # known scam link; message is added to the window, so it's deleted with the rest
+        if blocked_domain is not None:
+            self.user_statistics.add(repeated_message.author.id, record)
+            await self.timeout_member(repeated_message.author, repeated_message, f"blocked domain '{blocked_domain}'")
+            return
+
+        # check for offenders, flagged before in any guild
+        if await self.check_offender(repeated_message, record):
+            return
 
-        # append new repeated_message
-        user_statistic.append(repeated_message)
+        # check for raids; same content posted by many accounts
+        if self.is_raid_candidate(repeated_message):
+            raid_index = self.raid_indexes.get(repeated_message.guild.id)
+            if raid_index is None:
+                raid_index = self.raid_indexes[repeated_message.guild.id] = RaidIndex(
+                    window=self.module_config.raid_window,
+                    author_limit=self.module_config.raid_author_limit,
+                    max_distance=self.module_config.similarity_distance)
 
-        # compute repeated_message hash
-        original_message_hash = self.compute_message_content_hash(repeated_message)
+            authors = raid_index.add(record)
+            if len(authors) > 0:
+                await self.timeout_raid(repeated_message, authors, record.fingerprint)
+                return
 
-        # compare to other messages
-        repeats = 0
-        channels = set()
-        for message in user_statistic:
-            message_hash = self.compute_message_content_hash(message)
-            if original_message_hash == message_hash:
-                repeats += 1
-                channels.add(message.channel.id)
+        # add message to user's window; outdated messages are removed, and repeat counts are updated
+        repeats, channels = self.user_statistics.add(repeated_message.author.id, record)
 
         # if repeat count and channel count is more than allowed => timeout user
-        if repeats >= self.module_config.repeat_limit and len(channels) >= self.module_config.repeat_limit:
+        if repeats >= self.module_config.repeat_limit and channels >= self.module_config.repeat_limit:
             await self.timeout_member(repeated_message.author, repeated_message)
+            return
+
+        # unique messages, sent too fast, or with too many mentions or attachments
+        exceeded = self.rate_limiter.add(
+            repeated_message.guild.id,
+            repeated_message.author.id,
+            record.timestamp,
+            compute_message_costs(repeated_message))
+        if exceeded is not None:
+            # fast, but unique messages are not shared with other guilds
+            await self.timeout_member(repeated_message.author, repeated_message, f"too many {exceeded}", flag=False)
+
+    @app_commands.command(name="spamaton-status", description="shows spam detection state")
+    async def status_command(
+            self,
+            interaction: discord.Interaction
+    ) -> None:
+        """
+        Shows tracked users and memory usage. Can only be used by owner of the bot
+        """
+
+        # check bot ownership
+        await check_bot_ownership(self.client, interaction)
+
+        # make embed
+        embed = discord.Embed(
+            title="SpamATon status",
+            color=discord.Color.orange())
+        embed.add_field(
+            name="User statistics",
+            value="\n".join(f"{key}: {val}" for key, val in self.user_statistics.state().items()))
+        embed.add_field(
+            name="Rate limits",
+            value="\n".join(f"{key}: {val}" for key, val in self.rate_limiter.state().items()))
+        embed.add_field(
+            name="Raid indexes",
+            value=f"guilds: {len(self.raid_indexes)}\n"
+                  f"records: {sum(len(x) for x in self.raid_indexes.values())}")
+        embed.add_field(
+            name="Blocklists",
+            value=f"global: {len(self.blocklist)}\n"
+                  f"guilds: {len(self.guild_blocklists)}\n"
+                  f"guild domains: {sum(len(x) for x in self.guild_blocklists.values())}")
+        if self.offenders is not None:
+            embed.add_field(
+                name="Offenders",
+                value="\n".join(f"{key}: {val}" for key, val in self.offenders.state().items()))
+        if self.image_hasher is not None:
+            embed.add_field(
+                name="Image hashes",
+                value="\n".join(f"{key}: {val}" for key, val in self.image_hasher.state().items()))
+
+        # send response
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
     @commands.Cog.listener("on_message")
     async def on_message(self, message: discord.Message) -> None:
@@ -0,0 +1,323 @@
+"""
+Offenders, flagged in any guild, shared by all guilds
+"""
+
+
+import math
+import time
+import hashlib
+import aiosqlite
+from typing import Iterator
+
+
+def to_signed(value: int) -> int:
+    """
+    Converts unsigned 64 bit integer (ex. fingerprint) to signed one, as SQLite integers are signed
+    """
+
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class BloomFilter:
+    """
+    Set of integers with no false negatives, and rare false positives.
+    Checking costs O(1) regardless of amount of added integers
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        """
+        :param capacity: expected amount of integers
+        :param error_rate: false positive rate at full capacity
+        """
+
+        self.capacity: int = max(capacity, 1)
+        self.error_rate: float = error_rate
+
+        # optimal amount of bits and hashes
+        self.size: int = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes: int = max(round(self.size / self.capacity * math.log(2)), 1)
+
+        self.bits: bytearray = bytearray((self.size + 7) // 8)
+        self.count: int = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def positions(self, key: bytes) -> Iterator[int]:
+        """
+        :return: bit positions of the key; 2 hashes are combined to make the rest (Kirsch-Mitzenmacher).
+        Positions are generated lazily, so checking absent key usually stops at first few
+        """
+
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8])
+        h2 = int.from_bytes(digest[8:]) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: bytes) -> None:
+        """
+        Adds key to the filter
+        """
+
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class OffenderStore:
+    """
+    Persistent store of flagged users and fingerprints of their messages. Flags expire after 'ttl' seconds.
+    Bloom filter is checked first, so checking users, that were never flagged, doesn't touch the database
+    """
+
+    def __init__(self, db: aiosqlite.Connection, capacity: int, ttl: int, error_rate: float = 0.001):
+        """
+        :param db: database connection
+        :param capacity: expected amount of offenders and fingerprints; filter is made larger, if there are more
+        :param ttl: for how many seconds flags are kept
+        :param error_rate: false positive rate of the filter
+        """
+
+        self.db: aiosqlite.Connection = db
+        self.capacity: int = capacity
+        self.ttl: int = ttl
+        self.error_rate: float = error_rate
+        self.filter: BloomFilter = BloomFilter(capacity, error_rate)
+
+        # metrics
+        self.checks: int = 0
+        self.queries: int = 0
+        self.hits: int = 0
+
+    @staticmethod
+    def user_key(user_id: int) -> bytes:
+        """
+        :return: filter key of the user
+        """
+
+        return b"u" + user_id.to_bytes(8)
+
+    @staticmethod
+    def fingerprint_key(kind: str, fingerprint: int) -> bytes:
+        """
+        :return: filter key of the fingerprint
+        """
+
+        return kind.encode("utf-8") + fingerprint.to_bytes(8)
+
+    def oldest_timestamp(self) -> int:
+        """
+        :return: timestamp of the oldest flag, that didn't expire yet
+        """
+
+        return int(time.time()) - self.ttl
+
+    async def load(self) -> None:
+        """
+        Creates tables, and fills the filter
+        """
+
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS Offenders (
+                    UserId INTEGER PRIMARY KEY,
+                    GuildId INTEGER,
+                    Reason TEXT,
+                    FlaggedAt INTEGER,
+                    Count INTEGER DEFAULT 1
+                );""")
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS OffenderFingerprints (
+                    Kind TEXT,
+                    Fingerprint INTEGER,
+                    UserId INTEGER,
+                    FlaggedAt INTEGER,
+                    PRIMARY KEY (Kind, Fingerprint)
+                );""")
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS OffenderActions (
+                    GuildId INTEGER,
+                    UserId INTEGER,
+                    FlaggedAt INTEGER,
+                    ActedAt INTEGER,
+                    PRIMARY KEY (GuildId, UserId)
+                );""")
+
+            # load flagged users and fingerprints, that didn't expire
+            oldest = self.oldest_timestamp()
+            query = await cur.execute("SELECT UserId FROM Offenders WHERE FlaggedAt >= ?", (oldest,))
+            users = [x for x, in await query.fetchall()]
+            query = await cur.execute(
+                "SELECT Kind, Fingerprint FROM OffenderFingerprints WHERE FlaggedAt >= ?", (oldest,))
+            fingerprints = await query.fetchall()
+
+        # commit database changes
+        await self.db.commit()
+
+        # leave room for new entries
+        self.filter = BloomFilter(max(self.capacity, 2 * (len(users) + len(fingerprints))), self.error_rate)
+        for user_id in users:
+            self.filter.add(self.user_key(user_id))
+        for kind, fingerprint in fingerprints:
+            self.filter.add(self.fingerprint_key(kind, fingerprint & ((1 << 64) - 1)))
+
+    async def flag(
+            self,
+            user_id: int,
+            guild_id: int,
+            reason: str,
+            timestamp: int,
+            fingerprints: list[tuple[str, int]]
+    ) -> None:
+        """
+        Flags the user, and fingerprints of their messages
+        :param user_id: user id
+        :param guild_id: guild, where user was flagged
+        :param reason: reason
+        :param timestamp: when user was flagged
+        :param fingerprints: list of (kind, fingerprint); kind is 'text' or 'image'
+        """
+
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.execute("""
+                INSERT INTO Offenders (UserId, GuildId, Reason, FlaggedAt) VALUES (?, ?, ?, ?)
+                ON CONFLICT (UserId) DO UPDATE SET
+                    GuildId = excluded.GuildId,
+                    Reason = excluded.Reason,
+                    FlaggedAt = excluded.FlaggedAt,
+                    Count = CASE WHEN FlaggedAt >= ? THEN Count + 1 ELSE 1 END""",
+                (user_id, guild_id, reason, timestamp, timestamp - self.ttl))
+            await cur.executemany("""
+                INSERT INTO OffenderFingerprints (Kind, Fingerprint, UserId, FlaggedAt) VALUES (?, ?, ?, ?)
+                ON CONFLICT (Kind, Fingerprint) DO UPDATE SET
+                    UserId = excluded.UserId,
+                    FlaggedAt = excluded.FlaggedAt""",
+                [(kind, to_signed(fingerprint), user_id, timestamp) for kind, fingerprint in fingerprints])
+        await self.db.commit()
+
+        # add to the filter
+        self.filter.add(self.user_key(user_id))
+        for kind, fingerprint in fingerprints:
+            self.filter.add(self.fingerprint_key(kind, fingerprint))
+
+    async def clear(self, user_id: int) -> None:
+        """
+        Removes flag of the user, fingerprints of their messages, and actions guilds took on them.
+        Filter can't remove keys, so they are only dropped from it on next load
+        :param user_id: user id
+        """
+
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.execute("DELETE FROM Offenders WHERE UserId = ?", (user_id,))
+            await cur.execute("DELETE FROM OffenderFingerprints WHERE UserId = ?", (user_id,))
+            await cur.execute("DELETE FROM OffenderActions WHERE UserId = ?", (user_id,))
+        await self.db.commit()
+
+    async def prune(self) -> None:
+        """
+        Removes expired flags, fingerprints and actions
+        """
+
+        oldest = self.oldest_timestamp()
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.execute("DELETE FROM Offenders WHERE FlaggedAt < ?", (oldest,))
+            await cur.execute("DELETE FROM OffenderFingerprints WHERE FlaggedAt < ?", (oldest,))
+            await cur.execute("DELETE FROM OffenderActions WHERE ActedAt < ?", (oldest,))
+        await self.db.commit()
+
+    async def set_action(self, guild_id: int, user_id: int, flagged_at: int | None, timestamp: int) -> None:
+        """
+        Remembers, that guild acted on the user
+        :param guild_id: guild id
+        :param user_id: user id
+        :param flagged_at: timestamp of the flag, that guild acted on; None if guild acted on flagged content
+        :param timestamp: when guild acted on the user
+        """
+
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.execute("""
+                INSERT INTO OffenderActions (GuildId, UserId, FlaggedAt, ActedAt) VALUES (?, ?, ?, ?)
+                ON CONFLICT (GuildId, UserId) DO UPDATE SET
+                    FlaggedAt = excluded.FlaggedAt,
+                    ActedAt = excluded.ActedAt""", (guild_id, user_id, flagged_at, timestamp))
+        await self.db.commit()
+
+    async def get_action(self, guild_id: int, user_id: int) -> tuple[int | None] | None:
+        """
+        Checks whether guild acted on the user
+        :param guild_id: guild id
+        :param user_id: user id
+        :return: timestamp of the flag, that guild acted on (None for flagged content);
+        None if guild never acted on the user, or the action expired
+        """
+
+        async with self.db.execute(
+                "SELECT FlaggedAt FROM OffenderActions WHERE GuildId = ? AND UserId = ? AND ActedAt >= ?",
+                (guild_id, user_id, self.oldest_timestamp())) as cur:
+            return await cur.fetchone()
+
+    async def get_offender(self, user_id: int) -> tuple[int, str, int, int] | None:
+        """
+        Checks whether user was flagged
+        :param user_id: user id
+        :return: guild id, reason, timestamp and amount of times user was flagged;
+        None if user was never flagged, or the flag expired
+        """
+
+        self.checks += 1
+        if self.user_key(user_id) not in self.filter:
+            return None
+
+        self.queries += 1
+        async with self.db.execute(
+                "SELECT GuildId, Reason, FlaggedAt, Count FROM Offenders WHERE UserId = ? AND FlaggedAt >= ?",
+                (user_id, self.oldest_timestamp())) as cur:
+            row = await cur.fetchone()
+
+        if row is not None:
+            self.hits += 1
+        return row
+
+    async def get_fingerprint(self, kind: str, fingerprint: int) -> int | None:
+        """
+        Checks whether fingerprint was flagged
+        :param kind: 'text' or 'image'
+        :param fingerprint: fingerprint
+        :return: id of the user, who posted it; None if fingerprint was never flagged, or the flag expired
+        """
+
+        self.checks += 1
+        if self.fingerprint_key(kind, fingerprint) not in self.filter:
+            return None
+
+        self.queries += 1
+        async with self.db.execute(
+                "SELECT UserId FROM OffenderFingerprints WHERE Kind = ? AND Fingerprint = ? AND FlaggedAt >= ?",
+                (kind, to_signed(fingerprint), self.oldest_timestamp())) as cur:
+            row = await cur.fetchone()
+
+        if row is None:
+            return None
+        self.hits += 1
+        return row[0]
+
+    def state(self) -> dict[str, int]:
+        """
+        Returns gauges and metrics
+        :return: dictionary with state
+        """
+
+        return {
+            "filter_entries": len(self.filter),
+            "filter_kib": round(len(self.filter.bits) / 1024),
+            "checks": self.checks,
+            "queries": self.queries,
+            "hits": self.hits}
@@ -0,0 +1,127 @@
+"""
+Per-user rate limits, used to find floods of unique messages and mention storms
+"""
+
+
+import discord
+from typing import Any
+
+
+# counted kinds of activity
+KINDS: tuple[str, ...] = ("messages", "mentions", "attachments")
+
+
+def compute_message_costs(message: discord.Message) -> tuple[int, int, int]:
+    """
+    Computes how much of every kind of activity the message takes
+    :param message: user message
+    :return: messages, mentions and attachments counts
+    """
+
+    mentions = len(message.mentions) + len(message.role_mentions) + int(message.mention_everyone)
+    return 1, mentions, len(message.attachments)
+
+
+class RateState:
+    """
+    Token buckets of one user in one guild
+    """
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: list[float], updated: float):
+        """
+        :param tokens: tokens left in every bucket
+        :param updated: timestamp of last update
+        """
+
+        self.tokens: list[float] = tokens
+        self.updated: float = updated
+
+
+class RateLimiter:
+    """
+    Token buckets for every kind of activity of every (guild, user) pair.
+    Bucket of a kind holds up to 'limit' tokens, refills at 'limit / period' tokens per second,
+    and is exceeded when activity takes more tokens than there are left.
+    Checking a message costs O(1)
+    """
+
+    def __init__(self, limits: dict[str, dict[str, float]]):
+        """
+        :param limits: "kind": {"limit": ..., "period": ...}; kinds with limit of 0 are not checked
+        """
+
+        self.capacities: list[float] = [limits[kind]["limit"] for kind in KINDS]
+        self.rates: list[float] = [
+            limits[kind]["limit"] / limits[kind]["period"] if limits[kind]["limit"] > 0 else 0
+            for kind in KINDS]
+
+        # after that many seconds of inactivity, all buckets are full again
+        self.refill_time: float = max(limits[kind]["period"] for kind in KINDS)
+
+        # (guild_id, user_id): state
+        self.states: dict[tuple[int, int], RateState] = dict()
+
+        # metrics
+        self.exceeded: dict[str, int] = {kind: 0 for kind in KINDS}
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def add(self, guild_id: int, user_id: int, timestamp: float, costs: tuple[int, ...]) -> str | None:
+        """
+        Takes tokens for user's activity
+        :param guild_id: guild id
+        :param user_id: user id
+        :param timestamp: timestamp of the activity
+        :param costs: amount of tokens for every kind
+        :return: first exceeded kind, or None if user is within limits
+        """
+
+        key = (guild_id, user_id)
+        state = self.states.get(key)
+        if state is None:
+            state = self.states[key] = RateState(list(self.capacities), timestamp)
+
+        elapsed = max(timestamp - state.updated, 0)
+        state.updated = max(timestamp, state.updated)
+
+        exceeded = None
+        tokens = state.tokens
+        for i in range(len(KINDS)):
+            if self.capacities[i] == 0:
+                continue
+            tokens[i] = min(self.capacities[i], tokens[i] + elapsed * self.rates[i]) - costs[i]
+            if tokens[i] < 0 and exceeded is None:
+                exceeded = KINDS[i]
+
+        if exceeded is not None:
+            self.exceeded[exceeded] += 1
+        return exceeded
+
+    def remove(self, guild_id: int, user_id: int) -> None:
+        """
+        Resets limits of the user
+        :param guild_id: guild id
+        :param user_id: user id
+        """
+
+        self.states.pop((guild_id, user_id), None)
+
+    def sweep(self, timestamp: float) -> None:
+        """
+        Removes users, whose buckets are full again
+        :param timestamp: current timestamp
+        """
+
+        for key in [key for key, state in self.states.items() if timestamp - state.updated >= self.refill_time]:
+            del self.states[key]
+
+    def state(self) -> dict[str, Any]:
+        """
+        Returns gauges and metrics
+        :return: dictionary with state
+        """
+
+        return {"users": len(self.states)} | {f"exceeded_{kind}": val for kind, val in self.exceeded.items()}
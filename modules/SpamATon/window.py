@@ -0,0 +1,475 @@
+"""
+Sliding windows of recent messages
+"""
+
+
+import sys
+import math
+import discord
+from typing import Any, Callable
+from collections import deque, OrderedDict
+from dataclasses import dataclass
+from modules.SpamATon.fingerprints import LSHIndex, fingerprint, hamming_distance, minhash_distance
+
+
+@dataclass(frozen=True, slots=True)
+class MessageRecord:
+    """
+    Compact record of a message
+    """
+
+    timestamp: float
+    fingerprint: int
+    author_id: int
+    channel_id: int
+    message_id: int
+    image_hash: int | None = None
+
+    @staticmethod
+    def from_message(message: discord.Message, image_hash: int | None = None):
+        """
+        Generates 'self' from discord message
+        :param message: user message
+        :param image_hash: perceptual hash of message's image
+        """
+
+        return MessageRecord(
+            timestamp=message.created_at.timestamp(),
+            fingerprint=compute_message_fingerprint(message),
+            author_id=message.author.id,
+            channel_id=message.channel.id,
+            message_id=message.id,
+            image_hash=image_hash)
+
+
+def compute_message_fingerprint(message: discord.Message) -> int:
+    """
+    Computes message content fingerprint
+    :param message: user message
+    :return: 64 bit MinHash fingerprint
+    """
+
+    content = message.content + "".join(f" {x.size}{x.filename}" for x in message.attachments)
+    content += "".join(f" {x.id}" for x in message.stickers)
+    return fingerprint(content)
+
+
+class ContentCounter:
+    """
+    Counts of similar contents, and channels they were sent in.
+    Similar fingerprints are grouped into clusters by LSH index, so counting doesn't depend on amount of contents
+    """
+
+    def __init__(self, max_distance: int = 0, distance: Callable[[int, int], int] = hamming_distance):
+        """
+        :param max_distance: maximum distance of fingerprints, that are counted as the same content
+        :param distance: fingerprint distance function
+        """
+
+        # clusters of similar fingerprints
+        self.index: LSHIndex = LSHIndex(max_distance, distance)
+
+        # "representative": count
+        self.counts: dict[int, int] = dict()
+
+        # "representative": {channel_id: count}
+        self.channels: dict[int, dict[int, int]] = dict()
+
+    def add(self, fingerprint: int, channel_id: int) -> tuple[int, int]:
+        """
+        Counts the content
+        :param fingerprint: content fingerprint
+        :param channel_id: channel, content was sent in
+        :return: how many times this or similar content was sent, and in how many channels
+        """
+
+        representative = self.index.add(fingerprint)
+        self.counts[representative] = self.counts.get(representative, 0) + 1
+        channels = self.channels.setdefault(representative, dict())
+        channels[channel_id] = channels.get(channel_id, 0) + 1
+
+        return self.counts[representative], len(channels)
+
+    def remove(self, fingerprint: int, channel_id: int) -> None:
+        """
+        Uncounts the content
+        :param fingerprint: content fingerprint
+        :param channel_id: channel, content was sent in
+        """
+
+        representative = self.index.remove(fingerprint)
+        self.counts[representative] -= 1
+        if self.counts[representative] == 0:
+            del self.counts[representative]
+
+        channels = self.channels[representative]
+        channels[channel_id] -= 1
+        if channels[channel_id] == 0:
+            del channels[channel_id]
+        if len(channels) == 0:
+            del self.channels[representative]
+
+    def clear(self) -> None:
+        """
+        Removes all counts
+        """
+
+        self.counts.clear()
+        self.channels.clear()
+        self.index.clear()
+
+    def memory(self) -> int:
+        """
+        :return: approximate memory used by counts, in bytes
+        """
+
+        memory = sys.getsizeof(self.counts) + sys.getsizeof(self.channels)
+        memory += sum(sys.getsizeof(x) for x in self.channels.values())
+        memory += sys.getsizeof(self.index.representatives) + sys.getsizeof(self.index.references)
+        memory += sys.getsizeof(self.index.sizes) + sys.getsizeof(self.index.buckets)
+        memory += sum(sys.getsizeof(x) for x in self.index.buckets.values())
+        return memory
+
+
+class UserWindow:
+    """
+    Messages sent by user within last 'window' seconds.
+    Repeat counts are updated when messages are added and expired, so checking a message
+    doesn't depend on window size. Text and images are counted separately
+    """
+
+    def __init__(self, window: float, max_distance: int = 0, image_distance: int = 0):
+        """
+        :param window: window length in seconds
+        :param max_distance: maximum amount of different MinHash values of text fingerprints, that are counted as the same content
+        :param image_distance: maximum hamming distance of image hashes, that are counted as the same image
+        """
+
+        self.window: float = window
+
+        # records in order they were added
+        self.records: deque[MessageRecord] = deque()
+
+        # counts of texts and images
+        self.contents: ContentCounter = ContentCounter(max_distance, minhash_distance)
+        self.images: ContentCounter = ContentCounter(image_distance)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def expire(self, timestamp: float) -> None:
+        """
+        Removes records older than 'window' seconds
+        :param timestamp: current timestamp
+        """
+
+        while self.records and timestamp - self.records[0].timestamp > self.window:
+            record = self.records.popleft()
+
+            # update counts
+            self.contents.remove(record.fingerprint, record.channel_id)
+            if record.image_hash is not None:
+                self.images.remove(record.image_hash, record.channel_id)
+
+    def add(self, record: MessageRecord) -> tuple[int, int]:
+        """
+        Expires old records, and adds a new one
+        :param record: message record
+        :return: how many times this or similar content was sent, and in how many channels.
+        When message has an image, the larger of text and image counts is returned
+        """
+
+        self.expire(record.timestamp)
+
+        self.records.append(record)
+        result = self.contents.add(record.fingerprint, record.channel_id)
+        if record.image_hash is not None:
+            result = max(result, self.images.add(record.image_hash, record.channel_id))
+        return result
+
+    def clear(self) -> None:
+        """
+        Removes all records
+        """
+
+        self.records.clear()
+        self.contents.clear()
+        self.images.clear()
+
+
+class UserStatistics:
+    """
+    Windows of all users, with bounded memory.
+    Users, whose window became empty, are evicted by timing wheel.
+    When there are more than 'max_records' records, least recently active users are evicted
+    """
+
+    def __init__(
+            self,
+            window: float,
+            max_records: int,
+            tick: float = 1,
+            max_distance: int = 0,
+            image_distance: int = 0):
+        """
+        :param window: window length in seconds
+        :param max_records: maximum amount of records of all users
+        :param tick: timing wheel tick in seconds
+        :param max_distance: maximum amount of different MinHash values of text fingerprints, that are counted as the same content
+        :param image_distance: maximum hamming distance of image hashes, that are counted as the same image
+        """
+
+        self.window: float = window
+        self.max_distance: int = max_distance
+        self.image_distance: int = image_distance
+        self.max_records: int = max_records
+        self.tick: float = tick
+
+        # "user_id": UserWindow(...); least recently active users first
+        self.windows: OrderedDict[int, UserWindow] = OrderedDict()
+        self.total_records: int = 0
+
+        # timing wheel; users are placed in slot of the tick, when their window becomes empty
+        self.wheel: list[set[int]] = [set() for _ in range(math.ceil(window / tick) + 1)]
+        # "user_id": tick
+        self.scheduled: dict[int, int] = dict()
+        self.last_tick: int | None = None
+
+        # metrics
+        self.swept: int = 0
+        self.evicted: int = 0
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.windows
+
+    def __len__(self) -> int:
+        return len(self.windows)
+
+    def get(self, user_id: int) -> UserWindow | None:
+        """
+        Returns user's window
+        :param user_id: user id
+        :return: window, or None if user is not tracked
+        """
+
+        return self.windows.get(user_id)
+
+    def add(self, user_id: int, record: MessageRecord) -> tuple[int, int]:
+        """
+        Adds record to user's window
+        :param user_id: user id
+        :param record: message record
+        :return: how many times this content was sent, and in how many channels
+        """
+
+        user_window = self.windows.get(user_id)
+        if user_window is None:
+            user_window = self.windows[user_id] = UserWindow(self.window, self.max_distance, self.image_distance)
+        else:
+            self.windows.move_to_end(user_id)
+
+        # add record
+        size = len(user_window)
+        result = user_window.add(record)
+        self.total_records += len(user_window) - size
+
+        # schedule eviction
+        if user_id not in self.scheduled:
+            self.schedule(user_id, record.timestamp + self.window)
+
+        # evict least recently active users, if over the limit
+        while self.total_records > self.max_records and len(self.windows) > 1:
+            self.remove(next(iter(self.windows)))
+            self.evicted += 1
+
+        return result
+
+    def clear(self, user_id: int) -> None:
+        """
+        Removes all records of the user
+        :param user_id: user id
+        """
+
+        if user_id in self.windows:
+            self.total_records -= len(self.windows[user_id])
+            self.windows[user_id].clear()
+
+    def remove(self, user_id: int) -> None:
+        """
+        Stops tracking the user
+        :param user_id: user id
+        """
+
+        self.total_records -= len(self.windows.pop(user_id))
+        tick = self.scheduled.pop(user_id, None)
+        if tick is not None:
+            self.wheel[tick % len(self.wheel)].discard(user_id)
+
+    def schedule(self, user_id: int, timestamp: float) -> None:
+        """
+        Places user into timing wheel
+        :param user_id: user id
+        :param timestamp: when user should be checked
+        """
+
+        tick = math.ceil(timestamp / self.tick)
+        self.scheduled[user_id] = tick
+        self.wheel[tick % len(self.wheel)].add(user_id)
+
+    def sweep(self, timestamp: float) -> None:
+        """
+        Advances timing wheel. Users with empty windows are removed, others are rescheduled
+        :param timestamp: current timestamp
+        """
+
+        current_tick = math.floor(timestamp / self.tick)
+        if self.last_tick is None:
+            self.last_tick = current_tick - 1
+
+        # go through passed slots; every slot is visited at most once
+        first_tick = max(self.last_tick + 1, current_tick - len(self.wheel) + 1)
+        for tick in range(first_tick, current_tick + 1):
+            slot = self.wheel[tick % len(self.wheel)]
+            for user_id in list(slot):
+                if self.scheduled[user_id] > current_tick:  # scheduled for later turn of the wheel
+                    continue
+                slot.discard(user_id)
+                del self.scheduled[user_id]
+
+                # expire records
+                user_window = self.windows[user_id]
+                size = len(user_window)
+                user_window.expire(timestamp)
+                self.total_records -= size - len(user_window)
+
+                # remove, or check again when the last record expires
+                if len(user_window) == 0:
+                    del self.windows[user_id]
+                    self.swept += 1
+                else:
+                    self.schedule(user_id, user_window.records[-1].timestamp + self.window)
+
+        self.last_tick = current_tick
+
+    def state(self) -> dict[str, Any]:
+        """
+        Returns gauges and metrics
+        :return: dictionary with state
+        """
+
+        # approximate memory used by windows
+        memory = 0
+        for user_window in self.windows.values():
+            memory += sys.getsizeof(user_window) + sys.getsizeof(user_window.records)
+            memory += user_window.contents.memory() + user_window.images.memory()
+            for record in user_window.records:
+                memory += sys.getsizeof(record) + sys.getsizeof(record.fingerprint)
+
+        return {
+            "users": len(self.windows),
+            "records": self.total_records,
+            "max_records": self.max_records,
+            "memory_kib": round(memory / 1024),
+            "swept": self.swept,
+            "evicted": self.evicted}
+
+
+class RaidIndex:
+    """
+    Messages sent in a guild within last 'window' seconds, indexed by content fingerprint.
+    Used to find the same or similar content, posted by many different authors
+    """
+
+    def __init__(self, window: float, author_limit: int, max_distance: int = 0):
+        """
+        :param window: window length in seconds
+        :param author_limit: content is flagged when posted by this many distinct authors
+        :param max_distance: maximum amount of different MinHash values of fingerprints, that are counted as the same content
+        """
+
+        self.window: float = window
+        self.author_limit: int = author_limit
+
+        # records in order they were added
+        self.records: deque[MessageRecord] = deque()
+
+        # clusters of similar fingerprints in the window
+        self.index: LSHIndex = LSHIndex(max_distance, minhash_distance)
+
+        # "representative": {author_id: count}
+        self.authors: dict[int, dict[int, int]] = dict()
+
+        # "representative": {channel_id: count}
+        self.channels: dict[int, dict[int, int]] = dict()
+
+        # "representative": {author_id, ...}; authors, that were already flagged for posting this content
+        self.flagged: dict[int, set[int]] = dict()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def expire(self, timestamp: float) -> None:
+        """
+        Removes records older than 'window' seconds
+        :param timestamp: current timestamp
+        """
+
+        while self.records and timestamp - self.records[0].timestamp > self.window:
+            record = self.records.popleft()
+
+            # update counts
+            representative = self.index.remove(record.fingerprint)
+            authors = self.authors[representative]
+            authors[record.author_id] -= 1
+            if authors[record.author_id] == 0:
+                del authors[record.author_id]
+            if len(authors) == 0:
+                del self.authors[representative]
+                self.flagged.pop(representative, None)
+
+            channels = self.channels[representative]
+            channels[record.channel_id] -= 1
+            if channels[record.channel_id] == 0:
+                del channels[record.channel_id]
+            if len(channels) == 0:
+                del self.channels[representative]
+
+    def add(self, record: MessageRecord) -> list[int]:
+        """
+        Expires old records, and adds a new one
+        :param record: message record
+        :return: authors, that are newly flagged for posting this or similar content.
+        When content reaches the limit, all of its authors are returned, after that - only new ones
+        """
+
+        self.expire(record.timestamp)
+
+        self.records.append(record)
+        representative = self.index.add(record.fingerprint)
+        authors = self.authors.setdefault(representative, dict())
+        authors[record.author_id] = authors.get(record.author_id, 0) + 1
+        channels = self.channels.setdefault(representative, dict())
+        channels[record.channel_id] = channels.get(record.channel_id, 0) + 1
+
+        # check the limit
+        if len(authors) < self.author_limit:
+            return []
+
+        flagged = self.flagged.setdefault(representative, set())
+        new_authors = [author_id for author_id in authors if author_id not in flagged]
+        flagged.update(new_authors)
+        return new_authors
+
+    def get_records(self, fingerprint: int, authors: list[int]) -> list[MessageRecord]:
+        """
+        Returns records with given or similar content, posted by given authors
+        :param fingerprint: content fingerprint
+        :param authors: list of author ids
+        :return: list of records
+        """
+
+        authors = set(authors)
+        representative = self.index.representatives.get(fingerprint)
+        return [
+            x for x in self.records
+            if x.author_id in authors and self.index.representatives.get(x.fingerprint) == representative]
@@ -0,0 +1,164 @@
+"""
+Twitch users and games metadata caching
+"""
+
+
+import aiosqlite
+from typing import Any
+from datetime import datetime
+from modules.TwitchNotifs.fetcher import Fetcher
+
+
+class UserCache:
+    """
+    Persistent cache of login -> user id.
+    Users are queried by id, so they are not affected by renames
+    """
+
+    def __init__(self, db: aiosqlite.Connection, ttl: int):
+        """
+        :param db: database connection
+        :param ttl: how many seconds an entry is used before being refreshed
+        """
+
+        self.db: aiosqlite.Connection = db
+        self.ttl: int = ttl
+
+        # "login": ("user_id", updated_at)
+        # user id is None for logins that were never found
+        self.users: dict[str, tuple[str | None, int]] = dict()
+
+        # "user_id": "login"
+        self.logins: dict[str, str] = dict()
+
+        # metrics
+        self.hits: int = 0
+        self.misses: int = 0
+
+    async def load(self) -> None:
+        """
+        Creates the table and loads cached users
+        """
+
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS Users (
+                    Login TEXT PRIMARY KEY,
+                    UserId TEXT,
+                    UpdatedAt INTEGER DEFAULT 0
+                );""")
+
+            query = await cur.execute("SELECT Login, UserId, UpdatedAt FROM Users")
+            for login, user_id, updated_at in await query.fetchall():
+                self.users[login] = (user_id, updated_at)
+                self.logins[user_id] = login
+
+        await self.db.commit()
+
+    async def resolve(self, logins: list[str]) -> dict[str, str]:
+        """
+        Returns user ids for given logins. Missing and outdated entries are fetched in batches
+        :param logins: list of lowercase logins
+        :return: dict of login -> user id. Logins that were never found are not included
+        """
+
+        current_timestamp = int(datetime.now().timestamp())
+
+        # find missing and outdated entries
+        outdated = []
+        for login in logins:
+            if login in self.users and current_timestamp - self.users[login][1] < self.ttl:
+                self.hits += 1
+            else:
+                self.misses += 1
+                outdated.append(login)
+
+        # fetch them; users that were renamed are not found, so they keep their old id
+        if len(outdated) > 0:
+            users = await Fetcher.fetch_users(outdated)
+
+            rows = []
+            for login in outdated:
+                if login in users:
+                    user_id = users[login]["id"]
+                elif login in self.users and self.users[login][0] is not None:
+                    user_id = self.users[login][0]
+                else:  # never found; remembered, so it's not requested every time
+                    self.users[login] = (None, current_timestamp)
+                    continue
+
+                self.users[login] = (user_id, current_timestamp)
+                self.logins[user_id] = login
+                rows.append((login, user_id, current_timestamp))
+
+            async with self.db.cursor() as cur:
+                cur: aiosqlite.Cursor  # help with type hinting
+                await cur.executemany(
+                    "INSERT OR REPLACE INTO Users (Login, UserId, UpdatedAt) VALUES (?, ?, ?)", rows)
+            await self.db.commit()
+
+        return {login: self.users[login][0] for login in logins if self.users.get(login, (None,))[0] is not None}
+
+    def state(self) -> dict[str, Any]:
+        """
+        Returns cache metrics
+        :return: dictionary with metrics
+        """
+
+        return {"entries": len(self.users), "hits": self.hits, "misses": self.misses}
+
+
+class GameCache:
+    """
+    In-memory cache of games with time to live
+    """
+
+    def __init__(self, ttl: int):
+        """
+        :param ttl: how many seconds an entry is kept
+        """
+
+        self.ttl: int = ttl
+
+        # "game_id": (game, fetched_at)
+        self.games: dict[str, tuple[dict, int]] = dict()
+
+        # metrics
+        self.hits: int = 0
+        self.misses: int = 0
+        self.batches: int = 0
+
+    async def resolve(self, game_ids: list[str]) -> dict[str, dict]:
+        """
+        Returns games for given ids. Missing and expired entries are fetched in batches
+        :param game_ids: list of game ids
+        :return: dict of game id -> game. Games that were not found are not included
+        """
+
+        current_timestamp = int(datetime.now().timestamp())
+
+        # find missing and expired entries
+        missing = []
+        for game_id in set(game_ids):
+            if game_id in self.games and current_timestamp - self.games[game_id][1] < self.ttl:
+                self.hits += 1
+            else:
+                self.misses += 1
+                missing.append(game_id)
+
+        # fetch them
+        if len(missing) > 0:
+            self.batches += (len(missing) + Fetcher.BATCH_SIZE - 1) // Fetcher.BATCH_SIZE
+            for game_id, game in (await Fetcher.fetch_games(missing)).items():
+                self.games[game_id] = (game, current_timestamp)
+
+        return {game_id: self.games[game_id][0] for game_id in game_ids if game_id in self.games}
+
+    def state(self) -> dict[str, Any]:
+        """
+        Returns cache metrics
+        :return: dictionary with metrics
+        """
+
+        return {"entries": len(self.games), "hits": self.hits, "misses": self.misses, "batches": self.batches}
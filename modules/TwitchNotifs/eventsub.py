@@ -0,0 +1,173 @@
+"""
+Twitch EventSub webhook transport
+"""
+
+
+import hmac
+import json
+import asyncio
+import hashlib
+import logging
+from aiohttp import web
+from typing import Callable, Awaitable
+from datetime import datetime, timezone, timedelta
+
+
+class EventSubServer:
+    """
+    Embedded web server, that receives EventSub notifications from twitch
+    """
+
+    # request headers
+    MESSAGE_ID: str = "Twitch-Eventsub-Message-Id"
+    MESSAGE_TIMESTAMP: str = "Twitch-Eventsub-Message-Timestamp"
+    MESSAGE_SIGNATURE: str = "Twitch-Eventsub-Message-Signature"
+    MESSAGE_TYPE: str = "Twitch-Eventsub-Message-Type"
+
+    # messages older than that are rejected, and message ids are remembered for that long
+    MESSAGE_MAX_AGE: timedelta = timedelta(minutes=10)
+
+    def __init__(
+            self,
+            secret: str,
+            callback: Callable[[str, dict], Awaitable[None]],
+            host: str,
+            port: int,
+            path: str = "/eventsub",
+            logger: logging.Logger | None = None):
+        """
+        :param secret: secret used when creating subscriptions
+        :param callback: coroutine function, which receives subscription type and event
+        :param host: host to listen on
+        :param port: port to listen on
+        :param path: path that twitch sends notifications to
+        :param logger: logger
+        """
+
+        self.secret: bytes = secret.encode("utf-8")
+        self.callback: Callable[[str, dict], Awaitable[None]] = callback
+        self.host: str = host
+        self.port: int = port
+        self.path: str = path
+        self.logger: logging.Logger = logger if logger is not None else logging.getLogger(__name__)
+
+        # "message_id": received_at
+        self.seen_messages: dict[str, datetime] = dict()
+
+        self._runner: web.AppRunner | None = None
+
+        # running callbacks; references are kept, so they are not garbage collected
+        self._tasks: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        """
+        Starts the web server
+        """
+
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+        self.logger.info(f"EventSub server listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        """
+        Stops the web server
+        """
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def verify(self, headers, body: bytes) -> bool:
+        """
+        Verifies message signature
+        :param headers: request headers
+        :param body: raw request body
+        :return: True if message was signed with our secret
+        """
+
+        try:
+            message = headers[self.MESSAGE_ID].encode("utf-8") + headers[self.MESSAGE_TIMESTAMP].encode("utf-8") + body
+            signature = headers[self.MESSAGE_SIGNATURE]
+        except KeyError:
+            return False
+
+        expected = "sha256=" + hmac.new(self.secret, message, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+    def is_duplicate(self, message_id: str) -> bool:
+        """
+        Checks if message was already received, and remembers it
+        :param message_id: message id
+        :return: True if message is a duplicate
+        """
+
+        now = datetime.now(timezone.utc)
+
+        # forget old messages; they will be rejected by timestamp check anyway
+        for seen_id, received_at in list(self.seen_messages.items()):
+            if now - received_at < self.MESSAGE_MAX_AGE:
+                break
+            del self.seen_messages[seen_id]
+
+        if message_id in self.seen_messages:
+            return True
+        self.seen_messages[message_id] = now
+        return False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """
+        Handles incoming EventSub requests
+        """
+
+        body = await request.read()
+
+        # check the message came from twitch
+        if not self.verify(request.headers, body):
+            return web.Response(status=403)
+
+        # reject old (replayed) messages
+        try:
+            timestamp = datetime.fromisoformat(request.headers[self.MESSAGE_TIMESTAMP])
+        except ValueError:
+            return web.Response(status=403)
+        if datetime.now(timezone.utc) - timestamp > self.MESSAGE_MAX_AGE:
+            return web.Response(status=403)
+
+        payload = json.loads(body)
+        message_type = request.headers.get(self.MESSAGE_TYPE)
+
+        # subscription creation challenge
+        if message_type == "webhook_callback_verification":
+            return web.Response(text=payload["challenge"], content_type="text/plain")
+
+        # subscription was revoked by twitch
+        if message_type == "revocation":
+            self.logger.warning(
+                f"EventSub subscription revoked: "
+                f"{payload['subscription']['type']} ({payload['subscription']['status']})")
+            return web.Response(status=204)
+
+        # notifications may be resent, so they are deduplicated by id
+        if message_type == "notification" and not self.is_duplicate(request.headers[self.MESSAGE_ID]):
+            task = asyncio.create_task(self.dispatch(payload["subscription"]["type"], payload["event"]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        return web.Response(status=204)
+
+    async def dispatch(self, subscription_type: str, event: dict) -> None:
+        """
+        Passes event to callback
+        :param subscription_type: subscription type (ex. 'stream.online')
+        :param event: event data
+        """
+
+        try:
+            await self.callback(subscription_type, event)
+        except Exception as e:
+            self.logger.warning("Error occurred while handling EventSub event", exc_info=e)
@@ -4,15 +4,19 @@ Twitch stream fetching
 
 
 import json
+import time
 import asyncio
 import aiohttp
-from typing import Any
-from datetime import datetime
+from typing import Any, Callable, Awaitable
+from datetime import datetime, timedelta
 from dataclasses import dataclass
+from source.utils import json_loads
 from source.keychain import KeyChain
+from source.settings import VARS_DIRECTORY
+from source.breakers import BreakerRegistry, FetchError
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Stream:
     """
     Dataclass containing information about the stream
@@ -73,54 +77,331 @@ class Stream:
         return self.thumbnail_url.format(width=width, height=height)
 
 
+class TokenManager:
+    """
+    Keeps twitch app access token valid.
+    Refreshes it ahead of expiry, and coalesces concurrent refreshes into one request
+    """
+
+    # token is refreshed this long before it expires
+    REFRESH_MARGIN: timedelta = timedelta(minutes=10)
+
+    def __init__(self, token_path: str):
+        self.token_path: str = token_path
+
+        # "Bearer token" authorization header value
+        self.authorization: str | None = None
+        self.expires_at: datetime | None = None
+
+        self._loaded: bool = False
+        self._refresh_task: asyncio.Task | None = None
+
+    def load(self) -> None:
+        """
+        Loads persisted token
+        """
+
+        self._loaded = True
+        try:
+            with open(self.token_path, "r", encoding="utf-8") as file:
+                token = json.load(file)
+            self.authorization = token["authorization"]
+            self.expires_at = datetime.fromtimestamp(token["expires_at"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self) -> None:
+        """
+        Persists token, so it can be reused after restart
+        """
+
+        try:
+            with open(self.token_path, "w", encoding="utf-8") as file:
+                json.dump({"authorization": self.authorization, "expires_at": self.expires_at.timestamp()}, file)
+        except OSError:
+            pass
+
+    def is_valid(self) -> bool:
+        """
+        :return: True if token is present and doesn't need to be refreshed yet
+        """
+
+        if self.authorization is None or self.expires_at is None:
+            return False
+        return datetime.now() < self.expires_at - self.REFRESH_MARGIN
+
+    async def get(self, fetch_token: Callable[[], Awaitable[dict]]) -> str:
+        """
+        Returns valid authorization header value, refreshing the token if needed
+        :param fetch_token: coroutine function, that fetches new token (OAuth response)
+        :return: authorization header value
+        """
+
+        if not self._loaded:
+            self.load()
+
+        if not self.is_valid():
+            await self.refresh(fetch_token)
+        return self.authorization
+
+    async def refresh(self, fetch_token: Callable[[], Awaitable[dict]]) -> None:
+        """
+        Refreshes token. Concurrent calls wait for the same request
+        :param fetch_token: coroutine function, that fetches new token (OAuth response)
+        """
+
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh(fetch_token))
+            self._refresh_task.add_done_callback(lambda _: setattr(self, "_refresh_task", None))
+
+        await asyncio.shield(self._refresh_task)
+
+    async def _refresh(self, fetch_token: Callable[[], Awaitable[dict]]) -> None:
+        response = await fetch_token()
+
+        self.authorization = f"{response['token_type'].capitalize()} {response['access_token']}"
+        self.expires_at = datetime.now() + timedelta(seconds=response["expires_in"])
+        self.save()
+
+    def invalidate(self, authorization: str) -> None:
+        """
+        Marks token as invalid (ex. after 401 response).
+        Does nothing if the token was already refreshed
+        :param authorization: authorization header value that was rejected
+        """
+
+        if self.authorization == authorization:
+            self.expires_at = None
+
+
+class RateLimiter:
+    """
+    Token bucket, that paces API requests.
+    Synchronized with 'Ratelimit-*' headers of API responses
+    """
+
+    def __init__(self, limit: int = 800, period: float = 60):
+        """
+        :param limit: bucket size (points)
+        :param period: how many seconds it takes to refill an empty bucket
+        """
+
+        self.limit: int = limit
+        self.period: float = period
+        self.tokens: float = limit
+        self.updated_at: float = time.monotonic()
+
+        # when API will refill the bucket ('Ratelimit-Reset'), and until when requests are held after hitting the limit
+        self.reset_at: float | None = None
+        self.blocked_until: float | None = None
+
+        # metrics
+        self.requests: int = 0
+        self.throttled: int = 0
+        self.waiting: int = 0
+        self.wait_time: float = 0
+
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        """
+        Refills the bucket for the time passed since last refill
+        """
+
+        now = time.monotonic()
+
+        # after hitting the limit, bucket stays empty until API resets it
+        if self.blocked_until is not None:
+            if now < self.blocked_until:
+                self.updated_at = now
+                return
+            self.blocked_until = None
+            self.tokens = self.limit
+            self.updated_at = now
+            return
+
+        self.tokens = min(self.limit, self.tokens + (now - self.updated_at) * self.limit / self.period)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        """
+        Takes one point from the bucket. If bucket is empty, waits in queue for it to refill
+        """
+
+        self.waiting += 1
+        try:
+            async with self._lock:
+                # rate limit was hit; wait for the bucket to be reset
+                if self.blocked_until is not None and (delay := self.blocked_until - time.monotonic()) > 0:
+                    self.wait_time += delay
+                    await asyncio.sleep(delay)
+
+                self._refill()
+                if self.tokens < 1:
+                    delay = (1 - self.tokens) * self.period / self.limit
+                    self.wait_time += delay
+                    await asyncio.sleep(delay)
+                    self._refill()
+                self.tokens -= 1
+                self.requests += 1
+        finally:
+            self.waiting -= 1
+
+    def update(self, headers) -> None:
+        """
+        Updates bucket state using response headers
+        :param headers: API response headers
+        """
+
+        try:
+            limit = int(headers["Ratelimit-Limit"])
+            remaining = int(headers["Ratelimit-Remaining"])
+        except (KeyError, ValueError):
+            return
+
+        self._refill()
+        self.limit = limit
+        self.tokens = min(self.tokens, remaining)
+
+        # unix timestamp of bucket reset
+        try:
+            reset_in = float(headers["Ratelimit-Reset"]) - time.time()
+        except (KeyError, ValueError):
+            return
+        self.reset_at = time.monotonic() + min(max(reset_in, 0), self.period)
+
+    def throttle(self) -> None:
+        """
+        Empties the bucket after API rejected a request for hitting the rate limit.
+        Requests are held until the bucket reset time from last 'Ratelimit-Reset' header,
+        or until one point refills if the header is missing
+        """
+
+        now = time.monotonic()
+        self.throttled += 1
+        self.tokens = 0
+        if self.reset_at is not None and self.reset_at > now:
+            self.blocked_until = self.reset_at
+        else:
+            self.blocked_until = now + self.period / self.limit
+
+    def state(self) -> dict[str, Any]:
+        """
+        Returns bucket state and metrics
+        :return: dictionary with state
+        """
+
+        self._refill()
+        return {
+            "limit": self.limit,
+            "remaining": int(self.tokens),
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "waiting": self.waiting,
+            "wait_time": round(self.wait_time, 2)}
+
+
 class Fetcher:
     """
     Main twitch fetcher class
     """
 
-    _access_token: str | None = None
-    _token_type: str | None = None
+    # base urls
+    API_URL: str = "https://api.twitch.tv/helix"
+    AUTH_URL: str = "https://id.twitch.tv/oauth2"
+
+    # maximum amount of 'user_login' parameters per request
+    BATCH_SIZE: int = 100
+
+    # how many times a request is retried after hitting the rate limit
+    MAX_THROTTLED_RETRIES: int = 3
+
+    # helix request pacing
+    rate_limiter: RateLimiter = RateLimiter()
+
+    # app access token
+    token_manager: TokenManager = TokenManager(f"{VARS_DIRECTORY}/twitchnotifs_token.json")
+
+    # "endpoint:name" circuit breakers; only trip on server and network errors
+    endpoint_breakers: BreakerRegistry = BreakerRegistry(client_errors=False)
 
     @classmethod
-    async def fetch_access_token(cls) -> None:
+    async def fetch_access_token(cls) -> dict:
         """
         Fetches twitch API access token
+        :return: OAuth response
         """
 
+        return await cls.endpoint_breakers.get("endpoint:token").call(cls._fetch_access_token)
+
+    @classmethod
+    async def _fetch_access_token(cls) -> dict:
         async with aiohttp.ClientSession(headers={"Content-Type": "application/x-www-form-urlencoded"}) as session:
             async with session.post(
-                    f"https://id.twitch.tv/oauth2/token?"
+                    f"{cls.AUTH_URL}/token?"
                     f"client_id={KeyChain.TWITCH_API_ID}&"
                     f"client_secret={KeyChain.TWITCH_API_KEY}&"
                     f"grant_type=client_credentials") as resp:
+                if resp.status != 200:
+                    raise FetchError(resp.status, resp.reason)
                 response = await resp.json()
-        if resp.status != 200:
-            raise Exception(resp.reason)
 
-        cls._access_token = response["access_token"]
-        cls._token_type = response["token_type"].capitalize()
+        return response
 
     @classmethod
-    async def fetch_api(cls, url: str, headers: dict[str, Any] | None = None) -> dict:
+    async def fetch_api(
+            cls,
+            url: str,
+            headers: dict[str, Any] | None = None,
+            method: str = "GET",
+            data: dict | None = None
+    ) -> dict:
         """
         Fetch API response from url
         :param url: api request link
         :param headers: additional headers
+        :param method: request method
+        :param data: json request body
         :return: response
         """
 
-        if cls._access_token is None:
-            await cls.fetch_access_token()
+        breaker = cls.endpoint_breakers.get(f"endpoint:{url.split('?')[0].removeprefix(cls.API_URL + '/')}")
+        return await breaker.call(cls._fetch_api, url, headers, method, data)
 
-        _headers = {
-            "Authorization": f"{cls._token_type} {cls._access_token}",
-            "Client-Id": KeyChain.TWITCH_API_ID}
+    @classmethod
+    async def _fetch_api(cls, url: str, headers: dict[str, Any] | None, method: str, data: dict | None) -> dict:
+        _headers = {"Client-Id": KeyChain.TWITCH_API_ID}
         if headers is not None:
             _headers.update(headers)
 
         async with aiohttp.ClientSession(headers=_headers) as session:
-            async with session.get(url) as resp:
-                return await resp.json()
+            token_retried = False
+            throttled_retries = 0
+            while True:
+                authorization = await cls.token_manager.get(cls.fetch_access_token)
+                await cls.rate_limiter.acquire()
+                async with session.request(method, url, json=data, headers={"Authorization": authorization}) as resp:
+                    cls.rate_limiter.update(resp.headers)
+
+                    # retry once, if token was rejected
+                    if resp.status == 401 and not token_retried:  # token expired or was revoked
+                        token_retried = True
+                        cls.token_manager.invalidate(authorization)
+                        continue
+
+                    # requeue until bucket is reset, if rate limit was hit
+                    if resp.status == 429:
+                        cls.rate_limiter.throttle()
+                        if throttled_retries >= cls.MAX_THROTTLED_RETRIES:
+                            raise FetchError(resp.status, resp.reason)
+                        throttled_retries += 1
+                        continue
+
+                    if resp.status == 204:  # no content
+                        return {}
+                    if resp.status >= 400:  # error
+                        raise FetchError(resp.status, resp.reason)
+                    return json_loads(await resp.read())
 
     @classmethod
     async def fetch_stream_info(cls, user_login: str) -> Stream | None:
@@ -130,11 +411,185 @@ class Fetcher:
         :return: Stream dataclass if is live
         """
 
-        response = await cls.fetch_api(f"https://api.twitch.tv/helix/streams?user_login={user_login}")
+        response = await cls.fetch_api(f"{cls.API_URL}/streams?user_login={user_login}")
         if len(response["data"]) > 0:
             return Stream.from_response(response["data"][0])
         return None
 
+    @classmethod
+    async def fetch_streams_batched(cls, parameter: str, values: list[str], threads: int = 1) -> list[Stream]:
+        """
+        Fetches streams using one request per 100 values (plus pagination)
+        :param parameter: query parameter ('user_login' or 'user_id')
+        :param values: list of parameter values
+        :param threads: how many batches can be fetched at once
+        :return: list of live streams
+        """
+
+        sem = asyncio.Semaphore(threads)
+
+        async def coro(_batch):
+            streams = []
+            cursor = None
+            async with sem:
+                while True:
+                    url = (f"{cls.API_URL}/streams?"
+                           f"first={cls.BATCH_SIZE}&" +
+                           "&".join(f"{parameter}={x}" for x in _batch))
+                    if cursor is not None:
+                        url += f"&after={cursor}"
+
+                    response = await cls.fetch_api(url)
+                    streams += [Stream.from_response(x) for x in response["data"]]
+
+                    # go to next page, if present and the current one is full
+                    cursor = response.get("pagination", {}).get("cursor")
+                    if cursor is None or len(response["data"]) < cls.BATCH_SIZE:
+                        break
+            return streams
+
+        # split into batches
+        batches = [values[i:i + cls.BATCH_SIZE] for i in range(0, len(values), cls.BATCH_SIZE)]
+        responses = await asyncio.gather(*[coro(x) for x in batches])
+
+        return [stream for response in responses for stream in response]
+
+    @classmethod
+    async def fetch_streams_info(cls, user_logins: list[str], threads: int = 1) -> dict[str, Stream | None]:
+        """
+        Fetches stream info for multiple users.
+        Uses one request per 100 users (plus pagination)
+        :param user_logins: list of user login names
+        :param threads: how many batches can be fetched at once
+        :return: dict of lowercase user login -> Stream dataclass if is live, otherwise None
+        """
+
+        # map streams back to users
+        streams = {user_login.lower(): None for user_login in user_logins}
+        for stream in await cls.fetch_streams_batched("user_login", user_logins, threads):
+            streams[stream.user_login.lower()] = stream
+        return streams
+
+    @classmethod
+    async def fetch_streams_info_by_id(cls, user_ids: list[str], threads: int = 1) -> dict[str, Stream | None]:
+        """
+        Same as 'fetch_streams_info', except users are queried by id (not affected by renames)
+        :param user_ids: list of user ids
+        :param threads: how many batches can be fetched at once
+        :return: dict of user id -> Stream dataclass if is live, otherwise None
+        """
+
+        # map streams back to users
+        streams = {user_id: None for user_id in user_ids}
+        for stream in await cls.fetch_streams_batched("user_id", user_ids, threads):
+            streams[stream.user_id] = stream
+        return streams
+
+    @classmethod
+    async def fetch_users(cls, user_logins: list[str]) -> dict[str, dict]:
+        """
+        Fetches users. Uses one request per 100 users
+        :param user_logins: list of user login names
+        :return: dict of lowercase user login -> user. Missing users are not included
+        """
+
+        async def coro(_batch):
+            return await cls.fetch_api(f"{cls.API_URL}/users?" + "&".join(f"login={x}" for x in _batch))
+
+        batches = [user_logins[i:i + cls.BATCH_SIZE] for i in range(0, len(user_logins), cls.BATCH_SIZE)]
+        responses = await asyncio.gather(*[coro(x) for x in batches])
+
+        return {user["login"].lower(): user for response in responses for user in response["data"]}
+
+    @classmethod
+    async def fetch_games(cls, game_ids: list[str]) -> dict[str, dict]:
+        """
+        Fetches games. Uses one request per 100 games
+        :param game_ids: list of game ids
+        :return: dict of game id -> game. Missing games are not included
+        """
+
+        """
+        Example response:
+        {
+          "data": [
+            {
+              "id": "33214",
+              "name": "Fortnite",
+              "box_art_url": "https://static-cdn.jtvnw.net/ttv-boxart/33214-{width}x{height}.jpg",
+              "igdb_id": "1905"
+            }
+          ]
+        }
+        """
+
+        async def coro(_batch):
+            return await cls.fetch_api(f"{cls.API_URL}/games?" + "&".join(f"id={x}" for x in _batch))
+
+        batches = [game_ids[i:i + cls.BATCH_SIZE] for i in range(0, len(game_ids), cls.BATCH_SIZE)]
+        responses = await asyncio.gather(*[coro(x) for x in batches])
+
+        return {game["id"]: game for response in responses for game in response["data"]}
+
+    @classmethod
+    async def fetch_eventsub_subscriptions(cls) -> list[dict]:
+        """
+        Fetches all EventSub subscriptions made by this application
+        :return: list of subscriptions
+        """
+
+        subscriptions = []
+        cursor = None
+        while True:
+            url = f"{cls.API_URL}/eventsub/subscriptions"
+            if cursor is not None:
+                url += f"?after={cursor}"
+
+            response = await cls.fetch_api(url)
+            subscriptions += response["data"]
+
+            # go to next page, if present
+            cursor = response.get("pagination", {}).get("cursor")
+            if cursor is None or len(response["data"]) == 0:
+                break
+
+        return subscriptions
+
+    @classmethod
+    async def create_eventsub_subscription(
+            cls,
+            subscription_type: str,
+            user_id: str,
+            callback_url: str,
+            secret: str
+    ) -> dict:
+        """
+        Creates EventSub webhook subscription for a broadcaster
+        :param subscription_type: subscription type (ex. 'stream.online')
+        :param user_id: broadcaster user id
+        :param callback_url: public url of EventSub server
+        :param secret: secret used to sign messages
+        :return: response
+        """
+
+        return await cls.fetch_api(
+            f"{cls.API_URL}/eventsub/subscriptions",
+            method="POST",
+            data={
+                "type": subscription_type,
+                "version": "1",
+                "condition": {"broadcaster_user_id": user_id},
+                "transport": {"method": "webhook", "callback": callback_url, "secret": secret}})
+
+    @classmethod
+    async def delete_eventsub_subscription(cls, subscription_id: str) -> None:
+        """
+        Deletes EventSub subscription
+        :param subscription_id: subscription id
+        """
+
+        await cls.fetch_api(f"{cls.API_URL}/eventsub/subscriptions?id={subscription_id}", method="DELETE")
+
 
 async def test():
     response = await Fetcher.fetch_stream_info("mutzbunny")
@@ -5,12 +5,33 @@ This is a module that checks if some Twitch streamer is live.
 
 import json
 import asyncio
+import discord
 import logging
+import aiosqlite
+from datetime import datetime
+from dataclasses import dataclass
 from discord import app_commands
 from discord.ext import commands, tasks
 from source.configs import *
-from source.notifications import make_announcement
+from source.databases import *
+from source.keychain import KeyChain
+from source.utils import check_bot_ownership
+from source.breakers import FAILURES, CircuitOpen
+from source.notifications import make_announcement, make_subscription_index
 from modules.TwitchNotifs.fetcher import Fetcher, Stream
+from modules.TwitchNotifs.eventsub import EventSubServer
+from modules.TwitchNotifs.cache import UserCache, GameCache
+
+
+@dataclass
+class LiveState:
+    """
+    Dataclass containing live state of a streamer
+    """
+
+    stream_id: str | None = None
+    last_seen_live: int = 0
+    announced_stream_id: str | None = None
 
 
 class TwitchNotifsModule(commands.Cog):
@@ -28,29 +49,205 @@ class TwitchNotifsModule(commands.Cog):
         self.logger.info("Module loaded")
 
         # configs
-        self.module_config: ModuleConfig = ModuleConfig(self.module_name)
-        self.guild_config: GuildConfigCollection = GuildConfigCollection(self.module_name)
+        self.module_config: ModuleConfig | None = None
+        self.guild_config: GuildConfigCollection | None = None
+
+        # twitch login -> subscribed guilds
+        # {"login": [GuildConfig(...), GuildConfig(...), ...]}
+        self.subscriptions: dict[str, list[GuildConfig]] = dict()
+        self.load_config()
+
+        # databases
+        self.db_handle: DatabaseHandle = DatabaseHandle(self.module_name)
+        self.db: aiosqlite.Connection | None = None
 
         # channels
-        # 'channel_name': Stream
-        self.channels_live: dict[str, Stream | None] = dict()
+        # 'channel_name': LiveState(...)
+        self.live_states: dict[str, LiveState] = dict()
+
+        # metadata caches
+        self.users: UserCache | None = None
+        self.games: GameCache = GameCache(self.module_config.game_cache_ttl)
+
+        # EventSub webhook server (if enabled)
+        self.eventsub: EventSubServer | None = None
 
-        # start routines
         self.check_routine.change_interval(seconds=self.module_config.update_interval)
-        self.check_routine.start()
-        self.update_key_routine.start()
+
+    def load_config(self) -> None:
+        """
+        Loads configs and rebuilds subscription index
+        """
+
+        self.module_config = ModuleConfig(self.module_name)
+        self.guild_config = GuildConfigCollection(self.module_name)
+        self.subscriptions = make_subscription_index(self.guild_config, normalize=str.lower)
 
     async def on_cleanup(self):
         """
         Gets called when the bot is exiting
         """
 
+        if self.eventsub is not None:
+            await self.eventsub.stop()
+            self.logger.info("EventSub server stopped")
+
+        await self.db_handle.close()
+        self.logger.info("Database closed")
+
     async def on_ready(self):
         """
-        Fetch current states of streams
+        Load states of streams and start checking them
+        """
+
+        # connect to database
+        self.db = await self.db_handle.connect()
+        self.logger.info("Database connected")
+
+        # check the table is present
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS LiveStates (
+                    Login TEXT PRIMARY KEY,
+                    StreamId TEXT,
+                    LastSeenLive INTEGER DEFAULT 0,
+                    AnnouncedStreamId TEXT
+                );""")
+
+            # load live states
+            query = await cur.execute("SELECT Login, StreamId, LastSeenLive, AnnouncedStreamId FROM LiveStates")
+            for login, stream_id, last_seen_live, announced_stream_id in await query.fetchall():
+                self.live_states[login] = LiveState(stream_id, last_seen_live, announced_stream_id)
+
+        # commit database changes
+        await self.db.commit()
+
+        # load user ids
+        self.users = UserCache(self.db, self.module_config.user_cache_ttl)
+        await self.users.load()
+
+        # start routines
+        self.check_routine.start()
+
+        # start receiving events
+        if self.module_config.eventsub.enabled:
+            await self.start_eventsub()
+
+    async def start_eventsub(self) -> None:
+        """
+        Starts EventSub server and subscribes to configured streamers.
+        Polling is then only used for reconciliation
+        """
+
+        # secret is required to verify messages
+        secret = getattr(KeyChain, "TWITCH_EVENTSUB_SECRET", None)
+        if secret is None:
+            self.logger.error("EventSub is enabled, but 'TWITCH_EVENTSUB_SECRET' key is missing; using polling")
+            return
+
+        config = self.module_config.eventsub
+        self.eventsub = EventSubServer(
+            secret=secret,
+            callback=self.on_eventsub_event,
+            host=config.host,
+            port=config.port,
+            path=config.path,
+            logger=self.logger)
+        await self.eventsub.start()
+
+        # make subscriptions; missing ones are picked up by reconciliation polling
+        try:
+            await self.sync_eventsub_subscriptions(secret)
+        except FAILURES + (CircuitOpen,) as e:
+            self.logger.warning(f"Failed to sync EventSub subscriptions; {e}")
+
+        # slow down polling
+        self.check_routine.change_interval(seconds=config.reconcile_interval)
+
+    async def sync_eventsub_subscriptions(self, secret: str) -> None:
         """
+        Subscribes to 'stream.online' and 'stream.offline' events for all configured streamers,
+        and removes subscriptions for streamers that are no longer configured
+        :param secret: secret used to sign messages
+        """
+
+        callback_url = self.module_config.eventsub.callback_url
+        subscription_types = ("stream.online", "stream.offline")
+
+        # fetch user ids
+        user_ids = set((await self.users.resolve(list(self.subscriptions.keys()))).values())
+
+        # go through existing subscriptions
+        existing = set()
+        for subscription in await Fetcher.fetch_eventsub_subscriptions():
+            if subscription["transport"].get("callback") != callback_url:
+                continue
+            if subscription["type"] not in subscription_types:
+                continue
+
+            user_id = subscription["condition"]["broadcaster_user_id"]
+            is_active = subscription["status"] in ("enabled", "webhook_callback_verification_pending")
+            if user_id in user_ids and is_active:
+                existing.add((subscription["type"], user_id))
+            else:
+                await Fetcher.delete_eventsub_subscription(subscription["id"])
 
-        self.channels_live = await self.fetch_streams()
+        # create missing subscriptions
+        created = 0
+        for user_id in user_ids:
+            for subscription_type in subscription_types:
+                if (subscription_type, user_id) not in existing:
+                    await Fetcher.create_eventsub_subscription(subscription_type, user_id, callback_url, secret)
+                    created += 1
+
+        self.logger.info(f"EventSub subscriptions synced; {len(existing)} present, {created} created")
+
+    async def on_eventsub_event(self, subscription_type: str, event: dict) -> None:
+        """
+        Handles EventSub events
+        :param subscription_type: subscription type
+        :param event: event data
+        """
+
+        # find configured login by id, in case user was renamed
+        user_id = event["broadcaster_user_id"]
+        channel = self.users.logins.get(user_id, event["broadcaster_user_login"].lower())
+        if channel not in self.subscriptions:
+            return
+
+        # going offline starts the grace window; polling may not have seen the stream for a while
+        if subscription_type == "stream.offline":
+            state = self.live_states.get(channel)
+            if state is not None and state.stream_id is not None:
+                state.last_seen_live = int(datetime.now().timestamp())
+                await self.save_live_states([channel])
+            return
+
+        if subscription_type != "stream.online":
+            return
+
+        # skip if this stream was already announced
+        state = self.live_states.get(channel)
+        if state is not None and state.announced_stream_id == event["id"]:
+            return
+
+        # stream info may take a moment to appear in the API
+        for _ in range(3):
+            stream = (await Fetcher.fetch_streams_info_by_id([user_id]))[user_id]
+            if stream is not None:
+                break
+            await asyncio.sleep(10)
+        else:  # leave it to reconciliation
+            return
+
+        # update and save state
+        announce = self.update_live_state(channel, stream)
+        await self.save_live_states([channel])
+
+        if announce:
+            await self.games.resolve([stream.game_id] if stream.game_id else [])
+            await self.announce_stream(channel, stream)
 
     async def fetch_streams(self) -> dict[str, Stream | None]:
         """
@@ -59,69 +256,170 @@ class TwitchNotifsModule(commands.Cog):
         """
 
         # fetch all channels
-        channels = set()
-        for guild_config in self.guild_config:
-            channels.update(guild_config.channels)
+        channels = list(self.subscriptions.keys())
+        user_ids = await self.users.resolve(channels)
+
+        # fetch in batches
+        streams = await Fetcher.fetch_streams_info_by_id(list(user_ids.values()), threads=self.module_config.threads)
+
+        # map back to configured logins
+        return {channel: streams.get(user_ids.get(channel)) for channel in channels}
+
+    @tasks.loop(minutes=1)
+    async def check_routine(self) -> None:
+        """
+        Check every 'update_interval' for a new stream
+        """
 
-        # limit concurrency
-        sem = asyncio.Semaphore(self.module_config.threads)
+        # fetch current state; on error, try again next time
+        try:
+            channels_live = await self.fetch_streams()
+        except FAILURES + (CircuitOpen,) as e:
+            self.logger.warning(f"Failed to fetch streams; {e}")
+            return
 
-        # checking coroutine
-        async def check_coro(channel_name):
-            async with sem:
-                return await Fetcher.fetch_stream_info(channel_name)
+        # update states
+        announcements = []
+        for channel, stream in channels_live.items():
+            if self.update_live_state(channel, stream):
+                announcements.append((channel, stream))
+        await self.save_live_states(list(channels_live.keys()))
 
-        response = await asyncio.gather(
-            *[check_coro(channel) for channel in channels])
+        # fetch games of new streams in one batch; streams are announced without box art on error
+        try:
+            await self.games.resolve([stream.game_id for _, stream in announcements if stream.game_id])
+        except FAILURES + (CircuitOpen,) as e:
+            self.logger.warning(f"Failed to fetch games; {e}")
 
-        return {key: val for key, val in zip(channels, response)}
+        # make notifications
+        for channel, stream in announcements:
+            await self.announce_stream(channel, stream)
 
-    @tasks.loop(hours=24)
-    async def update_key_routine(self) -> None:
+    def update_live_state(self, channel: str, stream: Stream | None) -> bool:
         """
-        Updates a key every 24 hours
+        Updates streamer's live state.
+        Streamer only counts as offline after not being live for 'offline_grace_period' seconds,
+        so short stream drops don't cause another announcement
+        :param channel: twitch login
+        :param stream: current stream, or None if offline
+        :return: True if the stream should be announced
         """
 
-        await Fetcher.fetch_access_token()
+        current_timestamp = int(datetime.now().timestamp())
 
-    @tasks.loop(minutes=1)
-    async def check_routine(self) -> None:
+        # new channel; remember current state without announcing it
+        if channel not in self.live_states:
+            self.live_states[channel] = LiveState()
+            if stream is not None:
+                self.live_states[channel] = LiveState(stream.id, current_timestamp, stream.id)
+            return False
+
+        state = self.live_states[channel]
+        is_live = current_timestamp - state.last_seen_live <= self.module_config.offline_grace_period
+
+        # not live
+        if stream is None:
+            if not is_live:
+                state.stream_id = None
+            return False
+
+        # announce new streams, unless streamer was live moments ago (ex. stream drop)
+        announce = stream.id != state.announced_stream_id and not is_live
+
+        state.stream_id = stream.id
+        state.last_seen_live = current_timestamp
+        state.announced_stream_id = stream.id
+        return announce
+
+    async def save_live_states(self, channels: list[str]) -> None:
         """
-        Check every 'update_interval' for a new stream
+        Saves live states of given channels
+        :param channels: list of twitch logins
         """
 
-        # fetch current state
-        channels_live = await self.fetch_streams()
+        rows = []
+        for channel in channels:
+            state = self.live_states[channel]
+            rows.append((channel, state.stream_id, state.last_seen_live, state.announced_stream_id))
+
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.executemany(
+                "INSERT OR REPLACE INTO LiveStates (Login, StreamId, LastSeenLive, AnnouncedStreamId) "
+                "VALUES (?, ?, ?, ?)", rows)
+        await self.db.commit()
 
-        # go through all guilds
-        for guild_config in self.guild_config:
+    async def announce_stream(self, channel: str, stream: Stream) -> None:
+        """
+        Notifies subscribed guilds about the stream
+        :param channel: twitch login
+        :param stream: stream
+        """
+
+        # game box art (games are expected to be resolved beforehand)
+        game = self.games.games.get(stream.game_id)
+        box_art_url = game[0]["box_art_url"].format(width=285, height=380) if game is not None else None
+
+        for guild_config in self.subscriptions[channel]:
             notification_channel = self.client.get_channel(guild_config.notifications_channel_id)
             role_ping = f"<@&{guild_config.role_id}>"
 
-            # check every configured twitch channel
-            for channel in guild_config.channels:
-                # if channel is live, and it wasn't before, make a notification
-                if channels_live[channel] is not None and self.channels_live[channel] is None:
-                    stream = channels_live[channel]
-                    keywords = self.return_keywords_dict(
-                        role_mention=role_ping,
-                        channel_name=stream.user_name,
-                        stream_url=f"https://twitch.tv/{stream.user_login}",
-                        stream_title=stream.title,
-                        stream_thumbnail_url=stream.thumbnail(640, 360),
-                        stream_language=stream.language,
-                        stream_start_date=stream.started_at.__str__(),
-                        stream_game_name=stream.game_name,
-                        stream_tags=stream.tags,
-                        stream_nsfw=stream.is_mature)
-
-                    await make_announcement(
-                        channel=notification_channel,
-                        config=guild_config.format,
-                        keywords=keywords)
-
-        # update channel states
-        self.channels_live = channels_live
+            keywords = self.return_keywords_dict(
+                role_mention=role_ping,
+                channel_name=stream.user_name,
+                stream_url=f"https://twitch.tv/{stream.user_login}",
+                stream_title=stream.title,
+                stream_thumbnail_url=stream.thumbnail(640, 360),
+                stream_language=stream.language,
+                stream_start_date=stream.started_at.__str__(),
+                stream_game_name=stream.game_name,
+                stream_game_box_art_url=box_art_url,
+                stream_tags=stream.tags,
+                stream_nsfw=stream.is_mature)
+
+            await make_announcement(
+                channel=notification_channel,
+                config=guild_config.format,
+                keywords=keywords)
+
+    @app_commands.command(name="twitchnotifs-status", description="shows twitch API usage")
+    async def status_command(
+            self,
+            interaction: discord.Interaction
+    ) -> None:
+        """
+        Shows rate limit bucket state. Can only be used by owner of the bot
+        """
+
+        # check bot ownership
+        await check_bot_ownership(self.client, interaction)
+
+        # make embed
+        embed = discord.Embed(
+            title="TwitchNotifs status",
+            color=discord.Color.from_str("#6441a5"))
+        embed.add_field(
+            name="Tracked streamers",
+            value=f"{len(self.subscriptions)}",
+            inline=False)
+        embed.add_field(
+            name="Rate limit",
+            value="\n".join(f"{key}: {val}" for key, val in Fetcher.rate_limiter.state().items()))
+        embed.add_field(
+            name="User cache",
+            value="\n".join(f"{key}: {val}" for key, val in self.users.state().items()))
+        embed.add_field(
+            name="Game cache",
+            value="\n".join(f"{key}: {val}" for key, val in self.games.state().items()))
+        embed.add_field(
+            name="Failing endpoints",
+            value="\n".join(
+                f"{x['name']}: {x['state']}, retry in {x['retry_in']}s"
+                for x in Fetcher.endpoint_breakers.unhealthy()) or "none",
+            inline=False)
+
+        # send response
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
     @staticmethod
     def return_keywords_dict(
@@ -133,6 +431,7 @@ class TwitchNotifsModule(commands.Cog):
             stream_language: str,
             stream_start_date: str,
             stream_game_name: str,
+            stream_game_box_art_url: str | None,
             stream_tags: list[str],
             stream_nsfw: bool
     ) -> dict[str, str]:
@@ -150,6 +449,7 @@ class TwitchNotifsModule(commands.Cog):
             "stream_language": stream_language,
             "stream_start_date": stream_start_date,
             "stream_game_name": stream_game_name,
+            "stream_game_box_art_url": stream_game_box_art_url,
             "stream_tags": stream_tags,
             "stream_nsfw": stream_nsfw}
 
@@ -3,15 +3,36 @@ YouTube's videos and streams fetching
 """
 
 
+import re
 import asyncio
 import aiohttp
+import xml.etree.ElementTree as ElementTree
 from typing import Any
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from dataclasses import dataclass
+from source.utils import json_loads
 from source.keychain import KeyChain
+from source.breakers import BreakerRegistry, FetchError
 
 
-@dataclass(frozen=True)
+DURATION_REGEX: re.Pattern = re.compile(
+    r"P(?:(?P<days>\d+)D)?(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?")
+
+
+def parse_duration(duration: str) -> timedelta:
+    """
+    Parses ISO 8601 duration, used by API (ex. 'PT1H2M3S')
+    :param duration: duration string
+    :return: timedelta
+    """
+
+    match = DURATION_REGEX.fullmatch(duration)
+    if match is None:
+        return timedelta()
+    return timedelta(**{key: int(val) for key, val in match.groupdict().items() if val is not None})
+
+
+@dataclass(frozen=True, slots=True)
 class Thumbnail:
     """
     Class containing thumbnail data
@@ -33,17 +54,43 @@ class Thumbnail:
             height=response["height"])
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Thumbnails:
     """
-    Class containing Thumbnails
+    Class containing Thumbnails.
+    Keeps 'thumbnails' part of API response, and only makes Thumbnail when it's accessed
     """
 
-    default: Thumbnail
-    medium: Thumbnail
-    high: Thumbnail
-    standard: Thumbnail | None = None
-    maxres: Thumbnail | None = None
+    data: dict[str, dict]
+
+    def get(self, name: str) -> Thumbnail | None:
+        """
+        Returns thumbnail by name
+        :param name: thumbnail name (ex. 'high')
+        :return: thumbnail, or None if not present
+        """
+
+        return Thumbnail.from_response(self.data[name]) if name in self.data else None
+
+    @property
+    def default(self) -> Thumbnail:
+        return self.get("default")
+
+    @property
+    def medium(self) -> Thumbnail:
+        return self.get("medium")
+
+    @property
+    def high(self) -> Thumbnail:
+        return self.get("high")
+
+    @property
+    def standard(self) -> Thumbnail | None:
+        return self.get("standard")
+
+    @property
+    def maxres(self) -> Thumbnail | None:
+        return self.get("maxres")
 
     @staticmethod
     def from_response_dict(thumbnails: dict):
@@ -51,15 +98,21 @@ class Thumbnails:
         Generates 'self' from API response
         """
 
-        return Thumbnails(
-            default=Thumbnail.from_response(thumbnails["default"]),
-            medium=Thumbnail.from_response(thumbnails["medium"]),
-            high=Thumbnail.from_response(thumbnails["high"]),
-            standard=Thumbnail.from_response(thumbnails["standard"]) if "standard" in thumbnails else None,
-            maxres=Thumbnail.from_response(thumbnails["maxres"]) if "maxres" in thumbnails else None)
+        return Thumbnails(data=thumbnails)
+
+    @staticmethod
+    def from_video_id(video_id: str):
+        """
+        Generates 'self' from video id. Used when thumbnails are not part of the response (ex. RSS feed)
+        """
+
+        return Thumbnails(data={
+            "default": {"url": f"https://i.ytimg.com/vi/{video_id}/default.jpg", "width": 120, "height": 90},
+            "medium": {"url": f"https://i.ytimg.com/vi/{video_id}/mqdefault.jpg", "width": 320, "height": 180},
+            "high": {"url": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg", "width": 480, "height": 360}})
 
 
-@dataclass
+@dataclass(slots=True)
 class Channel:
     """
     Class containing channel information
@@ -93,12 +146,41 @@ class Channel:
             thumbnails=Thumbnails.from_response_dict(response["snippet"]["thumbnails"]),
             country=response["snippet"]["country"])
 
+    def to_dict(self) -> dict:
+        """
+        Converts 'self' to JSON serializable dictionary
+        """
+
+        return {
+            "id": self.id,
+            "title": self.title,
+            "description": self.description,
+            "custom_url": self.custom_url,
+            "published_at": self.published_at.isoformat(),
+            "thumbnails": self.thumbnails.data,
+            "country": self.country}
+
+    @staticmethod
+    def from_dict(data: dict):
+        """
+        Generates 'self' from dictionary, made by 'to_dict'
+        """
+
+        return Channel(
+            id=data["id"],
+            title=data["title"],
+            description=data["description"],
+            custom_url=data["custom_url"],
+            published_at=datetime.fromisoformat(data["published_at"]),
+            thumbnails=Thumbnails.from_response_dict(data["thumbnails"]),
+            country=data["country"])
+
     @property
     def url(self) -> str:
         return f"https://youtube.com/{self.custom_url}"
 
 
-@dataclass
+@dataclass(slots=True)
 class Media:
     """
     Class containing video / stream information
@@ -112,12 +194,25 @@ class Media:
     position: int
     channel: Channel
     is_stream: bool = False
+    live_status: str = "none"
+    duration: timedelta | None = None
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
             return self.id == other.id
         return False
 
+    def enrich(self, details: dict) -> None:
+        """
+        Updates 'self' with data from 'videos' API response
+        :param details: video resource from API response
+        """
+
+        self.is_stream = "liveStreamingDetails" in details
+        self.live_status = details["snippet"].get("liveBroadcastContent", "none")
+        if "contentDetails" in details:
+            self.duration = parse_duration(details["contentDetails"].get("duration", "P0D"))
+
     @staticmethod
     async def from_response(response: dict):
         """
@@ -133,49 +228,202 @@ class Media:
             position=response["position"],
             channel=await Fetcher.fetch_channel_info(response["channelId"]))
 
+    @staticmethod
+    async def from_feed_entry(entry: dict):
+        """
+        Generates 'self' from parsed RSS feed entry
+        """
+
+        return Media(
+            id=entry["video_id"],
+            title=entry["title"],
+            description=entry["description"],
+            published_at=datetime.fromisoformat(entry["published"]),
+            thumbnails=Thumbnails.from_video_id(entry["video_id"]),
+            position=entry["position"],
+            channel=await Fetcher.fetch_channel_info(entry["channel_id"]))
+
+    def to_dict(self) -> dict:
+        """
+        Converts 'self' to JSON serializable dictionary
+        """
+
+        return {
+            "id": self.id,
+            "title": self.title,
+            "description": self.description,
+            "published_at": self.published_at.isoformat(),
+            "thumbnails": self.thumbnails.data,
+            "position": self.position,
+            "channel": self.channel.to_dict(),
+            "is_stream": self.is_stream,
+            "live_status": self.live_status,
+            "duration": self.duration.total_seconds() if self.duration is not None else None}
+
+    @staticmethod
+    def from_dict(data: dict):
+        """
+        Generates 'self' from dictionary, made by 'to_dict'
+        """
+
+        return Media(
+            id=data["id"],
+            title=data["title"],
+            description=data["description"],
+            published_at=datetime.fromisoformat(data["published_at"]),
+            thumbnails=Thumbnails.from_response_dict(data["thumbnails"]),
+            position=data["position"],
+            channel=Channel.from_dict(data["channel"]),
+            is_stream=data["is_stream"],
+            live_status=data["live_status"],
+            duration=timedelta(seconds=data["duration"]) if data["duration"] is not None else None)
+
     @property
     def url(self) -> str:
         return f"https://youtu.be/{self.id}"
 
 
+class QuotaExceeded(FetchError):
+    """
+    Raised when all API keys have run out of quota
+    """
+
+    def __init__(self):
+        super().__init__(403, "All API keys have run out of quota")
+
+
+@dataclass
+class APIKey:
+    """
+    Class containing API key and its usage
+    """
+
+    key: str
+    used: int = 0
+    exhausted: bool = False
+
+
+class KeyPool:
+    """
+    Spreads API requests across multiple keys by their remaining daily quota
+    """
+
+    # quota resets at midnight Pacific Time (daylight saving time is ignored)
+    QUOTA_TIMEZONE: timezone = timezone(timedelta(hours=-8))
+
+    def __init__(self, keys: list[str], daily_quota: int = 10000):
+        self.keys: list[APIKey] = [APIKey(key) for key in keys]
+        self.daily_quota: int = daily_quota
+        self.quota_day = datetime.now(self.QUOTA_TIMEZONE).date()
+
+    def _check_reset(self) -> None:
+        """
+        Resets key usage when the quota day changes
+        """
+
+        today = datetime.now(self.QUOTA_TIMEZONE).date()
+        if today != self.quota_day:
+            self.quota_day = today
+            for key in self.keys:
+                key.used = 0
+                key.exhausted = False
+
+    def acquire(self, cost: int = 1) -> APIKey:
+        """
+        Picks the key with the most remaining quota, and counts the request towards it
+        :param cost: request quota cost
+        :return: API key
+        """
+
+        self._check_reset()
+
+        available = [key for key in self.keys if not key.exhausted]
+        if len(available) == 0:
+            raise QuotaExceeded()
+
+        key = min(available, key=lambda x: x.used)
+        key.used += cost
+        return key
+
+    def usage(self) -> list[dict[str, Any]]:
+        """
+        Returns usage of every key
+        :return: list of dictionaries with key usage
+        """
+
+        self._check_reset()
+        return [
+            {"used": key.used, "remaining": max(self.daily_quota - key.used, 0), "exhausted": key.exhausted}
+            for key in self.keys]
+
+
 class Fetcher:
     """
     Fetching class
     """
 
+    # base urls
+    API_URL: str = "https://www.googleapis.com/youtube/v3"
+    FEED_URL: str = "https://www.youtube.com/feeds/videos.xml"
+
+    # RSS feed xml namespaces
+    FEED_NAMESPACES: dict[str, str] = {
+        "atom": "http://www.w3.org/2005/Atom",
+        "yt": "http://www.youtube.com/xml/schemas/2015",
+        "media": "http://search.yahoo.com/mrss/"}
+
     # "channel_id": "upload_id"
     channels_playlists: dict[str, str] = {}
 
     # "channel_id": Channel(...)
     channels: dict[str, Channel] = {}
 
+    # API keys listed in 'configs/keys/youtubenotifs.keys'
+    key_pool: KeyPool = KeyPool(KeyChain.get_file_keys("youtubenotifs"))
+
+    # circuit breakers
+    # "endpoint:name" - API endpoints; only trip on server and network errors
+    # "feed:channel_id" - YouTube channels; used by the module. Running out of quota is not the channel's fault
+    endpoint_breakers: BreakerRegistry = BreakerRegistry(client_errors=False)
+    feed_breakers: BreakerRegistry = BreakerRegistry(ignored=(QuotaExceeded,))
+
     # cached requests
-    # "request_url": {"etag": "current_etag", "data": ...}
+    # "request_url": {"etag": "current_etag", "last_modified": "date" | None, "data": ...}
     cached: dict[str, dict[str, Any]] = dict()
 
     @classmethod
-    def update_cache(cls, url: str, etag: str, data: Any) -> None:
+    def update_cache(cls, url: str, etag: str | None, data: Any, last_modified: str | None = None) -> None:
         """
         Updates cache
         :param url: url request
         :param etag: API etag
         :param data: data
+        :param last_modified: 'Last-Modified' header value
         """
 
         cls.cached[url] = {
             "etag": etag,
+            "last_modified": last_modified,
             "data": data}
 
     @classmethod
-    async def fetch_api(cls, url: str, headers: dict[str, Any] | None = None):
+    async def fetch_api(cls, url: str, headers: dict[str, Any] | None = None, cache: bool = True):
         """
-        Fetches response using given URL and HEADERS
-        :param url: url request
+        Fetches response using given URL and HEADERS.
+        API key is added to the request by the fetcher.
+        When a key runs out of quota, the request is retried with the next one
+        :param url: url request (without API key)
         :param headers: headers to use
+        :param cache: if False, the response is not cached (ex. one time requests)
         :return: response
         """
 
-        cached = cls.cached.get(url)
+        breaker = cls.endpoint_breakers.get(f"endpoint:{url.split('?')[0].rsplit('/', 1)[-1]}")
+        return await breaker.call(cls._fetch_api, url, headers, cache)
+
+    @classmethod
+    async def _fetch_api(cls, url: str, headers: dict[str, Any] | None, cache: bool):
+        cached = cls.cached.get(url) if cache else None
 
         _headers = dict()
         if cached is not None:  # cache hit
@@ -184,15 +432,35 @@ class Fetcher:
             _headers.update(headers)
 
         async with aiohttp.ClientSession(headers=_headers) as session:
-            async with session.get(url) as resp:
-                if resp.status == 304:  # cache is unchanged
-                    return cached["data"]
-                elif resp.status == 200:  # cache is changed / new entry
-                    response = await resp.json()
-                    cls.update_cache(url, response["etag"], response)
-                    return response
-                else:  # error
-                    raise NotImplementedError
+            while True:
+                key = cls.key_pool.acquire()
+                async with session.get(url, params={"key": key.key}) as resp:
+                    if resp.status == 304:  # cache is unchanged
+                        return cached["data"]
+                    elif resp.status == 200:  # cache is changed / new entry
+                        response = json_loads(await resp.read())
+                        if cache:
+                            cls.update_cache(url, response["etag"], response)
+                        return response
+                    elif resp.status == 403 and await cls.is_quota_exceeded(resp):  # try next key
+                        key.exhausted = True
+                    else:  # error
+                        raise FetchError(resp.status, resp.reason)
+
+    @staticmethod
+    async def is_quota_exceeded(resp: aiohttp.ClientResponse) -> bool:
+        """
+        Checks if API error response was caused by exceeded quota
+        :param resp: API response
+        :return: True if key has run out of quota
+        """
+
+        try:
+            response = await resp.json()
+            reasons = [error.get("reason") for error in response["error"]["errors"]]
+        except (aiohttp.ContentTypeError, KeyError, TypeError, ValueError):
+            return False
+        return "quotaExceeded" in reasons or "dailyLimitExceeded" in reasons
 
     @classmethod
     async def fetch_channel_info(cls, channel_id: str) -> Channel:
@@ -251,10 +519,11 @@ class Fetcher:
 
         if channel_id not in cls.channels:
             response = await cls.fetch_api(
-                f"https://www.googleapis.com/youtube/v3/channels?"
+                f"{cls.API_URL}/channels?"
                 f"part=snippet&"
-                f"id={channel_id}&"
-                f"key={KeyChain.YOUTUBE_API_KEY}")
+                f"id={channel_id}")
+            if not response.get("items"):  # unknown or deleted channel
+                raise FetchError(404, f"Channel '{channel_id}' not found")
             cls.channels[channel_id] = await Channel.from_response(response["items"][0])
 
         return cls.channels[channel_id]
@@ -294,10 +563,11 @@ class Fetcher:
 
         if channel_id not in cls.channels_playlists:
             content_details = await cls.fetch_api(
-                f"https://www.googleapis.com/youtube/v3/channels?"
+                f"{cls.API_URL}/channels?"
                 f"part=contentDetails&"
-                f"id={channel_id}&"
-                f"key={KeyChain.YOUTUBE_API_KEY}")
+                f"id={channel_id}")
+            if not content_details.get("items"):  # unknown or deleted channel
+                raise FetchError(404, f"Channel '{channel_id}' not found")
             uploads_id = content_details["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
             cls.channels_playlists[channel_id] = uploads_id
         else:
@@ -358,10 +628,157 @@ class Fetcher:
         # fetch last {amount} videos
         uploads_id = await cls.fetch_channel_playlist_id(channel_id)
         playlist = await cls.fetch_api(
-            f"https://www.googleapis.com/youtube/v3/playlistItems?"
+            f"{cls.API_URL}/playlistItems?"
             f"part=snippet%2CcontentDetails&"
             f"maxResults={amount}&"
-            f"playlistId={uploads_id}&"
-            f"key={KeyChain.YOUTUBE_API_KEY}")
+            f"playlistId={uploads_id}")
+
+        try:
+            return await asyncio.gather(*[Media.from_response(x["snippet"]) for x in playlist["items"]])
+        except (KeyError, TypeError, ValueError) as e:  # malformed response
+            raise FetchError(200, f"Malformed playlist '{uploads_id}'; {e!r}")
+
+    @classmethod
+    def parse_feed_entry(cls, element: ElementTree.Element, position: int) -> dict:
+        """
+        Converts RSS feed entry element into a dictionary
+        :param element: feed entry element
+        :param position: position of entry in the feed
+        :return: entry dictionary
+        """
+
+        ns = cls.FEED_NAMESPACES
+        return {
+            "video_id": element.findtext("yt:videoId", namespaces=ns),
+            "channel_id": element.findtext("yt:channelId", namespaces=ns),
+            "title": element.findtext("atom:title", namespaces=ns),
+            "description": element.findtext("media:group/media:description", default="", namespaces=ns),
+            "published": element.findtext("atom:published", namespaces=ns),
+            "position": position}
+
+    @classmethod
+    async def fetch_feed(cls, channel_id: str, amount: int) -> list[dict]:
+        """
+        Fetches channel's RSS feed. Does not use API quota.
+        Uses conditional requests, and stops parsing after {amount} entries
+        :param channel_id: channel id
+        :param amount: amount of entries to parse
+        :return: list of parsed feed entries
+        """
+
+        return await cls.endpoint_breakers.get("endpoint:feed").call(cls._fetch_feed, channel_id, amount)
+
+    @classmethod
+    async def _fetch_feed(cls, channel_id: str, amount: int) -> list[dict]:
+        url = f"{cls.FEED_URL}?channel_id={channel_id}"
+        cached = cls.cached.get(url)
+
+        # only use conditional request if cached data is large enough
+        _headers = dict()
+        if cached is not None and cached["data"]["amount"] >= amount:
+            if cached["etag"] is not None:
+                _headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"] is not None:
+                _headers["If-Modified-Since"] = cached["last_modified"]
+
+        async with aiohttp.ClientSession(headers=_headers) as session:
+            async with session.get(url) as resp:
+                if resp.status == 304:  # feed is unchanged
+                    return cached["data"]["entries"][:amount]
+                elif resp.status != 200:  # error
+                    raise FetchError(resp.status, resp.reason)
+
+                # parse feed as it arrives
+                entries = []
+                parser = ElementTree.XMLPullParser(events=("end",))
+                entry_tag = f"{{{cls.FEED_NAMESPACES['atom']}}}entry"
+                try:
+                    async for chunk in resp.content.iter_chunked(8192):
+                        parser.feed(chunk)
+                        for _, element in parser.read_events():
+                            if element.tag == entry_tag:
+                                entries.append(cls.parse_feed_entry(element, len(entries)))
+                                element.clear()
+                        if len(entries) >= amount:
+                            break
+                except ElementTree.ParseError as e:
+                    raise FetchError(resp.status, f"Malformed feed of '{channel_id}'; {e}")
+
+                # entries without these can't be turned into videos
+                for entry in entries:
+                    if entry["video_id"] is None or entry["channel_id"] is None or entry["published"] is None:
+                        raise FetchError(resp.status, f"Malformed feed entry of '{channel_id}'")
+
+                cls.update_cache(
+                    url=url,
+                    etag=resp.headers.get("ETag"),
+                    data={"amount": amount, "entries": entries},
+                    last_modified=resp.headers.get("Last-Modified"))
+
+        return entries[:amount]
+
+    @classmethod
+    async def fetch_videos_rss(cls, channel_id: str, amount: int) -> tuple[Media]:
+        """
+        Same as 'fetch_videos', except it uses channel's RSS feed instead of API.
+        API is only used once per channel to fetch channel information
+        :param channel_id: channel id
+        :param amount: amount of videos to fetch
+        :return: list of videos
+        """
+
+        entries = await cls.fetch_feed(channel_id, amount)
+        try:
+            return await asyncio.gather(*[Media.from_feed_entry(x) for x in entries])
+        except (KeyError, TypeError, ValueError) as e:  # malformed entry (ex. invalid date)
+            raise FetchError(200, f"Malformed feed of '{channel_id}'; {e!r}")
+
+    @classmethod
+    async def fetch_videos_details(cls, video_ids: list[str]) -> dict[str, dict]:
+        """
+        Fetches details about given videos. Uses one API request per 50 videos
+        :param video_ids: list of video ids
+        :return: dict of video id -> video resource. Missing videos (ex. deleted) are not included
+        """
+
+        """
+        Example response:
+        {
+          "kind": "youtube#videoListResponse",
+          "etag": "...",
+          "items": [
+            {
+              "kind": "youtube#video",
+              "etag": "...",
+              "id": "KOufsvwqt-M",
+              "snippet": {
+                ...
+                "liveBroadcastContent": "none"
+              },
+              "contentDetails": {
+                "duration": "PT10M2S",
+                ...
+              },
+              "liveStreamingDetails": {
+                "actualStartTime": "...",
+                "scheduledStartTime": "...",
+                ...
+              }
+            }
+          ]
+        }
+        """
+
+        async def coro(_batch):
+            return await cls.fetch_api(
+                f"{cls.API_URL}/videos?"
+                f"part=snippet%2CcontentDetails%2CliveStreamingDetails&"
+                f"id={'%2C'.join(_batch)}&"
+                f"maxResults={len(_batch)}",
+                cache=False)
+
+        # split into batches of 50
+        batches = [video_ids[i:i + 50] for i in range(0, len(video_ids), 50)]
+        responses = await asyncio.gather(*[coro(x) for x in batches])
 
-        return await asyncio.gather(*[Media.from_response(x["snippet"]) for x in playlist["items"]])
+        return {item["id"]: item for response in responses for item in response["items"]}
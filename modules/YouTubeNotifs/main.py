@@ -8,13 +8,30 @@ import json
 import asyncio
 import discord
 import logging
+import aiosqlite
+from datetime import datetime
+from dataclasses import dataclass, field
 from discord import app_commands
 from discord.ext import commands, tasks
 from source.configs import *
-from source.notifications import make_announcement
+from source.databases import *
+from source.utils import check_bot_ownership
+from source.breakers import FAILURES, CircuitOpen
+from source.notifications import make_announcement, make_digest_embed, make_subscription_index
 from modules.YouTubeNotifs.fetcher import Fetcher, Media, Channel
 
 
+@dataclass
+class Digest:
+    """
+    Dataclass containing videos, that are waiting to be announced together
+    """
+
+    guild_config: GuildConfig
+    created_at: int
+    videos: list[tuple[Media, str]] = field(default_factory=list)
+
+
 class YouTubeNotifsModule(commands.Cog):
     """
     This is YouTube notifications module
@@ -29,49 +46,117 @@ class YouTubeNotifsModule(commands.Cog):
         self.logger.info("Module loaded")
 
         # configs
-        self.module_config: ModuleConfig = ModuleConfig(self.module_name)
-        self.guild_config: GuildConfigCollection = GuildConfigCollection(self.module_name)
+        self.module_config: ModuleConfig | None = None
+        self.guild_config: GuildConfigCollection | None = None
 
-        # youtube channels
-        # {"channel_id": [Video(...), Video(...), ...]}
-        self.channels_videos: dict[str, list[Media]] = dict()
+        # YT channel -> subscribed guilds
+        # {"channel_id": [GuildConfig(...), GuildConfig(...), ...]}
+        self.subscriptions: dict[str, list[GuildConfig]] = dict()
+        self.load_config()
 
-        # "channel_id": Channel(...)
-        self.channels: dict[str, Channel] = dict()
+        # databases
+        self.db_handle: DatabaseHandle = DatabaseHandle(self.module_name)
+        self.db: aiosqlite.Connection | None = None
+
+        # already seen videos
+        # {"channel_id": {"video_id", "video_id", ...}}
+        self.seen_videos: dict[str, set[str]] = dict()
+
+        # pending digests
+        # {notifications_channel_id: Digest(...)}
+        self.digests: dict[int, Digest] = dict()
 
         self.check.change_interval(seconds=self.module_config.update_interval)
 
+    def load_config(self) -> None:
+        """
+        Loads configs and rebuilds subscription index
+        """
+
+        self.module_config = ModuleConfig(self.module_name)
+        self.guild_config = GuildConfigCollection(self.module_name)
+        self.subscriptions = make_subscription_index(self.guild_config)
+
     async def on_cleanup(self):
         """
         Gets called when the bot is exiting
         """
 
+        await self.db_handle.close()
+        self.logger.info("Database closed")
+
     async def on_ready(self):
         """
-        Fetch latest uploaded videos
+        Load seen videos and start checking for new ones
         """
 
-        # try to fetch videos
-        while True:
-            try:
-                self.channels_videos = await self.retrieve_channel_videos()
-                break
-            except NotImplementedError:  # in case of error
-                await asyncio.sleep(5)
-
-        # thread semaphore
-        sem = asyncio.Semaphore(self.module_config.threads)
-
-        async def coro(_channel_id):
-            async with sem:
-                return await Fetcher.fetch_channel_info(_channel_id)
+        # connect to database
+        self.db = await self.db_handle.connect()
+        self.logger.info("Database connected")
+
+        # check the table is present
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS SeenVideos (
+                    ChannelId TEXT,
+                    VideoId TEXT,
+                    LastSeen INTEGER DEFAULT 0,
+                    PRIMARY KEY (ChannelId, VideoId)
+                );""")
+
+            await cur.execute("""
+                CREATE TABLE IF NOT EXISTS PendingDigests (
+                    NotificationsChannelId INTEGER,
+                    VideoId TEXT,
+                    VideoType TEXT,
+                    Video TEXT,
+                    CreatedAt INTEGER,
+                    PRIMARY KEY (NotificationsChannelId, VideoId)
+                );""")
+
+            # load seen videos
+            query = await cur.execute("SELECT ChannelId, VideoId FROM SeenVideos")
+            for channel_id, video_id in await query.fetchall():
+                self.seen_videos.setdefault(channel_id, set()).add(video_id)
+
+            # load pending digests; their videos were already marked as seen
+            query = await cur.execute(
+                "SELECT NotificationsChannelId, VideoType, Video, CreatedAt FROM PendingDigests ORDER BY rowid")
+            dropped = set()
+            for notifications_channel_id, video_type, video, created_at in await query.fetchall():
+                if notifications_channel_id not in self.digests:
+                    guild_config = self.find_digest_config(notifications_channel_id)
+                    if guild_config is None:  # digest mode was turned off
+                        dropped.add(notifications_channel_id)
+                        continue
+                    self.digests[notifications_channel_id] = Digest(guild_config, created_at)
+                self.digests[notifications_channel_id].videos.append((Media.from_dict(json.loads(video)), video_type))
+
+            if len(dropped) > 0:
+                self.logger.warning(f"Dropped pending digests of {len(dropped)} channels without digest config")
+                await cur.executemany(
+                    "DELETE FROM PendingDigests WHERE NotificationsChannelId = ?", [(x,) for x in dropped])
+
+        # commit database changes
+        await self.db.commit()
+
+        # start tasks
+        self.check.start()
+        self.prune_seen_videos.start()
 
-        # fetch and write results
-        results = await asyncio.gather(*[coro(x) for x in self.channels_videos.keys()])
-        self.channels = {channel_id: channel for channel_id, channel in zip(self.channels_videos.keys(), results)}
+    def find_digest_config(self, notifications_channel_id: int) -> GuildConfig | None:
+        """
+        Finds guild config with digest mode, that sends notifications to given channel
+        :param notifications_channel_id: notifications channel id
+        :return: guild config, or None if there is none
+        """
 
-        # start check
-        self.check.start()
+        for guild_config in self.guild_config:
+            if (guild_config.notifications_channel_id == notifications_channel_id
+                    and guild_config.get("digest") is not None):
+                return guild_config
+        return None
 
     async def retrieve_channel_videos(self, amount: int | None = None) -> dict[str, list[Media]]:
         """
@@ -85,26 +170,105 @@ class YouTubeNotifsModule(commands.Cog):
             amount = self.module_config.fetching_window
 
         # fetch all logged YT channels
-        channel_ids = set()
-        for guild_config in self.guild_config:
-            channel_ids.update(guild_config.channels)
+        channel_ids = list(self.subscriptions.keys())
+
+        # pick fetching backend
+        if self.module_config.backend == "rss":
+            fetch_videos = Fetcher.fetch_videos_rss
+        else:
+            fetch_videos = Fetcher.fetch_videos
+
+        # skip channels which failed recently
+        channel_ids = [x for x in channel_ids if Fetcher.feed_breakers.get(f"feed:{x}").allow()]
 
         # fetch videos from all configured YT channels
         sem = asyncio.Semaphore(self.module_config.threads)
 
         async def coro(_channel_id):
             async with sem:
-                return await Fetcher.fetch_videos(_channel_id, amount)
+                breaker = Fetcher.feed_breakers.get(f"feed:{_channel_id}")
+                try:  # endpoint breakers raise 'CircuitOpen', which doesn't count against the channel
+                    return await breaker.call(fetch_videos, _channel_id, amount)
+                except FAILURES + (CircuitOpen,):  # one failing channel doesn't stop others
+                    return None
 
         # fetch videos
         result = await asyncio.gather(*[coro(x) for x in channel_ids])
 
         # create a dictionary with channel id pointing to list of fetched videos
-        channel_dict = {cid: videos for cid, videos in zip(channel_ids, result)}
+        channel_dict = {cid: videos for cid, videos in zip(channel_ids, result) if videos is not None}
 
         # return channel dict
         return channel_dict
 
+    async def update_seen_videos(self, channels_videos: dict[str, list[Media]]) -> dict[str, list[Media]]:
+        """
+        Marks fetched videos as seen, and returns the ones that weren't seen before.
+        Channels that were never seen before only get marked, so old videos are not announced
+        :param channels_videos: dict of channel_id -> list of fetched videos
+        :return: dict of channel_id -> list of new videos
+        """
+
+        current_timestamp = int(datetime.now().timestamp())
+
+        new_videos = dict()
+        rows = []
+        for channel_id, videos in channels_videos.items():
+            # new channel, nothing to compare against
+            if channel_id not in self.seen_videos:
+                seen = self.seen_videos[channel_id] = set()
+                new_videos[channel_id] = []
+            else:
+                seen = self.seen_videos[channel_id]
+
+                # don't check last new video to prevent old videos to be considered new (ex. deleted video)
+                checked = videos[:-self.module_config.checking_window_offset]
+                new_videos[channel_id] = [video for video in checked if video.id not in seen]
+
+            # mark as seen; videos that are still in the window get their timestamp refreshed
+            for video in videos:
+                seen.add(video.id)
+                rows.append((channel_id, video.id, current_timestamp))
+
+        # write to database
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+            await cur.executemany("""
+                INSERT INTO SeenVideos (ChannelId, VideoId, LastSeen) VALUES (?, ?, ?)
+                ON CONFLICT (ChannelId, VideoId) DO UPDATE SET LastSeen = excluded.LastSeen""", rows)
+        await self.db.commit()
+
+        return new_videos
+
+    @tasks.loop(hours=6)
+    async def prune_seen_videos(self) -> None:
+        """
+        Removes videos that were not seen for 'seen_retention' seconds
+        """
+
+        current_timestamp = int(datetime.now().timestamp())
+        async with self.db.cursor() as cur:
+            cur: aiosqlite.Cursor  # help with type hinting
+
+            # fetch outdated videos
+            query = await cur.execute(
+                "SELECT ChannelId, VideoId FROM SeenVideos WHERE ? - LastSeen >= ?",
+                (current_timestamp, self.module_config.seen_retention))
+            outdated = await query.fetchall()
+
+            # skip if there's nothing to prune
+            if len(outdated) == 0:
+                return
+
+            # remove them
+            for channel_id, video_id in outdated:
+                self.seen_videos.get(channel_id, set()).discard(video_id)
+            await cur.executemany("DELETE FROM SeenVideos WHERE ChannelId = ? AND VideoId = ?", outdated)
+
+        # commit changes
+        await self.db.commit()
+        self.logger.info(f"Pruned {len(outdated)} seen videos")
+
     @tasks.loop(minutes=1)
     async def check(self) -> None:
         """
@@ -112,43 +276,217 @@ class YouTubeNotifsModule(commands.Cog):
         """
 
         # new channels dictionary
+        new_channels = await self.retrieve_channel_videos()
+
+        # find new videos once per YT channel
+        new_videos = await self.update_seen_videos(new_channels)
+
+        # fetch stream and duration information for new videos
+        await self.enrich_videos([video for videos in new_videos.values() for video in videos])
+
+        # notify subscribed guilds
+        current_timestamp = int(datetime.now().timestamp())
+        digest_rows = []
+        for channel_id, videos in new_videos.items():
+            for new_video in videos:
+                video_type = self.return_video_type(new_video)
+                for guild_config in self.subscriptions[channel_id]:
+                    # skip shorts if guild filters them out
+                    if video_type == "short" and guild_config.get("filter_shorts", False):
+                        continue
+
+                    # guilds with digest mode get videos announced together
+                    if guild_config.get("digest") is not None:
+                        digest = self.digests.setdefault(
+                            guild_config.notifications_channel_id, Digest(guild_config, current_timestamp))
+                        digest.videos.append((new_video, video_type))
+                        digest_rows.append((
+                            guild_config.notifications_channel_id, new_video.id, video_type,
+                            json.dumps(new_video.to_dict()), digest.created_at))
+                        continue
+
+                    # streams are announced with their own role and (optionally) format
+                    if new_video.is_stream:
+                        role_ping = f"<@&{guild_config.stream_role_id}>"
+                        format_config = guild_config.get("stream_format", guild_config.format)
+                    else:
+                        role_ping = f"<@&{guild_config.video_role_id}>"
+                        format_config = guild_config.format
+
+                    notification_channel = self.client.get_channel(guild_config.notifications_channel_id)
+                    await make_announcement(
+                        channel=notification_channel,
+                        config=format_config,
+                        keywords=self.return_video_keywords(new_video, video_type, role_ping))
+
+        # save pending digests, as their videos are already marked as seen
+        if len(digest_rows) > 0:
+            async with self.db.cursor() as cur:
+                cur: aiosqlite.Cursor  # help with type hinting
+                await cur.executemany("""
+                    INSERT OR REPLACE INTO PendingDigests
+                    (NotificationsChannelId, VideoId, VideoType, Video, CreatedAt) VALUES (?, ?, ?, ?, ?)""",
+                    digest_rows)
+            await self.db.commit()
+
+        # send digests, which coalescing window has passed
+        await self.send_digests(current_timestamp)
+
+    async def send_digests(self, current_timestamp: int) -> None:
+        """
+        Sends pending digests, that were collected for at least 'digest.window' seconds.
+        Every digest is rendered once, and sent as one message
+        :param current_timestamp: current timestamp
+        """
+
+        for notifications_channel_id, digest in list(self.digests.items()):
+            config = digest.guild_config.digest
+            if current_timestamp - digest.created_at < config.get("window", 0):
+                continue
+            del self.digests[notifications_channel_id]
+
+            await self.send_digest(notifications_channel_id, digest)
+
+            # sent; forget saved digest
+            async with self.db.cursor() as cur:
+                cur: aiosqlite.Cursor  # help with type hinting
+                await cur.execute(
+                    "DELETE FROM PendingDigests WHERE NotificationsChannelId = ?", (notifications_channel_id,))
+            await self.db.commit()
+
+    async def send_digest(self, notifications_channel_id: int, digest: Digest) -> None:
+        """
+        Renders and sends one digest
+        :param notifications_channel_id: notifications channel id
+        :param digest: digest
+        """
+
+        config = digest.guild_config.digest
+        notification_channel = self.client.get_channel(notifications_channel_id)
+
+        # single video is announced as usual
+        if len(digest.videos) == 1:
+            video, video_type = digest.videos[0]
+            role_id = digest.guild_config.stream_role_id if video.is_stream else digest.guild_config.video_role_id
+            format_config = digest.guild_config.format
+            if video.is_stream:
+                format_config = digest.guild_config.get("stream_format", format_config)
+            await make_announcement(
+                channel=notification_channel,
+                config=format_config,
+                keywords=self.return_video_keywords(video, video_type, f"<@&{role_id}>"))
+            return
+
+        # mention video role, and stream role if there are streams
+        roles = [digest.guild_config.video_role_id]
+        if any(video.is_stream for video, _ in digest.videos):
+            roles.append(digest.guild_config.stream_role_id)
+        role_ping = " ".join(f"<@&{role_id}>" for role_id in dict.fromkeys(roles))
+
+        # render
+        entries = [
+            self.return_video_keywords(video, video_type, role_ping) for video, video_type in digest.videos]
+        keywords = {"role_mention": role_ping, "count": len(entries)}
+        text = config.get("text", "{role_mention}").format(**keywords)
+        embed = make_digest_embed(config, entries, keywords)
+
+        # send
+        message_context = await notification_channel.send(content=text, embed=embed)
+        if notification_channel.is_news():
+            await message_context.publish()
+
+    async def enrich_videos(self, videos: list[Media]) -> None:
+        """
+        Fetches details for given videos in batches, and updates them
+        :param videos: list of videos
+        """
+
+        # skip if there's nothing to enrich
+        if len(videos) == 0:
+            return
+
         try:
-            new_channels = await self.retrieve_channel_videos()
-        except NotImplementedError:  # in case of error
+            details = await Fetcher.fetch_videos_details([video.id for video in videos])
+        except FAILURES + (CircuitOpen,):  # in case of error, videos are announced as regular ones
+            self.logger.warning("Failed to fetch video details")
             return
 
-        # check every guild
-        for guild_config in self.guild_config:
-            notification_channel = self.client.get_channel(guild_config.notifications_channel_id)
-            video_role_ping = f"<@&{guild_config.video_role_id}>"
-            # stream_role_ping = f"<@&{guild_config['stream_role_id']}>"  # unused
+        for video in videos:
+            if video.id in details:
+                video.enrich(details[video.id])
 
-            # check every YT channel
-            for channel_id in guild_config.channels:
-                # check every new video against old videos
-                # don't check last new video to prevent old videos to be considered new (ex. deleted video)
-                for new_video in new_channels[channel_id][:-self.module_config.checking_window_offset]:
-                    # if new video is not in old videos, then make an announcement
-                    if new_video not in self.channels_videos[channel_id]:
-                        keywords = self.return_keywords_dict(
-                            role_mention=video_role_ping,
-                            channel_name=self.channels[channel_id].title,
-                            channel_url=f"https://www.youtube.com/{self.channels[channel_id].custom_url}",
-                            channel_thumbnail_url=self.channels[channel_id].thumbnails.high.url,
-                            channel_country=self.channels[channel_id].country,
-                            video_url=new_video.url,
-                            video_title=new_video.title,
-                            video_description=new_video.description,
-                            video_thumbnail_url=new_video.thumbnails.high.url,
-                            video_publish_date=new_video.published_at.__str__())
-
-                        await make_announcement(
-                            channel=notification_channel,
-                            config=guild_config.format,
-                            keywords=keywords)
-
-        # reassign new_channels to self.channels
-        self.channels_videos = new_channels
+    def return_video_type(self, video: Media) -> str:
+        """
+        Returns type of the video
+        :param video: video
+        :return: 'live', 'upcoming', 'stream' (finished), 'short' or 'video'
+        """
+
+        if video.is_stream:
+            return video.live_status if video.live_status != "none" else "stream"
+        if video.duration is not None and video.duration.total_seconds() <= self.module_config.shorts_max_duration:
+            return "short"
+        return "video"
+
+    @app_commands.command(name="youtubenotifs-status", description="shows youtube API usage")
+    async def status_command(
+            self,
+            interaction: discord.Interaction
+    ) -> None:
+        """
+        Shows API key usage and failing feeds. Can only be used by owner of the bot
+        """
+
+        # check bot ownership
+        await check_bot_ownership(self.client, interaction)
+
+        # make embed
+        embed = discord.Embed(
+            title="YouTubeNotifs status",
+            color=discord.Color.from_str("#ff0000"))
+        embed.add_field(
+            name="Tracked channels",
+            value=f"{len(self.subscriptions)}",
+            inline=False)
+        embed.add_field(
+            name="API keys",
+            value="\n".join(
+                f"#{i}: {x['used']} used, {x['remaining']} remaining" + (" (exhausted)" if x["exhausted"] else "")
+                for i, x in enumerate(Fetcher.key_pool.usage())) or "none",
+            inline=False)
+
+        # breakers that are not closed
+        unhealthy = Fetcher.endpoint_breakers.unhealthy() + Fetcher.feed_breakers.unhealthy()
+        embed.add_field(
+            name="Failing endpoints and feeds",
+            value="\n".join(
+                f"{x['name']}: {x['state']}, retry in {x['retry_in']}s" for x in unhealthy[:20]) or "none",
+            inline=False)
+
+        # send response
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    def return_video_keywords(self, video: Media, video_type: str, role_mention: str) -> dict:
+        """
+        Returns a dict with filled keywords for given video
+        :param video: video
+        :param video_type: type of the video
+        :param role_mention: role that will be mentioned
+        :return: keywords dict
+        """
+
+        return self.return_keywords_dict(
+            role_mention=role_mention,
+            channel_name=video.channel.title,
+            channel_url=f"https://www.youtube.com/{video.channel.custom_url}",
+            channel_thumbnail_url=video.channel.thumbnails.high.url,
+            channel_country=video.channel.country,
+            video_url=video.url,
+            video_title=video.title,
+            video_description=video.description,
+            video_thumbnail_url=video.thumbnails.high.url,
+            video_publish_date=video.published_at.__str__(),
+            video_type=video_type)
 
     @staticmethod
     def return_keywords_dict(
@@ -161,7 +499,8 @@ class YouTubeNotifsModule(commands.Cog):
             video_title: str,
             video_description: str,
             video_thumbnail_url: str,
-            video_publish_date: str
+            video_publish_date: str,
+            video_type: str
     ) -> dict:
         """
         Returns a dict with filled keywords.
@@ -178,7 +517,8 @@ class YouTubeNotifsModule(commands.Cog):
             "video_title": video_title,
             "video_description": f"{video_description[:60]}..." if video_description is not None else None,
             "video_thumbnail_url": video_thumbnail_url,
-            "video_publish_date": video_publish_date}
+            "video_publish_date": video_publish_date,
+            "video_type": video_type}
 
 
 async def setup(client: commands.Bot) -> None:
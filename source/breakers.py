@@ -0,0 +1,178 @@
+"""
+Circuit breakers for external APIs.
+Used by fetchers to stop hammering failing endpoints and feeds
+"""
+
+
+import time
+import random
+import asyncio
+import aiohttp
+import logging
+from typing import Any, Callable, Awaitable
+
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+
+class FetchError(Exception):
+    """
+    Raised when API responds with an error
+    """
+
+    def __init__(self, status: int, message: str = ""):
+        super().__init__(f"API responded with status {status}" + (f"; {message}" if message else ""))
+        self.status: int = status
+
+
+class CircuitOpen(Exception):
+    """
+    Raised when a call is made while the circuit breaker is open
+    """
+
+
+# errors that count as failures
+FAILURES: tuple[type[Exception], ...] = (FetchError, aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker with exponential backoff and jitter.
+    After 'failure_threshold' consecutive failures, calls are rejected for a backoff delay.
+    After the delay calls are let through again (half-open); the next failure opens the breaker
+    with doubled delay, and the next success closes it
+    """
+
+    def __init__(
+            self,
+            name: str,
+            failure_threshold: int = 3,
+            base_delay: float = 30,
+            max_delay: float = 3600,
+            client_errors: bool = True,
+            ignored: tuple[type[Exception], ...] = ()):
+        """
+        :param name: breaker name
+        :param failure_threshold: consecutive failures before opening
+        :param base_delay: first backoff delay in seconds
+        :param max_delay: maximum backoff delay in seconds
+        :param client_errors: if False, only server errors (5xx, 429) and network errors count as failures
+        :param ignored: errors that are passed through without counting as failures or successes
+        """
+
+        self.name: str = name
+        self.failure_threshold: int = failure_threshold
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.client_errors: bool = client_errors
+        self.ignored: tuple[type[Exception], ...] = ignored
+
+        self.failures: int = 0
+        self.opened_until: float = 0
+        self.last_error: str | None = None
+
+    @property
+    def is_closed(self) -> bool:
+        return self.failures < self.failure_threshold
+
+    def allow(self) -> bool:
+        """
+        :return: True if a call can be made
+        """
+
+        return self.is_closed or time.monotonic() >= self.opened_until
+
+    def record_success(self) -> None:
+        """
+        Closes the breaker
+        """
+
+        if not self.is_closed:
+            LOGGER.info(f"Circuit '{self.name}' closed")
+
+        self.failures = 0
+        self.last_error = None
+
+    def record_failure(self, error: Exception) -> None:
+        """
+        Counts the failure, and opens the breaker if threshold is reached
+        :param error: error that happened
+        """
+
+        self.failures += 1
+        self.last_error = f"{type(error).__name__}: {error}"
+
+        if not self.is_closed:
+            # exponential backoff with equal jitter
+            delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - self.failure_threshold))
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            self.opened_until = time.monotonic() + delay
+
+            LOGGER.warning(f"Circuit '{self.name}' open for {delay:.0f} seconds; {self.last_error}")
+
+    async def call(self, coroutine_function: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Calls coroutine function through the breaker
+        :return: coroutine result
+        """
+
+        if not self.allow():
+            raise CircuitOpen(self.name)
+
+        try:
+            result = await coroutine_function(*args, **kwargs)
+        except FAILURES as e:
+            if isinstance(e, self.ignored):
+                raise
+            if self.client_errors or not isinstance(e, FetchError) or e.status >= 500 or e.status == 429:
+                self.record_failure(e)
+            raise
+
+        self.record_success()
+        return result
+
+    def state(self) -> dict[str, Any]:
+        """
+        Returns breaker state
+        :return: dictionary with state
+        """
+
+        return {
+            "name": self.name,
+            "state": "closed" if self.is_closed else ("half-open" if self.allow() else "open"),
+            "failures": self.failures,
+            "retry_in": max(0, round(self.opened_until - time.monotonic())) if not self.is_closed else 0,
+            "last_error": self.last_error}
+
+
+class BreakerRegistry:
+    """
+    Collection of circuit breakers, created on demand
+    """
+
+    def __init__(self, **breaker_kwargs):
+        """
+        :param breaker_kwargs: arguments for created breakers
+        """
+
+        self.breaker_kwargs: dict[str, Any] = breaker_kwargs
+        self.breakers: dict[str, CircuitBreaker] = dict()
+
+    def get(self, name: str) -> CircuitBreaker:
+        """
+        Returns breaker by name, creating it if needed
+        :param name: breaker name (ex. 'endpoint:streams', 'feed:channel_id')
+        :return: circuit breaker
+        """
+
+        if name not in self.breakers:
+            self.breakers[name] = CircuitBreaker(name, **self.breaker_kwargs)
+        return self.breakers[name]
+
+    def unhealthy(self) -> list[dict[str, Any]]:
+        """
+        Returns states of breakers that are not closed
+        :return: list of breaker states
+        """
+
+        return [breaker.state() for breaker in self.breakers.values() if not breaker.is_closed]
@@ -28,6 +28,11 @@ class ModuleConfig:
         else:
             raise AttributeError
 
+    def get(self, item, default=None):
+        if item in self._config:
+            return getattr(self._config, item)
+        return default
+
 
 class GuildConfig:
     """
@@ -48,6 +53,11 @@ class GuildConfig:
         else:
             raise AttributeError
 
+    def get(self, item, default=None):
+        if item in self._config:
+            return getattr(self._config, item)
+        return default
+
 
 class GuildConfigCollection:
     """
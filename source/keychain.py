@@ -17,6 +17,10 @@ class KeyChain:
     Manages API Keys
     """
 
+    # "file_name": ["KEY_NAME", ...]
+    # names of successfully fetched keys, grouped by '.keys' file they were listed in
+    key_files: dict[str, list[str]] = {}
+
     @classmethod
     def update_keychain(cls):
         """
@@ -31,6 +35,7 @@ class KeyChain:
             # get keys
             with open(filepath, "r", encoding="utf-8") as f:
                 keys = cls._return_file_keys(f)
+            fetched_keys = cls.key_files[os.path.splitext(file)[0]] = []
 
             # try making mapping
             for key in keys:
@@ -44,10 +49,21 @@ class KeyChain:
 
                 # set the attribute
                 setattr(cls, key, env)
+                fetched_keys.append(key)
 
         # log info
         LOGGER.info("KeyChain updated")
 
+    @classmethod
+    def get_file_keys(cls, file_name: str) -> list[str]:
+        """
+        Returns values of all keys listed in a '.keys' file
+        :param file_name: name of the file without extension (ex. 'youtubenotifs')
+        :return: list of key values
+        """
+
+        return [getattr(cls, key) for key in cls.key_files.get(file_name, [])]
+
     @staticmethod
     def _return_file_keys(file: TextIO) -> list[str]:
         """
@@ -59,6 +75,10 @@ class KeyChain:
         # read keys
         keys = []
         for key in file.readlines():
+            # skip empty lines
+            if not key.strip():
+                continue
+
             # append key
             keys.append(key.strip())
 
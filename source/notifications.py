@@ -19,6 +19,31 @@ def format_string(string: str | None, *args, **kwargs) -> str | None:
     return string.format(*args, **kwargs)
 
 
+def make_subscription_index(
+        guild_configs: GuildConfigCollection,
+        normalize=None
+) -> dict[str, list[GuildConfig]]:
+    """
+    Makes an inverted index from feed (channel id, login, etc.) to guilds that are subscribed to it
+    :param guild_configs: per-guild configs, each containing a list of 'channels'
+    :param normalize: function to normalize feed names with (ex. str.lower)
+    :return: dict of feed -> list of subscribed guild configs
+    """
+
+    index = dict()
+    for guild_config in guild_configs:
+        for feed in guild_config.channels:
+            if normalize is not None:
+                feed = normalize(feed)
+
+            # skip duplicate entries in the same guild
+            subscribers = index.setdefault(feed, [])
+            if guild_config not in subscribers:
+                subscribers.append(guild_config)
+
+    return index
+
+
 async def make_announcement(
         channel: discord.TextChannel,
         config: GuildConfig,
@@ -60,6 +85,41 @@ async def make_announcement(
         await message_context.publish()
 
 
+def make_digest_embed(
+        config: GuildConfig,
+        entries: list[dict],
+        keywords: dict
+) -> discord.Embed:
+    """
+    Makes an embed, that lists multiple announcements as fields.
+    Entries that don't fit into embed limits are counted in the last field
+    :param config: digest formatting data ('title', 'color', 'field_name', 'field_value')
+    :param entries: keywords of every announced item
+    :param keywords: digest keywords (ex. 'count')
+    :return: embed
+    """
+
+    embed = discord.Embed(
+        title=format_string(config.get("title"), **keywords),
+        color=discord.Color.from_str(config.get("color", "#ffffff")))
+
+    # add fields, until embed limits are reached (25 fields, 6000 characters)
+    added = 0
+    for entry in entries:
+        name = format_string(config.get("field_name", "{channel_name}"), **entry)[:256]
+        value = format_string(config.get("field_value", "{video_url}"), **entry)[:1024]
+        if len(embed.fields) >= 24 or len(embed) + len(name) + len(value) > 5900:
+            break
+        embed.add_field(name=name, value=value, inline=False)
+        added += 1
+
+    # count the rest
+    if added < len(entries):
+        embed.add_field(name="...", value=f"and {len(entries) - added} more", inline=False)
+
+    return embed
+
+
 async def try_notify(user: discord.Member, embed: discord.Embed, logger: logging.Logger | None = None):
     """
     Try to notify user about something
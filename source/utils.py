@@ -3,11 +3,20 @@ Some random utility classes
 """
 
 
+import json
 import discord
 from discord import app_commands
 from discord.ext import commands
 
 
+# faster JSON decoder, if installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+
 async def is_bot_owner(client: commands.Bot, interaction: discord.Interaction) -> bool:
     """
     Checks if the interaction was called by bot owner